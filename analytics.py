@@ -0,0 +1,280 @@
+"""
+Relatórios do funil em cima das rollups mantidas por trigger no SQLite
+(ver db._init_rollups). Nenhuma consulta varre events: contagens saem de
+events_daily/stage_daily/stage_counts e o tempo desde o /start do
+histograma event_latency, sempre por índice. Num banco antigo o bot
+preenche as rollups com o histórico em segundo plano depois de subir;
+--rebuild faz o mesmo de uma vez, aqui.
+
+    python analytics.py                        # hoje
+    python analytics.py --day 2026-10-16 --days 7
+    python analytics.py --user 123456          # linha do tempo de um usuário
+    python analytics.py --rebuild              # recalcula as rollups do histórico
+
+Dias em YYYY-MM-DD, no fuso TZ_OFFSET_HOURS (o mesmo do bot).
+"""
+import argparse
+import json
+import sys
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+
+import db
+import funnel
+
+TZ = timezone(timedelta(hours=db.TZ_OFFSET_HOURS))
+
+# eventos cujo tempo desde o primeiro /start entra no relatório
+LATENCY_EVENTS = ("confirm_sim", "print_received", "print_approved")
+
+
+@dataclass
+class Durations:
+    n: int
+    p50: float | None
+    p90: float | None
+
+
+def today() -> str:
+    return datetime.now(TZ).strftime("%Y-%m-%d")
+
+
+def _shift(day: str, days: int) -> str:
+    return (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def _utc_bounds(day_from: str, day_to: str) -> tuple[str, str]:
+    """[00:00 de day_from, 00:00 do dia seguinte a day_to) local, em UTC."""
+    start = datetime.strptime(day_from, "%Y-%m-%d").replace(tzinfo=TZ)
+    end = datetime.strptime(day_to, "%Y-%m-%d").replace(tzinfo=TZ) + timedelta(days=1)
+    fmt = "%Y-%m-%d %H:%M:%S"
+    return start.astimezone(timezone.utc).strftime(fmt), end.astimezone(timezone.utc).strftime(fmt)
+
+
+def _percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def _stage_order(counts: dict[str, int]) -> dict[str, int]:
+    known = {s: counts[s] for s in funnel.STAGES if s in counts}
+    return {**known, **{s: n for s, n in counts.items() if s not in known}}
+
+
+def stage_totals() -> dict[str, int]:
+    """Quantos usuários estão em cada estágio agora."""
+    with db.get_conn() as conn:
+        rows = conn.execute("SELECT stage, n FROM stage_counts WHERE n > 0").fetchall()
+    return _stage_order({r[0]: r[1] for r in rows})
+
+
+def stages_reached(day_from: str, day_to: str | None = None) -> dict[str, int]:
+    """Quantos entraram em cada estágio no período."""
+    with db.get_conn() as conn:
+        rows = conn.execute(
+            "SELECT stage, sum(n) FROM stage_daily WHERE day BETWEEN ? AND ? GROUP BY stage",
+            (day_from, day_to or day_from),
+        ).fetchall()
+    return _stage_order({r[0]: r[1] for r in rows})
+
+
+def events_by_day(
+    day_from: str, day_to: str | None = None, events: list[str] | None = None
+) -> dict[str, dict[str, int]]:
+    sql = "SELECT day, event, n FROM events_daily WHERE day BETWEEN ? AND ?"
+    args: list = [day_from, day_to or day_from]
+    if events:
+        sql += f" AND event IN ({','.join('?' * len(events))})"
+        args += events
+    with db.get_conn() as conn:
+        rows = conn.execute(sql + " ORDER BY day", args).fetchall()
+    out: dict[str, dict[str, int]] = {}
+    for day, event, n in rows:
+        out.setdefault(day, {})[event] = n
+    return out
+
+
+def _bucket_percentile(counts: dict[int, int], total: int, p: float) -> float:
+    """Percentil aproximado: interpola dentro do bucket onde ele cai."""
+    edges = db.LATENCY_BUCKETS
+    rank = p / 100 * total
+    seen = 0
+    for bucket in sorted(counts):
+        n = counts[bucket]
+        if seen + n >= rank:
+            lo = edges[bucket - 1] if bucket > 0 else 0
+            hi = edges[bucket] if bucket < len(edges) else edges[-1] * 2
+            return lo + (hi - lo) * (rank - seen) / n
+        seen += n
+    return float(edges[-1])
+
+
+def latency_from_start(event: str, day_from: str, day_to: str | None = None) -> Durations:
+    """
+    Tempo do primeiro /start até a primeira vez em `event`, para quem
+    chegou em `event` no período. Sai do histograma (p50/p90 aproximados
+    dentro do bucket), então custa o mesmo com mil ou com milhões de eventos.
+    """
+    with db.get_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT bucket, sum(n) FROM event_latency
+            WHERE day BETWEEN ? AND ? AND event = ? GROUP BY bucket
+            """,
+            (day_from, day_to or day_from, event),
+        ).fetchall()
+    counts = {r[0]: r[1] for r in rows}
+    total = sum(counts.values())
+    if not total:
+        return Durations(0, None, None)
+    return Durations(total, _bucket_percentile(counts, total, 50), _bucket_percentile(counts, total, 90))
+
+
+def time_to(start_event: str, end_event: str, day_from: str, day_to: str | None = None) -> Durations:
+    """
+    Tempo exato da primeira vez em `start_event` até a primeira vez em
+    `end_event`, para quem chegou em `end_event` no período. Lê uma linha
+    por usuário: para pares fora do histograma ou períodos curtos.
+    """
+    lo, hi = _utc_bounds(day_from, day_to or day_from)
+    with db.get_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT (julianday(e.first_at) - julianday(s.first_at)) * 86400
+            FROM event_firsts e
+            JOIN event_firsts s ON s.telegram_id = e.telegram_id AND s.event = ?
+            WHERE e.event = ? AND e.first_at >= ? AND e.first_at < ?
+            """,
+            (start_event, end_event, lo, hi),
+        ).fetchall()
+    values = [r[0] for r in rows if r[0] is not None and r[0] >= 0]
+    return Durations(len(values), _percentile(values, 50), _percentile(values, 90))
+
+
+def events_since(event: str, seconds: float) -> int:
+    """Contagem crua numa janela curta (ex.: última hora), pelo índice (event, created_at)."""
+    since = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - seconds))
+    with db.get_conn() as conn:
+        return conn.execute(
+            "SELECT count(*) FROM events WHERE event = ? AND created_at >= ?", (event, since)
+        ).fetchone()[0]
+
+
+def user_timeline(telegram_id: int, limit: int = 100) -> list[tuple[str, str, str | None]]:
+    with db.get_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT created_at, event, meta FROM events
+            WHERE telegram_id = ? ORDER BY created_at LIMIT ?
+            """,
+            (telegram_id, limit),
+        ).fetchall()
+    return [(r[0], r[1], r[2]) for r in rows]
+
+
+def stuck(stage: str, older_than: float, limit: int = 100) -> list[int]:
+    """Usuários parados em `stage` há mais de `older_than` segundos."""
+    with db.get_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT telegram_id FROM users
+            WHERE stage = ? AND stage_at < ? ORDER BY stage_at LIMIT ?
+            """,
+            (stage, time.time() - older_than, limit),
+        ).fetchall()
+    return [r[0] for r in rows]
+
+
+def report(day_from: str, day_to: str | None = None) -> dict:
+    day_to = day_to or day_from
+    started = time.perf_counter()
+    reached = stages_reached(day_from, day_to)
+    conversion = {}
+    prev = None
+    for stage in funnel.STAGES:
+        if prev is not None and reached.get(prev):
+            conversion[stage] = reached.get(stage, 0) / reached[prev]
+        prev = stage
+    result = {
+        "from": day_from,
+        "to": day_to,
+        "stage_totals": stage_totals(),
+        "stages_reached": reached,
+        "conversion": conversion,
+        "events_by_day": events_by_day(day_from, day_to),
+        "from_start": {
+            event: asdict(latency_from_start(event, day_from, day_to)) for event in LATENCY_EVENTS
+        },
+    }
+    result["took_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def _fmt_seconds(value: float | None) -> str:
+    if value is None:
+        return "-"
+    if value < 120:
+        return f"{value:.0f}s"
+    if value < 7200:
+        return f"{value / 60:.1f}min"
+    return f"{value / 3600:.1f}h"
+
+
+def print_report(r: dict) -> None:
+    period = r["from"] if r["from"] == r["to"] else f"{r['from']} a {r['to']}"
+    print(f"Funil — {period}\n")
+    print(f"{'estágio':<15}{'agora':>9}{'entraram':>10}{'conversão':>11}")
+    stages = list(dict.fromkeys([*r["stage_totals"], *r["stages_reached"]]))
+    for stage in stages:
+        conv = r["conversion"].get(stage)
+        print(
+            f"{stage:<15}{r['stage_totals'].get(stage, 0):>9}"
+            f"{r['stages_reached'].get(stage, 0):>10}"
+            f"{(f'{conv:.0%}' if conv is not None else '-'):>11}"
+        )
+    print("\neventos por dia")
+    for day, counts in r["events_by_day"].items():
+        print(f"  {day}: " + ", ".join(f"{e}={n}" for e, n in sorted(counts.items())))
+    print("\ntempo desde o /start (p50 / p90, aprox.)")
+    for event, d in r["from_start"].items():
+        print(f"  {event:<20} n={d['n']:<8} {_fmt_seconds(d['p50'])} / {_fmt_seconds(d['p90'])}")
+    print(f"\nconsulta em {r['took_ms']:.1f}ms")
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Relatório do funil (SQLite)")
+    p.add_argument("--day", default=None, help="último dia do período (padrão: hoje)")
+    p.add_argument("--days", type=int, default=1, help="tamanho do período em dias")
+    p.add_argument("--user", type=int, default=None, help="linha do tempo de um usuário")
+    p.add_argument("--rebuild", action="store_true", help="recalcula as rollups do histórico")
+    p.add_argument("--json", action="store_true")
+    args = p.parse_args()
+
+    db.init_db()
+    if args.rebuild:
+        started = time.perf_counter()
+        db.rebuild_rollups()
+        print(f"rollups recalculadas em {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    elif db.rollups_pending():
+        print("⚠️ rollups ainda sendo preenchidas com o histórico pelo bot; números incompletos", file=sys.stderr)
+
+    if args.user is not None:
+        for created_at, event, meta in user_timeline(args.user):
+            print(f"{created_at}  {event}" + (f"  ({meta})" if meta else ""))
+        return
+
+    day_to = args.day or today()
+    result = report(_shift(day_to, -(max(1, args.days) - 1)), day_to)
+    if args.json:
+        json.dump(result, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
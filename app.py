@@ -1,13 +1,24 @@
+import boot  # primeiro import: o cronômetro do boot começa aqui
 import os
 import io
-import json
 import base64
 import logging
 import asyncio
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 
+import httpx
 from dotenv import load_dotenv
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputFile, Update
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputFile,
+    InputMediaVideo,
+    Update,
+)
+from telegram.error import BadRequest
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -17,12 +28,28 @@ from telegram.ext import (
     MessageHandler,
     filters,
     ChatJoinRequestHandler,
+    TypeHandler,
 )
-from telegram.request import HTTPXRequest
-import telegram
-from telegram.error import RetryAfter, TimedOut
-from openai import OpenAI
-from PIL import Image
+
+import db
+import download
+import funnel
+from joins import JoinQueue
+import prescreen
+import metrics
+from media import MediaRegistry, parse_admin_ids
+from pending import PendingPrints
+from ratelimit import LOW_PRIORITY, OutboundRateLimiter
+from retry import CircuitBreaker, RetryPolicy
+from scheduler import FollowupScheduler
+from sequencer import SequenceEngine
+from update_processor import PerChatUpdateProcessor
+from verdict_cache import VerdictCache, dhash
+import sharding
+import verdict
+import webhook
+
+boot.mark("imports")
 
 # ========= LOGGING =========
 logging.basicConfig(
@@ -43,10 +70,125 @@ BOT_USERNAME = (os.getenv("BOT_USERNAME") or "").lstrip("@")
 if not BOT_USERNAME:
     raise RuntimeError("❌ Defina BOT_USERNAME nas variáveis de ambiente (sem @).")
 
+# Bot API alternativa (Bot API local ou o servidor falso do loadtest.py)
+BOT_API_URL = os.getenv("BOT_API_URL", "").rstrip("/")
+# conexões HTTP simultâneas com a Bot API (o padrão do HTTPXRequest é 1)
+BOT_API_POOL_SIZE = int(os.getenv("BOT_API_POOL_SIZE", "64"))
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 if not OPENAI_API_KEY:
     log.warning("⚠️ OPENAI_API_KEY ausente — validação não funcionará.")
-client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+OPENAI_MAX_OUTPUT_TOKENS = int(os.getenv("OPENAI_MAX_OUTPUT_TOKENS", "120"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+_openai_client = None
+_openai_loading: asyncio.Future | None = None
+_OPENAI_WARMUP_RESPONSE = {
+    "id": "resp_warmup", "object": "response", "created_at": 0, "model": "gpt-4o",
+    "status": "completed", "parallel_tool_calls": False, "tool_choice": "auto", "tools": [],
+    "output": [{
+        "type": "message", "id": "msg_warmup", "status": "completed", "role": "assistant",
+        "content": [{"type": "output_text", "text": "{}", "annotations": []}],
+    }],
+}
+
+
+def _make_openai_client():
+    from openai import AsyncOpenAI
+    from openai._models import construct_type
+    from openai.types.responses import Response
+
+    client = AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT)
+    client.responses  # também é importado no primeiro acesso
+    # a primeira resposta monta os validadores do pydantic (~0.1s); monta aqui
+    construct_type(type_=Response, value=_OPENAI_WARMUP_RESPONSE)
+    return client
+
+
+async def openai_client():
+    """
+    Cliente criado no primeiro print: o boot não paga o import do openai,
+    e o import (mais de 1s) roda numa thread para não travar o loop.
+    """
+    global _openai_client, _openai_loading
+    if _openai_client is None:
+        if _openai_loading is None:
+            _openai_loading = asyncio.get_running_loop().run_in_executor(None, _make_openai_client)
+        try:
+            _openai_client = await _openai_loading
+        finally:
+            _openai_loading = None
+    return _openai_client
+
+
+# Fila de validação: N workers em paralelo, fila limitada (backpressure)
+VALIDATION_WORKERS = int(os.getenv("VALIDATION_WORKERS", "4"))
+VALIDATION_QUEUE_SIZE = int(os.getenv("VALIDATION_QUEUE_SIZE", "50"))
+
+# Modo sharded: o front define SHARD_COUNT/SHARD_INDEX em cada worker.
+# Os limites globais (envio, CPUs) são divididos entre os workers.
+SHARD_COUNT = max(1, db.SHARD_COUNT)
+IS_FIRST_SHARD = db.SHARD_INDEX == 0
+
+# Re-encode das imagens fora do event loop
+IMAGE_POOL_KIND = os.getenv("IMAGE_POOL_KIND", "process")  # process | thread
+IMAGE_POOL_WORKERS = int(
+    os.getenv("IMAGE_POOL_WORKERS", str(max(1, (os.cpu_count() or 2) // SHARD_COUNT)))
+)
+IMAGE_ENCODE_TIMEOUT = float(os.getenv("IMAGE_ENCODE_TIMEOUT_SECONDS", "20"))
+
+# Updates de chats diferentes em paralelo (mesmo chat continua em ordem)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+
+# Limites de envio do Telegram (~30 msg/s global, ~1 msg/s por chat).
+# O global vale para o bot inteiro: cada shard fica com a sua fatia.
+GLOBAL_MSGS_PER_SEC = float(os.getenv("GLOBAL_MSGS_PER_SEC", "25")) / SHARD_COUNT
+CHAT_MSGS_PER_SEC = float(os.getenv("CHAT_MSGS_PER_SEC", "1"))
+
+# Retentativas / circuit breaker da Bot API
+RETRY = RetryPolicy(
+    max_retry_after=float(os.getenv("MAX_RETRY_AFTER_SECONDS", "60")),
+    breaker=CircuitBreaker(
+        threshold=int(os.getenv("BREAKER_THRESHOLD", "10")),
+        window=float(os.getenv("BREAKER_WINDOW_SECONDS", "30")),
+        cooldown=float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30")),
+    ),
+)
+
+# Modo de recebimento: polling (padrão) ou webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # base pública, ex: https://meubot.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    # um secret gerado no boot mudaria a cada restart e derrubaria as
+    # outras instâncias atrás do mesmo endpoint
+    raise RuntimeError("❌ Defina WEBHOOK_SECRET (o mesmo em todas as instâncias) para BOT_MODE=webhook.")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# SHARDS > 1: um processo de frente distribui os chats entre N workers
+SHARDS = int(os.getenv("SHARDS", "1"))
+
+# Métricas Prometheus (/metrics). METRICS_PORT=0 desliga.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Orçamento do boot (import até o primeiro poll); 0 desliga o aviso
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET_SECONDS", "5"))
+
+# Download do print: limite de tamanho/pixels e menor foto ainda legível
+MAX_PRINT_BYTES = int(os.getenv("MAX_PRINT_BYTES", str(10 * 1024 * 1024)))
+MAX_PRINT_PIXELS = int(os.getenv("MAX_PRINT_PIXELS", str(25_000_000)))
+PRINT_MIN_LONG_SIDE = int(os.getenv("PRINT_MIN_LONG_SIDE", "1280"))
+
+# Pré-triagem local antes do gpt-4o (recusa selfie, meme, imagem lisa...)
+PRESCREEN_ENABLED = os.getenv("PRESCREEN_ENABLED", "1") == "1"
+
+# Cache de veredictos (reenvio do mesmo print não chama o gpt-4o de novo)
+VERDICT_CACHE_TTL = float(os.getenv("VERDICT_CACHE_TTL_SECONDS", str(6 * 3600)))
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", "5000"))
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "4"))
 
 # Validação
 MIN_VALUE = float(os.getenv("MIN_DEPOSIT_VALUE", "35"))
@@ -69,27 +211,17 @@ IMG1_URL = "https://gallery-r3de.s3.us-east-2.amazonaws.com/presente_da_marluce.
 IMG2_URL = "https://gallery-r3de.s3.us-east-2.amazonaws.com/presente_da_marluce_2.png"
 WHATSAPP_VIP_LINK = "https://chat.whatsapp.com/CPj6L57HPZK1MYE1f6WAre"
 
-# Cache JSON para file_ids
+# Registro de file_ids (SQLite, write-behind). O file_ids.json antigo só
+# é lido uma vez, para migrar.
 CACHE_PATH = os.path.join(os.path.dirname(__file__), "file_ids.json")
+FILE_IDS = MediaRegistry(legacy_json=CACHE_PATH)
 
+# Pré-aquecimento: sobe as mídias que faltarem nesse chat antes de atender
+MEDIA_STORAGE_CHAT_ID = os.getenv("MEDIA_STORAGE_CHAT_ID", "")
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "90"))
 
-def load_cache() -> dict:
-    try:
-        with open(CACHE_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-
-def save_cache(d: dict) -> None:
-    try:
-        with open(CACHE_PATH, "w", encoding="utf-8") as f:
-            json.dump(d, f)
-    except Exception as e:
-        log.warning("Não consegui salvar cache: %s", e)
-
-
-FILE_IDS = load_cache()
+# Só esses chats podem gravar slots de mídia (capture_audio/capture_video)
+ADMIN_CHAT_IDS = parse_admin_ids(os.getenv("ADMIN_CHAT_IDS", ""))
 
 # ======== CONSTS / estados ========
 CB_CONFIRM_SIM = "confirm_sim"
@@ -99,13 +231,33 @@ CB_VIP_EXPLICAR = "vip_explicar"
 CB_VIP_PRINT = "vip_print"
 CB_VIP_DEPOSITAR = "vip_depositar"
 
-WAIT_SECONDS = 60
-VIP_WAIT_SECONDS = 7 * 60
+PENDING_PRINT_TTL = float(os.getenv("PENDING_PRINT_TTL_HOURS", "24")) * 3600
+VIP_PENDING_PRINT = PendingPrints(PENDING_PRINT_TTL)  # chats aguardando print
 
-VIP_PENDING_PRINT: set[int] = set()  # chats aguardando print
+FOLLOWUP_BATCH_SIZE = int(os.getenv("FOLLOWUP_BATCH_SIZE", "200"))
+FOLLOWUPS = FollowupScheduler(FOLLOWUP_BATCH_SIZE)
+
+# Copy e delays dos follow-ups ficam em sequences.py, relido sem restart
+SEQUENCES_RELOAD_SECONDS = float(os.getenv("SEQUENCES_RELOAD_SECONDS", "5"))
+
+# Estágio de cada chat no funil; /start repetido não reenvia nada
+FUNNEL_RESTART_AFTER = float(os.getenv("FUNNEL_RESTART_HOURS", "24")) * 3600
+FUNNEL_CACHE_SIZE = int(os.getenv("FUNNEL_CACHE_SIZE", "100000"))
+FUNNEL_CACHE_TTL = float(os.getenv("FUNNEL_CACHE_TTL_SECONDS", "3600"))
+FUNNEL = funnel.Funnel(FUNNEL_RESTART_AFTER, FUNNEL_CACHE_SIZE, FUNNEL_CACHE_TTL)
+
+# Join requests: fila própria, DM e aprovação em workers separados
+JOIN_APPROVALS_PER_SEC = float(os.getenv("JOIN_APPROVALS_PER_SEC", "20")) / SHARD_COUNT
+JOIN_DMS_PER_SEC = float(os.getenv("JOIN_DMS_PER_SEC", "20")) / SHARD_COUNT
+JOIN_APPROVE_MAX_DELAY = float(os.getenv("JOIN_APPROVE_MAX_DELAY_SECONDS", "240"))
+JOINS = JoinQueue(JOIN_APPROVALS_PER_SEC, JOIN_DMS_PER_SEC, JOIN_APPROVE_MAX_DELAY)
+
+VERDICTS = VerdictCache(VERDICT_CACHE_TTL, VERDICT_CACHE_SIZE, PHASH_MAX_DISTANCE)
 
 AUDIO_FILE_LOCAL = "Audio.mp3"
 
+boot.mark("config")
+
 
 # ====== Botões ======
 def btn_criar_conta() -> InlineKeyboardMarkup:
@@ -173,22 +325,17 @@ def btn_liberar_presente() -> InlineKeyboardMarkup:
 
 
 # ====== Retry ======
-async def _retry_send(coro_factory, max_attempts: int = 2):
-    last = None
-    for _ in range(max_attempts):
-        try:
-            return await coro_factory()
-        except (RetryAfter, TimedOut) as e:
-            last = e
-            await asyncio.sleep(1)
-        except telegram.error.RetryAfter as e:
-            last = e
-            await asyncio.sleep(e.retry_after)
-        except Exception as e:
-            last = e
-            break
-    if last:
-        raise last
+async def _retry_send(
+    coro_factory,
+    method: str = "send_message",
+    low_priority: bool = False,
+):
+    """
+    Envia com a política de RETRY (retry_after, backoff com jitter,
+    orçamento por método e circuit breaker). Envios de baixa prioridade
+    são descartados enquanto a Bot API estiver degradada.
+    """
+    return await RETRY.run(coro_factory, method, low_priority)
 
 
 # ====== envio de foto via URL + cache de file_id ======
@@ -210,7 +357,8 @@ async def send_photo_from_url(
                     caption=caption,
                     parse_mode="Markdown",
                     reply_markup=reply_markup,
-                )
+                ),
+                method="send_photo",
             )
 
         msg = await _retry_send(
@@ -220,12 +368,12 @@ async def send_photo_from_url(
                 caption=caption,
                 parse_mode="Markdown",
                 reply_markup=reply_markup,
-            )
+            ),
+            method="send_photo",
         )
 
         if msg and msg.photo:
             FILE_IDS[file_id_key] = msg.photo[-1].file_id
-            save_cache(FILE_IDS)
         return msg
     except Exception as e:
         log.warning("Falha ao enviar foto: %s", e)
@@ -246,7 +394,8 @@ async def send_audio_fast(
                     chat_id=chat_id,
                     audio=fid_env,
                     caption=caption,
-                )
+                ),
+                method="send_audio",
             )
         except Exception as e:
             log.warning("%s falhou: %s", var_name, e)
@@ -259,11 +408,11 @@ async def send_audio_fast(
                     chat_id=chat_id,
                     audio=fid_cache,
                     caption=caption,
-                )
+                ),
+                method="send_audio",
             )
         except Exception as e:
             FILE_IDS.pop("audio", None)
-            save_cache(FILE_IDS)
 
     full = os.path.join(os.path.dirname(__file__), AUDIO_FILE_LOCAL)
     if os.path.exists(full) and os.path.getsize(full) > 0:
@@ -273,11 +422,11 @@ async def send_audio_fast(
                     chat_id=chat_id,
                     audio=InputFile(f, filename="Audio.mp3"),
                     caption=caption,
-                )
+                ),
+                method="send_audio",
             )
         if msg and msg.audio:
             FILE_IDS["audio"] = msg.audio.file_id
-            save_cache(FILE_IDS)
         return msg
 
 
@@ -289,7 +438,8 @@ async def send_video_by_slot(context, chat_id: int, slot: str):
         if fid:
             try:
                 return await _retry_send(
-                    lambda: context.bot.send_video(chat_id=chat_id, video=fid)
+                    lambda: context.bot.send_video(chat_id=chat_id, video=fid),
+                    method="send_video",
                 )
             except Exception as e:
                 log.warning("%s falhou: %s", name, e)
@@ -298,15 +448,62 @@ async def send_video_by_slot(context, chat_id: int, slot: str):
     if fid_cache:
         try:
             return await _retry_send(
-                lambda: context.bot.send_video(chat_id=chat_id, video=fid_cache)
+                lambda: context.bot.send_video(chat_id=chat_id, video=fid_cache),
+                method="send_video",
             )
         except Exception as e:
             FILE_IDS.pop(slot, None)
-            save_cache(FILE_IDS)
+
+
+VIDEO_SLOTS = ("video1", "video2", "video3")
+
+
+def resolve_video_ids() -> list[tuple[str, str]]:
+    """
+    (slot, file_id) dos vídeos do VIP, na ordem: env primeiro, depois cache.
+    """
+    out = []
+    for slot in VIDEO_SLOTS:
+        idx = slot.replace("video", "")
+        fid = (
+            os.getenv(f"FILE_ID_VIDEO{idx}")
+            or os.getenv(f"FILE_ID_VIDEO0{idx}")
+            or FILE_IDS.get(slot)
+        )
+        if fid:
+            out.append((slot, fid))
+    return out
+
+
+async def send_vip_videos(context, chat_id: int, videos: list[tuple[str, str]]):
+    """
+    Manda os vídeos como um álbum só (sendMediaGroup). Se o álbum falhar
+    (ex: file_id inválido), cai para o envio um a um por slot.
+    """
+    if len(videos) >= 2:
+        media = [InputMediaVideo(fid) for _, fid in videos]
+        try:
+            return await _retry_send(
+                lambda: context.bot.send_media_group(chat_id=chat_id, media=media),
+                method="send_media_group",
+            )
+        except Exception as e:
+            log.warning("Álbum de vídeos falhou, enviando um a um: %s", e)
+
+    for slot, _ in videos:
+        await send_video_by_slot(context, chat_id, slot)
 
 
 # ====== Captura ======
+def is_admin_chat(chat_id: int) -> bool:
+    return chat_id in ADMIN_CHAT_IDS
+
+
 async def capture_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # áudio/voz de usuário comum não mexe nos slots
+    if not is_admin_chat(update.effective_chat.id):
+        return
+
     msg = update.effective_message
     fid = (
         msg.audio.file_id
@@ -317,7 +514,6 @@ async def capture_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     FILE_IDS["audio"] = fid
-    save_cache(FILE_IDS)
     await _retry_send(
         lambda: context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -327,6 +523,9 @@ async def capture_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def capture_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_chat(update.effective_chat.id):
+        return
+
     msg = update.effective_message
 
     vid = (
@@ -348,7 +547,6 @@ async def capture_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for key in ("video1", "video2", "video3"):
         if not FILE_IDS.get(key):
             FILE_IDS[key] = fid
-            save_cache(FILE_IDS)
             await _retry_send(
                 lambda: context.bot.send_message(
                     chat_id=update.effective_chat.id,
@@ -365,42 +563,27 @@ async def capture_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-# ====== VIP follow-up ======
-def schedule_vip_followup(context, chat_id: int):
-    for job in context.application.job_queue.get_jobs_by_name(f"vip:{chat_id}"):
-        return
-
-    context.application.job_queue.run_once(
-        vip_followup_job,
-        when=VIP_WAIT_SECONDS,
-        data={"chat_id": chat_id},
-        name=f"vip:{chat_id}",
+# ====== Sequências (follow-ups) ======
+async def send_sequence_step(context, chat_id: int, payload: dict):
+    await _retry_send(
+        lambda: context.bot.send_message(
+            chat_id=chat_id, **payload, rate_limit_args=LOW_PRIORITY
+        ),
+        low_priority=True,
     )
 
 
-async def vip_followup_job(context: ContextTypes.DEFAULT_TYPE):
-    chat_id = context.job.data["chat_id"]
-    if chat_id not in VIP_PENDING_PRINT:
-        return
+SEQUENCES = SequenceEngine(FOLLOWUPS, FUNNEL, send_sequence_step)
 
-    txt = (
-        "Eii, tá por aí? Não sei se você esqueceu, mas são pelo menos R$500 sorteados "
-        "para 10 pessoas + 1 chance na roleta que pode te dar até um IPHONE 17 PRO HOJE!"
-    )
 
-    await _retry_send(
-        lambda: context.bot.send_message(
-            chat_id=chat_id,
-            text=txt,
-            parse_mode="Markdown",
-            reply_markup=btn_vip_print_deposito(),
-        )
-    )
+def schedule_vip_followup(context, chat_id: int):
+    SEQUENCES.start(chat_id, "vip")
 
 
 # ====== Funções VIP ======
 async def ask_vip_print(context, chat_id: int):
     VIP_PENDING_PRINT.add(chat_id)
+    FUNNEL.advance(chat_id, funnel.PENDING_PRINT)
 
     txt = (
         "Todas essas pessoas fizeram parte e ganharam um prêmio muito bom, "
@@ -422,80 +605,132 @@ async def ask_vip_print(context, chat_id: int):
 
 
 async def _vip_send_media_and_request(context, chat_id: int):
+    """
+    Áudio → álbum com os 3 vídeos → pedido do print: 3 envios em vez de 5,
+    um depois do outro (o chat tem que ver nessa sequência).
+    Se o chat já está aguardando o print (ou já foi aprovado), não reenvia.
+    """
+    if chat_id in VIP_PENDING_PRINT or FUNNEL.reached(chat_id, funnel.APPROVED):
+        metrics.FUNNEL_COALESCED.inc("vip_media")
+        return
+    FUNNEL.advance(chat_id, funnel.VIP)
     await send_audio_fast(
         context,
         chat_id,
         caption="🔊 Explicação rápida (1 min)",
         var_name="FILE_ID_AUDIO_VIP",
     )
-    await send_video_by_slot(context, chat_id, "video1")
-    await send_video_by_slot(context, chat_id, "video2")
-    await send_video_by_slot(context, chat_id, "video3")
+    await send_vip_videos(context, chat_id, resolve_video_ids())
     await ask_vip_print(context, chat_id)
 
 
 # ====== Validação OpenAI ======
-def _to_data_url(raw: bytes) -> str:
-    img = Image.open(io.BytesIO(raw))
+def _prepare_image(raw: bytes | memoryview) -> tuple[str | None, str, str]:
+    """
+    Decodifica o print uma vez só: devolve (data_url PNG, hash perceptual,
+    motivo). Se a pré-triagem recusar, data_url vem None com o motivo e
+    nem gasta o re-encode.
+    """
+    from PIL import Image  # carregado no worker do pool, no primeiro print
+
+    img = Image.open(download.MemoryReader(memoryview(raw)))
+    if img.width * img.height > MAX_PRINT_PIXELS:
+        raise download.TooLarge(img.size)
     if img.mode in ("P", "RGBA"):
         img = img.convert("RGB")
+    phash = dhash(img)
+
+    if PRESCREEN_ENABLED:
+        screening = prescreen.screen(img)
+        if not screening.ok:
+            return None, phash, screening.reason
 
     buf = io.BytesIO()
     img.save(buf, format="PNG", optimize=True)
     buf.seek(0)
     b64 = base64.b64encode(buf.read()).decode("utf-8")
-    return f"data:image/png;base64,{b64}"
+    return f"data:image/png;base64,{b64}", phash, ""
 
 
-async def validate_print_and_reply(
-    update: Update,
-    context: ContextTypes.DEFAULT_TYPE,
-    raw: bytes,
-):
-    chat_id = update.effective_chat.id
-    if chat_id not in VIP_PENDING_PRINT:
-        return
+_image_pool: Executor | None = None
 
-    if not client:
-        await _retry_send(
-            lambda: context.bot.send_message(
-                chat_id=chat_id,
-                text="✅ Print recebido! (Validação indisponível)",
+
+def _get_image_pool() -> Executor:
+    global _image_pool
+    if _image_pool is None:
+        workers = max(1, IMAGE_POOL_WORKERS)
+        if IMAGE_POOL_KIND == "thread":
+            _image_pool = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="img"
             )
-        )
-        VIP_PENDING_PRINT.discard(chat_id)
-        return
+        else:
+            _image_pool = ProcessPoolExecutor(max_workers=workers)
+    return _image_pool
 
-    data_url = _to_data_url(raw)
 
-    rules = (
-        "Considere APROVADO se status='Concluído', valor >= "
-        f"{MIN_VALUE:.2f} e a data do depósito é IGUAL a {today_str()}."
-    )
+def shutdown_image_pool():
+    global _image_pool
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=False, cancel_futures=True)
+        _image_pool = None
 
-    prompt = (
-        "Analise APENAS o item de Depósito que está expandido (seta para cima). "
-        "Extraia valor (número), data/hora (texto) e status. "
-        + rules
-        + " Responda curto em PT-BR:\n- Valor\n- Data/hora\n"
-          "- Resultado: Aprovado/Reprovado (explique motivo se reprovar)."
-    )
 
-    r = client.responses.create(
-        model="gpt-4o",
-        input=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "input_text", "text": prompt},
-                    {"type": "input_image", "image_url": data_url},
-                ],
-            }
-        ],
-        temperature=0,
-    )
+async def prepare_image(raw: bytes | memoryview) -> tuple[str | None, str, str]:
+    """
+    Roda o _prepare_image no pool (processos ou threads), com timeout.
+    No pool de threads o memoryview vai direto, sem cópia; para outro
+    processo precisa virar bytes: no modo process o download sem cópia
+    termina aqui, com uma cópia do print por validação.
+    """
+    loop = asyncio.get_running_loop()
+    if IMAGE_POOL_KIND != "thread" and isinstance(raw, memoryview):
+        raw = bytes(raw)
+    fut = loop.run_in_executor(_get_image_pool(), _prepare_image, raw)
+    return await asyncio.wait_for(fut, timeout=IMAGE_ENCODE_TIMEOUT)
+
+
+async def _ask_model(data_url: str) -> verdict.Receipt | None:
+    """
+    Pede ao gpt-4o só os campos do depósito, em JSON estrito. A decisão
+    (valor mínimo, data de hoje) fica no código, em verdict.evaluate.
+    """
+    client = await openai_client()
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        r = await client.responses.create(
+            model="gpt-4o",
+            input=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "input_text", "text": verdict.PROMPT},
+                        {"type": "input_image", "image_url": data_url},
+                    ],
+                }
+            ],
+            text=verdict.TEXT_FORMAT,
+            max_output_tokens=OPENAI_MAX_OUTPUT_TOKENS,
+            temperature=0,
+        )
+        outcome = "ok"
+    finally:
+        metrics.OPENAI_SECONDS.observe(time.perf_counter() - start, outcome)
 
-    text_resp = r.output_text.strip()
+    receipt = verdict.parse(r.output_text)
+    if receipt is None:
+        log.warning("Resposta fora do schema do gpt-4o: %r", r.output_text[:200])
+    return receipt
+
+
+async def reply_with_verdict(context, chat_id: int, receipt: verdict.Receipt | None):
+    await FUNNEL.load(chat_id)  # a validação pode ter saído bem depois do update
+    if receipt is None:
+        result = verdict.Verdict(False, ["não consegui ler o print"])
+        text_resp = "⚠️ Não consegui ler o print do depósito."
+    else:
+        result = verdict.evaluate(receipt, MIN_VALUE, today_str())
+        text_resp = verdict.render(receipt, result)
 
     await _retry_send(
         lambda: context.bot.send_message(
@@ -506,7 +741,9 @@ async def validate_print_and_reply(
 
     VIP_PENDING_PRINT.discard(chat_id)
 
-    if "aprovado" in text_resp.lower():
+    if result.approved:
+        db.log_event(chat_id, "print_approved")
+        FUNNEL.advance(chat_id, funnel.APPROVED)
         congrats = (
             "🎉 Parabéns! Você agora tem acesso à Comunidade VIP.\n\n"
             "Clique no botão abaixo para entrar."
@@ -521,6 +758,7 @@ async def validate_print_and_reply(
         )
         return
 
+    db.log_event(chat_id, "print_rejected")
     retry_msg = (
         "⚠️ Reprovado.\n"
         "Por favor, envie *novamente* o print do depósito com o item *expandido* "
@@ -542,6 +780,167 @@ async def validate_print_and_reply(
     schedule_vip_followup(context, chat_id)
 
 
+async def reply_from_cache(context, chat_id: int, file_unique_id: str) -> bool:
+    """
+    Se esse mesmo arquivo já foi validado hoje para esse chat, responde
+    direto do cache, sem baixar nada. Retorna True se respondeu.
+    """
+    if not OPENAI_API_KEY or chat_id not in VIP_PENDING_PRINT:
+        return False
+    if chat_id in _validating:
+        return False  # vai para a fila, atrás do print que está sendo validado
+    cached = VERDICTS.get_by_file(chat_id, file_unique_id, today_str())
+    if cached is None:
+        return False
+    log.info("Veredicto em cache (file_unique_id) para %s", chat_id)
+    db.log_event(chat_id, "print_received")  # como no enqueue_validation
+    await reply_with_verdict(context, chat_id, cached)
+    return True
+
+
+async def validate_print_and_reply(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    raw: bytes | memoryview,
+    file_unique_id: str | None = None,
+):
+    chat_id = update.effective_chat.id
+    if chat_id not in VIP_PENDING_PRINT:
+        return
+
+    if not OPENAI_API_KEY:
+        await _retry_send(
+            lambda: context.bot.send_message(
+                chat_id=chat_id,
+                text="✅ Print recebido! (Validação indisponível)",
+            )
+        )
+        VIP_PENDING_PRINT.discard(chat_id)
+        return
+
+    data_url, phash, reason = await prepare_image(raw)
+    day = today_str()
+
+    if data_url is None:
+        log.info("Pré-triagem recusou print de %s: %s", chat_id, reason)
+        metrics.PRESCREEN_REJECTS.inc(reason)
+        await _retry_send(
+            lambda: context.bot.send_message(
+                chat_id=chat_id,
+                text=(
+                    f"⚠️ Essa imagem não parece o print do depósito ({reason}).\n"
+                    "Me manda o *print da tela* da sua conta Betboom com o item de "
+                    "Depósito *expandido* (seta para cima). 📸"
+                ),
+                parse_mode="Markdown",
+            )
+        )
+        return
+
+    receipt = VERDICTS.get_by_hash(chat_id, phash, day)
+    if receipt is None:
+        receipt = await _ask_model(data_url)
+        # resposta ilegível não entra no cache: o reenvio tenta de novo
+        if receipt is not None:
+            VERDICTS.put(chat_id, day, receipt, file_unique_id=file_unique_id, phash=phash)
+    else:
+        log.info("Veredicto em cache (hash perceptual) para %s", chat_id)
+
+    await reply_with_verdict(context, chat_id, receipt)
+
+
+# ====== Fila de validação ======
+_validation_queue: asyncio.Queue | None = None
+_validation_tasks: list[asyncio.Task] = []
+# chat em validação -> prints do mesmo chat que chegaram enquanto isso.
+# Um chat é validado por um worker só, em ordem: dois prints seguidos
+# não disputam VERDICTS/VIP_PENDING_PRINT, e o outro worker não fica
+# parado esperando.
+_validating: dict[int, deque] = {}
+
+
+async def _validate_one(update, context, raw, file_unique_id):
+    chat_id = update.effective_chat.id
+    try:
+        await validate_print_and_reply(update, context, raw, file_unique_id)
+    except Exception as e:
+        log.exception("Falha ao validar print de %s: %s", chat_id, e)
+        try:
+            await _retry_send(
+                lambda: context.bot.send_message(
+                    chat_id=chat_id,
+                    text=(
+                        "⚠️ Não consegui validar seu print agora. "
+                        "Me envia de novo em alguns minutos, por favor. 📸"
+                    ),
+                )
+            )
+        except Exception:
+            pass
+
+
+async def _validation_worker():
+    while True:
+        job = await _validation_queue.get()
+        chat_id = job[0].effective_chat.id
+        later = _validating.get(chat_id)
+        if later is not None:
+            # outro worker está nesse chat: entra depois dele, que marca o task_done
+            later.append(job)
+            continue
+        _validating[chat_id] = later = deque([job])
+        try:
+            while later:
+                await _validate_one(*later.popleft())
+                _validation_queue.task_done()
+        finally:
+            del _validating[chat_id]
+
+
+async def enqueue_validation(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    raw: bytes | memoryview,
+    file_unique_id: str | None = None,
+):
+    """
+    Coloca o print na fila e retorna na hora, sem segurar o handler.
+    Se a fila estiver cheia, avisa o usuário para reenviar depois.
+    """
+    chat_id = update.effective_chat.id
+    if chat_id not in VIP_PENDING_PRINT:
+        return
+
+    db.log_event(chat_id, "print_received")
+    try:
+        _validation_queue.put_nowait((update, context, raw, file_unique_id))
+    except asyncio.QueueFull:
+        log.warning("Fila de validação cheia, print de %s recusado", chat_id)
+        await _retry_send(
+            lambda: context.bot.send_message(
+                chat_id=chat_id,
+                text=(
+                    "⏳ Estou validando muitos prints agora. "
+                    "Me envia de novo daqui a pouquinho, por favor."
+                ),
+            )
+        )
+
+
+def start_validation_workers():
+    global _validation_queue
+    _validation_queue = asyncio.Queue(maxsize=VALIDATION_QUEUE_SIZE)
+    for _ in range(VALIDATION_WORKERS):
+        _validation_tasks.append(asyncio.create_task(_validation_worker()))
+
+
+async def stop_validation_workers():
+    for task in _validation_tasks:
+        task.cancel()
+    await asyncio.gather(*_validation_tasks, return_exceptions=True)
+    _validation_tasks.clear()
+
+
 # ====== FUNIL INICIAL ======
 async def run_start_flow(
     context: ContextTypes.DEFAULT_TYPE,
@@ -575,33 +974,38 @@ async def run_start_flow(
             )
         )
 
-    # Daqui pra frente é "só áudio pra frente"
-    await send_audio_fast(
-        context,
-        chat_id,
-        caption="🔊 Mensagem rápida antes de continuar",
-        var_name="FILE_ID_AUDIO",
-    )
+    # Daqui pra frente é "só áudio pra frente". Cada passo só sai uma vez;
+    # se um falhou, o próximo /start retoma dele.
+    if not FUNNEL.reached(chat_id, funnel.AUDIO):
+        audio = await send_audio_fast(
+            context,
+            chat_id,
+            caption="🔊 Mensagem rápida antes de continuar",
+            var_name="FILE_ID_AUDIO",
+        )
+        if audio:
+            FUNNEL.advance(chat_id, funnel.AUDIO)
 
-    caption = (
-        "🎁 Presente da Marluce aguardando…\n\n"
-        "Clique no botão abaixo para abrir sua conta e garantir seu presente."
-    )
+    if not FUNNEL.reached(chat_id, funnel.IMG1):
+        caption = (
+            "🎁 Presente da Marluce aguardando…\n\n"
+            "Clique no botão abaixo para abrir sua conta e garantir seu presente."
+        )
 
-    await send_photo_from_url(
-        context,
-        chat_id,
-        "img1",
-        IMG1_URL,
-        caption,
-        btn_criar_conta(),
-    )
+        photo = await send_photo_from_url(
+            context,
+            chat_id,
+            "img1",
+            IMG1_URL,
+            caption,
+            btn_criar_conta(),
+        )
+        if not photo:
+            return
+        FUNNEL.advance(chat_id, funnel.IMG1)
 
-    context.application.job_queue.run_once(
-        send_followup_job,
-        when=WAIT_SECONDS,
-        data={"chat_id": chat_id},
-    )
+    if not FUNNEL.reached(chat_id, funnel.FOLLOWUP):
+        SEQUENCES.start(chat_id, "start")
 
 
 # ====== Handlers ======
@@ -614,6 +1018,19 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     args = context.args or []
     from_presente = len(args) > 0 and args[0] == "presente"
+    db.log_event(chat_id, "start", args[0] if args else None)
+
+    user = update.effective_user
+    if user:
+        db.submit(db.upsert_user, user.id, user.username, user.full_name, args[0] if args else None)
+
+    if FUNNEL.stale(chat_id):
+        FUNNEL.restart(chat_id)
+    elif FUNNEL.reached(chat_id, funnel.IMG1):
+        # já recebeu o início do funil: /start repetido não custa envio
+        metrics.FUNNEL_COALESCED.inc("start")
+        return
+    FUNNEL.advance(chat_id, funnel.START)
 
     # aqui você pode diferenciar o comportamento se quiser
     # por enquanto, sempre começa direto do áudio pra frente
@@ -627,23 +1044,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-async def send_followup_job(context: ContextTypes.DEFAULT_TYPE):
-    chat_id = context.job.data["chat_id"]
-    await _retry_send(
-        lambda: context.bot.send_message(
-            chat_id=chat_id,
-            text="Eae, já conseguiu finalizar a criação da sua conta?",
-            reply_markup=InlineKeyboardMarkup(
-                [[InlineKeyboardButton("✅ SIM", callback_data=CB_CONFIRM_SIM)]]
-            ),
-        )
-    )
-
-
 async def confirm_sim(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     chat_id = q.message.chat_id
+    if FUNNEL.reached(chat_id, funnel.CONFIRMED):
+        metrics.FUNNEL_COALESCED.inc("confirm_sim")
+        return
+    db.log_event(chat_id, "confirm_sim")
 
     texto_final = (
         "🎁 Presente Liberado!!!\n\n"
@@ -651,20 +1059,25 @@ async def confirm_sim(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "e fica de olho que o resultado sai na live de HOJE."
     )
 
-    await send_photo_from_url(
+    if await send_photo_from_url(
         context,
         chat_id,
         "img2",
         IMG2_URL,
         texto_final,
         btn_comunidade_e_vip(),
-    )
+    ):
+        FUNNEL.advance(chat_id, funnel.CONFIRMED)
 
 
 async def acessar_vip(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     chat_id = q.message.chat_id
+    if FUNNEL.reached(chat_id, funnel.VIP):
+        metrics.FUNNEL_COALESCED.inc("vip_open")
+        return
+    db.log_event(chat_id, "vip_open")
 
     first = q.from_user.first_name or "amigo"
     intro = (
@@ -681,17 +1094,20 @@ async def acessar_vip(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=btn_vip_primeira_escolha(),
         )
     )
+    FUNNEL.advance(chat_id, funnel.VIP)
 
 
 async def vip_quero_garantir(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
+    db.log_event(q.message.chat_id, "vip_media", q.data)
     await _vip_send_media_and_request(context, q.message.chat_id)
 
 
 async def vip_me_explica(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
+    db.log_event(q.message.chat_id, "vip_media", q.data)
     await _vip_send_media_and_request(context, q.message.chat_id)
 
 
@@ -722,11 +1138,67 @@ async def vip_btn_depositar(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # Recebe print
+_http: httpx.AsyncClient | None = None
+
+
+def _get_http() -> httpx.AsyncClient:
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(timeout=30.0)
+    return _http
+
+
+async def download_print(
+    context, chat_id: int, file_id: str, file_size: int | None, pixels: int | None = None
+):
+    """
+    Baixa o print com limite de MAX_PRINT_BYTES, direto num buffer
+    pré-alocado. Devolve um memoryview, ou None se recusou (já avisando).
+    Tamanho em bytes e em pixels (quando o Telegram informa) são conferidos
+    antes de baixar qualquer coisa.
+    """
+    try:
+        if file_size and file_size > MAX_PRINT_BYTES:
+            raise download.TooLarge(f"{file_size} bytes")
+        if pixels and pixels > MAX_PRINT_PIXELS:
+            raise download.TooLarge(f"{pixels} pixels")
+        f = await context.bot.get_file(file_id)
+        if f.file_path and f.file_path.startswith("http"):
+            return await download.stream_to_buffer(
+                _get_http(), f.file_path, MAX_PRINT_BYTES, f.file_size or file_size
+            )
+        # Bot API local: file_path é um caminho no disco
+        return memoryview(await f.download_as_bytearray())
+    except download.TooLarge as e:
+        log.info("Print grande demais de %s (%s)", chat_id, e)
+        await _retry_send(
+            lambda: context.bot.send_message(
+                chat_id=chat_id,
+                text=(
+                    "⚠️ Esse arquivo é grande demais. "
+                    "Me manda só o *print da tela* (screenshot), por favor. 📸"
+                ),
+                parse_mode="Markdown",
+            )
+        )
+        return None
+
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    photo = update.message.photo[-1]
-    f = await context.bot.get_file(photo.file_id)
-    ba = await f.download_as_bytearray()
-    await validate_print_and_reply(update, context, bytes(ba))
+    chat_id = update.effective_chat.id
+    if chat_id not in VIP_PENDING_PRINT:
+        return
+
+    photo = download.pick_photo_size(update.message.photo, PRINT_MIN_LONG_SIDE)
+    if await reply_from_cache(context, chat_id, photo.file_unique_id):
+        return
+
+    raw = await download_print(
+        context, chat_id, photo.file_id, photo.file_size, photo.width * photo.height
+    )
+    if raw is None:
+        return
+    await enqueue_validation(update, context, raw, photo.file_unique_id)
 
 
 async def handle_image_doc(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -734,54 +1206,169 @@ async def handle_image_doc(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not doc or not (doc.mime_type or "").startswith("image/"):
         return
 
-    f = await context.bot.get_file(doc.file_id)
-    ba = await f.download_as_bytearray()
-    await validate_print_and_reply(update, context, bytes(ba))
+    chat_id = update.effective_chat.id
+    if chat_id not in VIP_PENDING_PRINT:
+        return
+    if await reply_from_cache(context, chat_id, doc.file_unique_id):
+        return
+
+    raw = await download_print(context, chat_id, doc.file_id, doc.file_size)
+    if raw is None:
+        return
+    await enqueue_validation(update, context, raw, doc.file_unique_id)
+
+
+async def load_funnel_stage(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat = update.effective_chat
+    if chat is not None and chat.type == "private":
+        await FUNNEL.load(chat.id)
 
 
 # ====== QUANDO USA REQUEST TO JOIN NO CANAL ======
 async def on_join_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Quando o cliente entrar no grupo (join request aprovado),
-    manda mensagem + botão 'Liberar presente' no PV.
+    Pedido para entrar no canal: só registra e enfileira. A DM com o botão
+    'Liberar presente' e a aprovação saem pelos workers do JOINS.
     """
     req = update.chat_join_request
     if not req:
         return
 
     user = req.from_user
-    user_chat_id = req.user_chat_id
-
     log.info("Join request de %s para chat %s", user.id, req.chat.id)
+    db.log_event(user.id, "join_request", str(req.chat.id))
 
-    if not user_chat_id:
+    if not req.user_chat_id:
         log.warning("Join request sem user_chat_id para %s", user.id)
-        return
+    if not JOINS.add(user.id, req.chat.id, req.user_chat_id or 0, user.first_name):
+        log.info("Join request repetido de %s para %s, ignorado", user.id, req.chat.id)
+
 
-    first = user.first_name or ""
+async def send_join_welcome(bot, req):
+    if not req.user_chat_id:
+        return
 
     texto = (
-        f"Falaaa {first}, tá por aí? 👋\n\n"
+        f"Falaaa {req.first_name or ''}, tá por aí? 👋\n\n"
         "Agora você está na COMUNIDADE DA MALU 🤩\n\n"
         "Aqui você tem chance de ganhar todo dia.\n\n"
         "Vou te mandar um áudio rápido e depois o botão pra você garantir "
         "seu presente de hoje 👇"
     )
 
-    # Manda no PV do usuário essa mensagem + botão liberar presente (deep-link)
+    # Manda no PV do usuário essa mensagem + botão liberar presente (deep-link).
+    # Fila de baixa prioridade: quem já está conversando com o bot vem antes.
     await _retry_send(
-        lambda: context.bot.send_message(
-            chat_id=user_chat_id,
+        lambda: bot.send_message(
+            chat_id=req.user_chat_id,
             text=texto,
             reply_markup=btn_liberar_presente(),
+            rate_limit_args=LOW_PRIORITY,
         )
     )
 
-    # aprova a entrada no canal
+
+async def approve_join(bot, req):
+    await _retry_send(
+        lambda: bot.approve_chat_join_request(chat_id=req.chat_id, user_id=req.user_id),
+        method="approve_chat_join_request",
+    )
+
+
+# ====== Pré-aquecimento de mídia ======
+async def _file_id_ok(bot, fid: str) -> bool:
     try:
-        await req.approve()
+        await bot.get_file(fid)
+        return True
+    except BadRequest as e:
+        # > 20 MB o get_file recusa, mas o file_id existe
+        return "too big" in str(e).lower()
     except Exception as e:
-        log.warning("Erro ao aprovar join request: %s", e)
+        log.warning("Não deu para validar file_id agora (%s); mantendo.", e)
+        return True
+
+
+async def _upload_photo(bot, url: str) -> str | None:
+    msg = await _retry_send(
+        lambda: bot.send_photo(
+            chat_id=MEDIA_STORAGE_CHAT_ID, photo=url, disable_notification=True
+        ),
+        method="send_photo",
+    )
+    return msg.photo[-1].file_id if msg and msg.photo else None
+
+
+async def _upload_audio(bot) -> str | None:
+    full = os.path.join(os.path.dirname(__file__), AUDIO_FILE_LOCAL)
+    if not (os.path.exists(full) and os.path.getsize(full) > 0):
+        return None
+    with open(full, "rb") as f:
+        msg = await _retry_send(
+            lambda: bot.send_audio(
+                chat_id=MEDIA_STORAGE_CHAT_ID,
+                audio=InputFile(f, filename="Audio.mp3"),
+                disable_notification=True,
+            ),
+            method="send_audio",
+        )
+    return msg.audio.file_id if msg and msg.audio else None
+
+
+async def _warm_slot(bot, slot: str, env_names: list[str], upload=None) -> str:
+    """
+    Valida env → cache; se nada servir, sobe uma vez no chat de storage.
+    Retorna de onde o slot ficou resolvido.
+    """
+    for name in env_names:
+        fid = os.getenv(name) or ""
+        if fid:
+            if await _file_id_ok(bot, fid):
+                return f"env {name}"
+            log.warning("%s inválido", name)
+
+    fid = FILE_IDS.get(slot)
+    if fid:
+        if await _file_id_ok(bot, fid):
+            return "cache"
+        FILE_IDS.pop(slot, None)
+
+    if upload and MEDIA_STORAGE_CHAT_ID:
+        try:
+            new_fid = await upload(bot)
+        except Exception as e:
+            log.warning("Upload de %s falhou: %s", slot, e)
+            new_fid = None
+        if new_fid:
+            FILE_IDS[slot] = new_fid
+            return "upload"
+    return "AUSENTE"
+
+
+async def warm_up_media(bot) -> dict[str, str]:
+    """
+    Resolve todos os slots de mídia em paralelo antes de começar a
+    atender, para que nenhum usuário pague upload.
+    """
+    slots = {
+        "img1": _warm_slot(bot, "img1", [], lambda b: _upload_photo(b, IMG1_URL)),
+        "img2": _warm_slot(bot, "img2", [], lambda b: _upload_photo(b, IMG2_URL)),
+        "audio": _warm_slot(bot, "audio", ["FILE_ID_AUDIO"], _upload_audio),
+        "audio_vip": _warm_slot(bot, "audio_vip", ["FILE_ID_AUDIO_VIP"]),
+    }
+    for slot in VIDEO_SLOTS:
+        idx = slot.replace("video", "")
+        slots[slot] = _warm_slot(
+            bot, slot, [f"FILE_ID_VIDEO{idx}", f"FILE_ID_VIDEO0{idx}"]
+        )
+
+    results = await asyncio.gather(*slots.values())
+    report = dict(zip(slots, results))
+    if report["audio_vip"] == "AUSENTE":
+        report["audio_vip"] = "usa o slot audio"  # mesmo fallback do send_audio_fast
+    FILE_IDS.flush()
+    for slot, source in report.items():
+        log.info("🔥 mídia %-9s → %s", slot, source)
+    return report
 
 
 # ====== Main ======
@@ -789,86 +1376,311 @@ async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
     log.exception("Unhandled error: %s | update=%s", context.error, update)
 
 
-def main():
-    request = HTTPXRequest(
-        read_timeout=20.0,
-        write_timeout=20.0,
-        connect_timeout=10.0,
-        pool_timeout=10.0,
+async def prune_pending_job(context: ContextTypes.DEFAULT_TYPE):
+    removed = VIP_PENDING_PRINT.prune()
+    if removed:
+        log.info("Pendências de print vencidas removidas: %s", removed)
+
+
+async def media_refresh_job(context: ContextTypes.DEFAULT_TYPE):
+    await FILE_IDS.refresh()
+
+
+async def followups_tick_job(context: ContextTypes.DEFAULT_TYPE):
+    await FOLLOWUPS.tick(context)
+
+
+async def sequences_reload_job(context: ContextTypes.DEFAULT_TYPE):
+    SEQUENCES.reload_if_changed()
+
+
+async def fill_rollups():
+    """
+    Preenche as rollups de um banco antigo com o histórico, um lote por vez
+    na thread de escrita. Cancelada no on_stop; o próximo boot continua de
+    onde parou.
+    """
+    started = time.perf_counter()
+    log.info("📊 Preenchendo as rollups com o histórico em segundo plano…")
+    try:
+        while not await db.run(db.fill_rollups_step):
+            pass
+    except Exception:
+        log.exception("Falha ao preencher as rollups; rode python analytics.py --rebuild")
+        return
+    log.info("📊 Rollups preenchidas em %.1fs.", time.perf_counter() - started)
+
+
+def register_gauges(limiter: OutboundRateLimiter):
+    for lane in ("high", "low"):
+        metrics.REGISTRY.gauge(
+            f"outbound_queue_depth_{lane}",
+            f"Envios aguardando na fila {lane} do rate limiter",
+            lambda lane=lane: limiter.depth(lane),
+        )
+    metrics.REGISTRY.gauge(
+        "validation_queue_depth",
+        "Prints aguardando validação",
+        lambda: _validation_queue.qsize() if _validation_queue else 0,
     )
+    metrics.REGISTRY.gauge(
+        "pending_prints", "Chats aguardando print", lambda: len(VIP_PENDING_PRINT)
+    )
+    metrics.REGISTRY.gauge(
+        "followups_scheduled", "Follow-ups agendados", lambda: len(FOLLOWUPS)
+    )
+    metrics.REGISTRY.gauge(
+        "event_buffer_depth", "Eventos aguardando flush", db.pending_events
+    )
+    metrics.REGISTRY.gauge(
+        "events_dropped_total",
+        "Eventos descartados (buffer cheio ou falha de gravação)",
+        db.dropped_events,
+        kind="counter",
+    )
+    for kind in ("approve", "dm"):
+        metrics.REGISTRY.gauge(
+            f"join_queue_depth_{kind}",
+            f"Join requests aguardando {kind}",
+            lambda kind=kind: JOINS.depth(kind),
+        )
 
-    app = (
+
+_metrics_server = None
+# preenchimento das rollups de um banco antigo (db.fill_rollups_step)
+_rollups_task: asyncio.Task | None = None
+
+
+def report_boot():
+    if boot.finished():
+        return  # restart do app no mesmo processo (loadtest)
+    took = boot.finish()
+    log.info("⏱️ Boot até o primeiro poll: %s", boot.report())
+    if STARTUP_BUDGET and took > STARTUP_BUDGET:
+        log.warning("⚠️ Boot levou %.2fs, acima do orçamento de %.2fs", took, STARTUP_BUDGET)
+
+
+async def on_startup(app):
+    global _metrics_server, _rollups_task
+    boot.mark("initialize")  # getMe e afins, antes do post_init
+    db.init_db()
+    start_validation_workers()
+
+    if METRICS_PORT and _metrics_server is None:
+        register_gauges(app.bot.rate_limiter)
+        _metrics_server = metrics.start_http_server(METRICS_PORT, METRICS_HOST)
+    boot.mark("db")
+
+    log.info("Passos de sequência carregados: %s", SEQUENCES.load())
+    log.info("Follow-ups agendados carregados: %s", FOLLOWUPS.load())
+    log.info("Pendências de print carregadas: %s", await VIP_PENDING_PRINT.load())
+    log.info("Join requests pendentes carregados: %s", JOINS.load())
+    JOINS.start(app.bot, approve_join, send_join_welcome)
+
+    app.job_queue.run_repeating(followups_tick_job, interval=1, first=1)
+    app.job_queue.run_repeating(prune_pending_job, interval=3600, first=3600)
+    app.job_queue.run_repeating(media_refresh_job, interval=30, first=30)
+    if SEQUENCES_RELOAD_SECONDS > 0:
+        app.job_queue.run_repeating(
+            sequences_reload_job,
+            interval=SEQUENCES_RELOAD_SECONDS,
+            first=SEQUENCES_RELOAD_SECONDS,
+        )
+
+    if not ADMIN_CHAT_IDS:
+        log.warning("⚠️ ADMIN_CHAT_IDS vazio — captura de áudio/vídeo desativada.")
+    boot.mark("estado")
+
+    # o polling/webhook só começa depois que o post_init terminar. Com
+    # shards só o primeiro sobe as mídias; os outros pegam os file_ids
+    # pelo SQLite no media_refresh_job.
+    if IS_FIRST_SHARD:
+        try:
+            await asyncio.wait_for(warm_up_media(app.bot), WARMUP_TIMEOUT)
+            log.info("✅ Mídias prontas, começando a atender.")
+        except asyncio.TimeoutError:
+            log.warning("⚠️ Pré-aquecimento passou de %ss; seguindo assim mesmo.", WARMUP_TIMEOUT)
+    boot.mark("mídias")
+    report_boot()
+    if OPENAI_API_KEY:
+        # o import do openai roda numa thread agora, e não no primeiro print
+        app.create_task(openai_client())
+    if IS_FIRST_SHARD and db.rollups_pending():
+        _rollups_task = asyncio.create_task(fill_rollups())
+
+
+async def on_stop(app):
+    # antes do app.shutdown(): o lote em andamento ainda precisa do bot
+    # (cliente HTTP aberto) para terminar e ser marcado
+    await stop_validation_workers()
+    await JOINS.stop()
+    if _rollups_task is not None:
+        _rollups_task.cancel()
+        await asyncio.gather(_rollups_task, return_exceptions=True)
+
+
+async def on_shutdown(app):
+    global _metrics_server, _http
+    if _metrics_server is not None:
+        _metrics_server.shutdown()
+        _metrics_server = None
+    shutdown_image_pool()
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+    FILE_IDS.flush()
+    db.close()
+
+
+def bot_api_settings() -> dict:
+    """
+    Request HTTP e URLs da Bot API (BOT_API_URL), como kwargs do Bot.
+    Os mesmos no app e no front do modo sharded.
+    """
+    base = BOT_API_URL or "https://api.telegram.org"
+    return {
+        "request": metrics.InstrumentedRequest(
+            connection_pool_size=BOT_API_POOL_SIZE,
+            read_timeout=20.0,
+            write_timeout=20.0,
+            connect_timeout=10.0,
+            pool_timeout=10.0,
+        ),
+        "base_url": f"{base}/bot",
+        "base_file_url": f"{base}/file/bot",
+    }
+
+
+def build_app():
+    api = bot_api_settings()
+    builder = (
         ApplicationBuilder()
         .token(TOKEN)
-        .request(request)
+        .request(api["request"])
+        .base_url(api["base_url"])
+        .base_file_url(api["base_file_url"])
         .job_queue(JobQueue())
-        .build()
+        .rate_limiter(OutboundRateLimiter(GLOBAL_MSGS_PER_SEC, CHAT_MSGS_PER_SEC))
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
     )
+    app = builder.build()
+
+    # estágio do funil carregado fora do loop antes dos handlers do grupo 0
+    app.add_handler(TypeHandler(Update, load_funnel_stage), group=-1)
 
     # handler para Request to Join
-    app.add_handler(ChatJoinRequestHandler(on_join_request))
+    app.add_handler(ChatJoinRequestHandler(metrics.instrument(on_join_request)))
 
     # comandos
-    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("start", metrics.instrument(start)))
 
     # mídia utilitária (capturas de file_id)
-    app.add_handler(MessageHandler(filters.AUDIO | filters.VOICE, capture_audio))
+    app.add_handler(
+        MessageHandler(
+            filters.AUDIO | filters.VOICE,
+            metrics.instrument(capture_audio),
+        )
+    )
     app.add_handler(
         MessageHandler(
             filters.VIDEO | filters.Document.VIDEO | filters.VIDEO_NOTE,
-            capture_video,
+            metrics.instrument(capture_video),
         )
     )
 
     # validação de print (foto ou documento de imagem)
-    app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
-    app.add_handler(MessageHandler(filters.Document.IMAGE, handle_image_doc))
+    app.add_handler(MessageHandler(filters.PHOTO, metrics.instrument(handle_photo)))
+    app.add_handler(
+        MessageHandler(filters.Document.IMAGE, metrics.instrument(handle_image_doc))
+    )
 
     # callbacks de botões
     app.add_handler(
         CallbackQueryHandler(
-            confirm_sim,
+            metrics.instrument(confirm_sim),
             pattern=f"^{CB_CONFIRM_SIM}$",
         )
     )
     app.add_handler(
         CallbackQueryHandler(
-            acessar_vip,
+            metrics.instrument(acessar_vip),
             pattern=f"^{CB_ACESSAR_VIP}$",
         )
     )
     app.add_handler(
         CallbackQueryHandler(
-            vip_quero_garantir,
+            metrics.instrument(vip_quero_garantir),
             pattern=f"^{CB_VIP_GARANTIR}$",
         )
     )
     app.add_handler(
         CallbackQueryHandler(
-            vip_me_explica,
+            metrics.instrument(vip_me_explica),
             pattern=f"^{CB_VIP_EXPLICAR}$",
         )
     )
     app.add_handler(
         CallbackQueryHandler(
-            vip_btn_print,
+            metrics.instrument(vip_btn_print),
             pattern=f"^{CB_VIP_PRINT}$",
         )
     )
     app.add_handler(
         CallbackQueryHandler(
-            vip_btn_depositar,
+            metrics.instrument(vip_btn_depositar),
             pattern=f"^{CB_VIP_DEPOSITAR}$",
         )
     )
 
     # error handler
     app.add_error_handler(on_error)
+    boot.mark("build_app")
+    return app
+
+
+def main():
+    if SHARDS > 1:
+        log.info("🧩 Modo sharded: %s workers (%s)", SHARDS, BOT_MODE)
+        asyncio.run(
+            sharding.run_front(
+                TOKEN,
+                SHARDS,
+                BOT_MODE,
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                secret=WEBHOOK_SECRET,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                webhook_url=WEBHOOK_URL,
+                bot_api=bot_api_settings(),
+            )
+        )
+        return
+
+    app = build_app()
 
     log.info(
-        "🤖 Bot unificado rodando: RequestToJoin + VIP + validação do print (OpenAI) + deep-link do presente."
+        "🤖 Bot unificado rodando (%s): RequestToJoin + VIP + validação do print (OpenAI) + deep-link do presente.",
+        BOT_MODE,
     )
 
+    if BOT_MODE == "webhook":
+        asyncio.run(
+            webhook.serve(
+                app,
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                secret=WEBHOOK_SECRET,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                webhook_url=WEBHOOK_URL,
+            )
+        )
+        return
+
     app.run_polling(drop_pending_updates=True)
 
 
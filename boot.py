@@ -0,0 +1,50 @@
+"""
+Cronômetro do boot: quanto cada fase levou até o primeiro poll.
+
+É o primeiro import do app.py, então o relógio começa antes de
+telegram/httpx. Cada `mark()` fecha a fase que estava correndo.
+"""
+import time
+
+_started = time.perf_counter()
+_last = _started
+_phases: list[tuple[str, float]] = []
+_finished_at: float | None = None
+
+
+def mark(name: str) -> float:
+    """Encerra a fase `name` e devolve quanto ela levou."""
+    global _last
+    if _finished_at is not None:
+        return 0.0
+    now = time.perf_counter()
+    took = now - _last
+    _phases.append((name, took))
+    _last = now
+    return took
+
+
+def elapsed() -> float:
+    end = _finished_at if _finished_at is not None else time.perf_counter()
+    return end - _started
+
+
+def finish() -> float:
+    """Fecha o boot (pronto para o primeiro poll) e devolve o total."""
+    global _finished_at
+    if _finished_at is None:
+        _finished_at = time.perf_counter()
+    return elapsed()
+
+
+def finished() -> bool:
+    return _finished_at is not None
+
+
+def phases() -> list[tuple[str, float]]:
+    return list(_phases)
+
+
+def report() -> str:
+    parts = " · ".join(f"{name} {took:.2f}s" for name, took in _phases)
+    return f"{parts} = {elapsed():.2f}s"
@@ -1,16 +1,129 @@
+import os
+import asyncio
+import logging
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
 
-DB_PATH = "bot_data.sqlite"
+log = logging.getLogger("presente-vip-unificado.db")
+
+DB_PATH = os.getenv("DB_PATH", "bot_data.sqlite")
+
+# Modo sharded: cada worker só carrega os chats que são dele
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+
+# Buffer de eventos: grava em lote a cada N eventos ou M ms
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "500"))
+EVENT_FLUSH_MS = int(os.getenv("EVENT_FLUSH_MS", "250"))
+EVENT_BUFFER_MAX = int(os.getenv("EVENT_BUFFER_MAX", "20000"))
+
+# Dia das rollups de analytics (events_daily/stage_daily) no fuso do bot
+TZ_OFFSET_HOURS = int(os.getenv("TZ_OFFSET_HOURS", "-3"))
+# Eventos por lote no preenchimento das rollups de um banco antigo
+ROLLUP_BATCH = 5_000
+# Faixa de telegram_id do preenchimento: os limites do INTEGER do SQLite
+_MIN_TID, _MAX_TID = -(2**63), 2**63 - 1
+
+# Limites (s) dos buckets de event_latency; o último bucket é "acima disso"
+LATENCY_BUCKETS = (
+    5, 10, 20, 30, 45, 60, 90, 120, 180, 240, 300, 420, 600, 900, 1200, 1500,
+    1800, 2400, 3000, 3600, 5400, 7200, 10800, 21600, 43200, 86400, 172800, 604800,
+)
+
+# Uma conexão longa por processo (WAL), protegida por lock. O sqlite3 já
+# reaproveita os prepared statements pelo texto do SQL (cached_statements).
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA busy_timeout=5000",
+)
+
+_conn: sqlite3.Connection | None = None
+_lock = threading.RLock()
+_writer: ThreadPoolExecutor | None = None
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    return conn
 
 @contextmanager
 def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-    finally:
-        conn.close()
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = _connect()
+        conn = _conn
+        try:
+            yield conn
+        except BaseException:
+            # a conexão é compartilhada: sem isso o próximo commit() de
+            # outra função gravaria a transação pela metade
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+def _get_writer() -> ThreadPoolExecutor:
+    global _writer
+    if _writer is None:
+        _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+    return _writer
+
+def submit(fn, *args) -> Future:
+    """Fire-and-forget: roda fn(*args) na thread de escrita, em ordem."""
+    return _get_writer().submit(fn, *args)
+
+async def run(fn, *args):
+    """Roda fn(*args) na thread de escrita e aguarda, sem travar o event loop."""
+    return await asyncio.wrap_future(submit(fn, *args))
+
+def close():
+    global _conn, _writer
+    _events.close()
+    if _writer is not None:
+        _writer.shutdown(wait=True)
+        _writer = None
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+def _ensure_column(cur: sqlite3.Cursor, table: str, column: str, decl: str):
+    cols = {r[1] for r in cur.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+_JOIN_REQUESTS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS join_requests (
+      user_id INTEGER NOT NULL,
+      chat_id INTEGER NOT NULL,
+      user_chat_id INTEGER NOT NULL,
+      first_name TEXT,
+      created_at REAL NOT NULL,
+      approved INTEGER NOT NULL DEFAULT 0,
+      dm_sent INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (user_id, chat_id)
+    ) WITHOUT ROWID
+"""
+
+def _init_join_requests(cur: sqlite3.Cursor):
+    # versões antigas tinham user_id como chave: o pedido do mesmo usuário
+    # para um segundo canal era ignorado. Recria com (user_id, chat_id).
+    pk = [r[1] for r in sorted(cur.execute("PRAGMA table_info(join_requests)"), key=lambda r: r[5]) if r[5]]
+    if pk == ["user_id"]:
+        cur.execute("ALTER TABLE join_requests RENAME TO join_requests_old")
+        cur.execute(_JOIN_REQUESTS_SCHEMA)
+        cur.execute("INSERT INTO join_requests SELECT * FROM join_requests_old")
+        cur.execute("DROP TABLE join_requests_old")
+    else:
+        cur.execute(_JOIN_REQUESTS_SCHEMA)
 
 def init_db():
     with get_conn() as conn:
@@ -29,6 +142,7 @@ def init_db():
             )
             """
         )
+        _ensure_column(cur, "users", "stage_at", "REAL")
         cur.execute(
             """
             CREATE TABLE IF NOT EXISTS events (
@@ -40,7 +154,299 @@ def init_db():
             )
             """
         )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pending_prints (
+              chat_id INTEGER PRIMARY KEY,
+              expires_at REAL NOT NULL
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS followups (
+              chat_id INTEGER NOT NULL,
+              step TEXT NOT NULL,
+              due_at REAL NOT NULL,
+              PRIMARY KEY (chat_id, step)
+            ) WITHOUT ROWID
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_followups_due ON followups(due_at)")
+        _init_join_requests(cur)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_events_user_time ON events(telegram_id, created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_events_event_time ON events(event, created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_users_stage ON users(stage, stage_at)")
+        _init_rollups(cur)
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media (
+              slot TEXT PRIMARY KEY,
+              file_id TEXT NOT NULL,
+              version INTEGER NOT NULL DEFAULT 1,
+              updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        conn.commit()
+
+def _init_rollups(cur: sqlite3.Cursor):
+    """
+    Rollups do analytics.py, mantidas por trigger na mesma transação do
+    INSERT/UPDATE — ninguém precisa lembrar de atualizá-las:
+
+    - events_daily: eventos por dia (fuso TZ_OFFSET_HOURS) e tipo
+    - event_firsts: primeira vez de cada usuário em cada evento
+    - event_latency: histograma do tempo entre o primeiro /start e a
+      primeira vez em cada evento, por dia do evento
+    - stage_daily: quantos entraram em cada estágio do funil, por dia
+    - stage_counts: quantos usuários estão em cada estágio agora
+
+    Os triggers são recriados a cada init (pegam mudança de fuso). Na
+    primeira vez as tabelas nascem vazias e o histórico entra depois, aos
+    poucos, por fill_rollups_step — o init não varre events. Enquanto isso
+    rollup_backfill guarda até qual telegram_id já foi preenchido, e os
+    triggers ignoram quem ainda não foi: cada usuário é contado uma vez só,
+    ou pelo preenchimento ou pelo trigger.
+    """
+    fresh = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='events_daily'"
+    ).fetchone() is None
+    cur.execute("CREATE TABLE IF NOT EXISTS rollup_backfill (next_tid INTEGER)")
+    if fresh:
+        cur.execute("INSERT INTO rollup_backfill (next_tid) VALUES (?)", (_MIN_TID,))
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS events_daily (
+          day TEXT NOT NULL,
+          event TEXT NOT NULL,
+          n INTEGER NOT NULL,
+          PRIMARY KEY (day, event)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS event_firsts (
+          telegram_id INTEGER NOT NULL,
+          event TEXT NOT NULL,
+          first_at TEXT NOT NULL,
+          PRIMARY KEY (telegram_id, event)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_event_firsts_event ON event_firsts(event, first_at)")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS event_latency (
+          day TEXT NOT NULL,
+          event TEXT NOT NULL,
+          bucket INTEGER NOT NULL,
+          n INTEGER NOT NULL,
+          PRIMARY KEY (day, event, bucket)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stage_daily (
+          day TEXT NOT NULL,
+          stage TEXT NOT NULL,
+          n INTEGER NOT NULL,
+          PRIMARY KEY (day, stage)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stage_counts (
+          stage TEXT PRIMARY KEY,
+          n INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+
+    tz = f"{TZ_OFFSET_HOURS:+d} hours"
+    for name in (
+        "trg_events_rollup",
+        "trg_event_firsts_latency",
+        "trg_users_stage_insert",
+        "trg_users_stage_update",
+    ):
+        cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+    cur.execute(
+        f"""
+        CREATE TRIGGER trg_events_rollup AFTER INSERT ON events
+        WHEN NEW.event IS NOT NULL AND {_filled("NEW.telegram_id")}
+        BEGIN
+          INSERT INTO events_daily (day, event, n)
+          VALUES (date(NEW.created_at, '{tz}'), NEW.event, 1)
+          ON CONFLICT(day, event) DO UPDATE SET n = n + 1;
+          INSERT OR IGNORE INTO event_firsts (telegram_id, event, first_at)
+          VALUES (NEW.telegram_id, NEW.event, NEW.created_at);
+        END
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER trg_event_firsts_latency AFTER INSERT ON event_firsts
+        WHEN NEW.event != 'start' AND {_filled("NEW.telegram_id")}
+        BEGIN
+          INSERT INTO event_latency (day, event, bucket, n)
+          SELECT date(NEW.first_at, '{tz}'), NEW.event, {_latency_bucket("d")}, 1
+          FROM (
+            SELECT (julianday(NEW.first_at) - julianday(first_at)) * 86400 AS d
+            FROM event_firsts
+            WHERE telegram_id = NEW.telegram_id AND event = 'start' AND first_at <= NEW.first_at
+          ) WHERE 1
+          ON CONFLICT(day, event, bucket) DO UPDATE SET n = n + 1;
+        END
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER trg_users_stage_insert AFTER INSERT ON users
+        WHEN NEW.stage IS NOT NULL AND {_filled("NEW.telegram_id")}
+        BEGIN
+          INSERT INTO stage_counts (stage, n) VALUES (NEW.stage, 1)
+          ON CONFLICT(stage) DO UPDATE SET n = n + 1;
+          INSERT INTO stage_daily (day, stage, n)
+          VALUES (date(COALESCE(NEW.stage_at, strftime('%s', 'now')), 'unixepoch', '{tz}'), NEW.stage, 1)
+          ON CONFLICT(day, stage) DO UPDATE SET n = n + 1;
+        END
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER trg_users_stage_update AFTER UPDATE OF stage ON users
+        WHEN NEW.stage IS NOT OLD.stage AND {_filled("NEW.telegram_id")}
+        BEGIN
+          UPDATE stage_counts SET n = n - 1 WHERE stage = OLD.stage;
+          INSERT INTO stage_counts (stage, n)
+          SELECT NEW.stage, 1 WHERE NEW.stage IS NOT NULL
+          ON CONFLICT(stage) DO UPDATE SET n = n + 1;
+          INSERT INTO stage_daily (day, stage, n)
+          SELECT date(COALESCE(NEW.stage_at, strftime('%s', 'now')), 'unixepoch', '{tz}'), NEW.stage, 1
+          WHERE NEW.stage IS NOT NULL
+          ON CONFLICT(day, stage) DO UPDATE SET n = n + 1;
+        END
+        """
+    )
+
+def _filled(tid: str) -> str:
+    # telegram_id NULL só entra no último passo do preenchimento
+    return f"NOT EXISTS (SELECT 1 FROM rollup_backfill WHERE {tid} IS NULL OR {tid} >= next_tid)"
+
+def _latency_bucket(col: str) -> str:
+    cases = " ".join(f"WHEN {col} < {edge} THEN {i}" for i, edge in enumerate(LATENCY_BUCKETS))
+    return f"CASE {cases} ELSE {len(LATENCY_BUCKETS)} END"
+
+def _fill_rollups(cur: sqlite3.Cursor, rng: str, args: dict):
+    """Soma nas rollups o histórico dos usuários que casam com rng."""
+    tz = f"{TZ_OFFSET_HOURS:+d} hours"
+    cur.execute(
+        f"""
+        INSERT INTO events_daily (day, event, n)
+        SELECT date(created_at, '{tz}'), event, count(*) FROM events
+        WHERE event IS NOT NULL AND {rng} GROUP BY 1, 2
+        ON CONFLICT(day, event) DO UPDATE SET n = n + excluded.n
+        """,
+        args,
+    )
+    # os triggers ainda ignoram esse lote, inclusive o de latência
+    cur.execute(
+        f"""
+        INSERT INTO event_firsts (telegram_id, event, first_at)
+        SELECT telegram_id, event, min(created_at) FROM events
+        WHERE telegram_id IS NOT NULL AND event IS NOT NULL AND {rng} GROUP BY 1, 2
+        """,
+        args,
+    )
+    cur.execute(
+        f"""
+        INSERT INTO event_latency (day, event, bucket, n)
+        SELECT day, event, {_latency_bucket("d")}, count(*) FROM (
+          SELECT date(e.first_at, '{tz}') AS day, e.event AS event,
+                 (julianday(e.first_at) - julianday(s.first_at)) * 86400 AS d
+          FROM event_firsts e
+          JOIN event_firsts s
+            ON s.telegram_id = e.telegram_id AND s.event = 'start' AND s.first_at <= e.first_at
+          WHERE e.event != 'start' AND {rng.replace("telegram_id", "e.telegram_id")}
+            AND {rng.replace("telegram_id", "s.telegram_id")}
+        ) GROUP BY 1, 2, 3
+        ON CONFLICT(day, event, bucket) DO UPDATE SET n = n + excluded.n
+        """,
+        args,
+    )
+    # do histórico de estágios só sobrou o atual de cada usuário
+    cur.execute(
+        f"""
+        INSERT INTO stage_daily (day, stage, n)
+        SELECT date(stage_at, 'unixepoch', '{tz}'), stage, count(*) FROM users
+        WHERE stage IS NOT NULL AND stage_at IS NOT NULL AND {rng} GROUP BY 1, 2
+        ON CONFLICT(day, stage) DO UPDATE SET n = n + excluded.n
+        """,
+        args,
+    )
+    cur.execute(
+        f"""
+        INSERT INTO stage_counts (stage, n)
+        SELECT stage, count(*) FROM users WHERE stage IS NOT NULL AND {rng} GROUP BY stage
+        ON CONFLICT(stage) DO UPDATE SET n = n + excluded.n
+        """,
+        args,
+    )
+
+def fill_rollups_step(batch: int = ROLLUP_BATCH) -> bool:
+    """
+    Preenche as rollups de mais um lote de usuários (~batch eventos) e
+    avança rollup_backfill. Devolve True quando não falta nada. Cada lote
+    é uma transação curta, então as outras escritas seguem entre um lote e
+    outro. Roda na thread de escrita (db.run) ou no analytics.py --rebuild.
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        # IMMEDIATE: outro processo (shard, analytics.py) pode estar no
+        # mesmo preenchimento; o next_tid lido tem que valer até o commit
+        cur.execute("BEGIN IMMEDIATE")
+        row = cur.execute("SELECT next_tid FROM rollup_backfill").fetchone()
+        if row is None:
+            conn.commit()
+            return True
+        lo = row[0]
+        hi = cur.execute(
+            "SELECT telegram_id FROM events WHERE telegram_id >= ? ORDER BY telegram_id LIMIT 1 OFFSET ?",
+            (lo, batch),
+        ).fetchone()
+        hi = hi[0] if hi else None
+        if hi is None:
+            # último lote: quem só existe em users e os telegram_id NULL, à
+            # parte. Sem OR e com os dois limites o SQLite usa o índice de
+            # telegram_id em vez de varrer users pelo de stage.
+            _fill_rollups(cur, "telegram_id BETWEEN :lo AND :hi", {"lo": lo, "hi": _MAX_TID})
+            _fill_rollups(cur, "telegram_id IS NULL", {})
+            cur.execute("DELETE FROM rollup_backfill")
+        else:
+            _fill_rollups(cur, "telegram_id >= :lo AND telegram_id < :hi", {"lo": lo, "hi": hi})
+            cur.execute("UPDATE rollup_backfill SET next_tid = ?", (hi,))
         conn.commit()
+        return hi is None
+
+def rollups_pending() -> bool:
+    with get_conn() as conn:
+        return conn.execute("SELECT 1 FROM rollup_backfill").fetchone() is not None
+
+def rebuild_rollups():
+    """Recalcula as rollups do zero a partir de events/users, em lotes."""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        for table in ("events_daily", "event_firsts", "event_latency", "stage_daily", "stage_counts", "rollup_backfill"):
+            cur.execute(f"DELETE FROM {table}")
+        cur.execute("INSERT INTO rollup_backfill (next_tid) VALUES (?)", (_MIN_TID,))
+        conn.commit()
+    while not fill_rollups_step():
+        pass
 
 def upsert_user(telegram_id: int, username: str | None, full_name: str | None, source: str | None = None):
     with get_conn() as conn:
@@ -64,14 +470,299 @@ def set_consent(telegram_id: int, consent: bool):
         cur.execute("UPDATE users SET consent=? WHERE telegram_id=?", (1 if consent else 0, telegram_id))
         conn.commit()
 
-def set_stage(telegram_id: int, stage: str):
+def set_stage(telegram_id: int, stage: str, at: float | None = None):
+    """Grava o estágio do funil; cria o usuário se ainda não existir."""
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("UPDATE users SET stage=? WHERE telegram_id=?", (stage, telegram_id))
+        cur.execute(
+            """
+            INSERT INTO users (telegram_id, stage, stage_at) VALUES (?, ?, ?)
+            ON CONFLICT(telegram_id) DO UPDATE SET
+              stage=excluded.stage,
+              stage_at=excluded.stage_at
+            """,
+            (telegram_id, stage, at if at is not None else time.time()),
+        )
         conn.commit()
 
+def get_stage(telegram_id: int) -> tuple[str, float] | None:
+    with get_conn() as conn:
+        row = conn.execute(
+            "SELECT stage, stage_at FROM users WHERE telegram_id=?", (telegram_id,)
+        ).fetchone()
+    if row is None or row[0] is None:
+        return None
+    return row[0], row[1] or 0.0
+
+class EventSink:
+    """
+    Buffer em memória para a tabela events.
+
+    put() roda no event loop, então só faz append e nunca espera: com o
+    buffer em `max_size` o evento é descartado e contado em `dropped`.
+    Uma thread de flush grava tudo com executemany numa transação quando
+    junta `batch_size` eventos ou a cada `flush_ms`. Se a gravação falhar
+    (ex.: "database is locked" com vários shards no mesmo arquivo), o lote
+    volta para a frente do buffer e a thread tenta de novo com backoff.
+    close() grava o que sobrou.
+    """
+
+    def __init__(self, batch_size: int, flush_ms: int, max_size: int, max_backoff: float = 30):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.max_size = max_size
+        self.max_backoff = max_backoff
+        self.dropped = 0
+        self._buf: list[tuple] = []
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._closed = False
+        self._failures = 0
+
+    def __len__(self) -> int:
+        return len(self._buf)
+
+    def _drop(self, n: int, why: str) -> None:
+        before = self.dropped
+        self.dropped += n
+        if before == 0 or before // 1000 != self.dropped // 1000:
+            log.warning("Eventos descartados (%s): %s no total", why, self.dropped)
+
+    def put(self, row: tuple) -> None:
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._closed = False
+                self._thread = threading.Thread(
+                    target=self._run, name="db-events", daemon=True
+                )
+                self._thread.start()
+            if len(self._buf) >= self.max_size:
+                self._drop(1, "buffer cheio")
+                return
+            self._buf.append(row)
+            if len(self._buf) >= self.batch_size:
+                self._cond.notify_all()
+
+    def _take(self) -> list[tuple]:
+        batch, self._buf = self._buf, []
+        return batch
+
+    def _requeue(self, batch: list[tuple]) -> None:
+        with self._cond:
+            self._buf = batch + self._buf
+            overflow = len(self._buf) - self.max_size
+            if overflow > 0:
+                del self._buf[:overflow]  # sai o mais antigo
+                self._drop(overflow, "buffer cheio durante falha de gravação")
+
+    def _write(self, batch: list[tuple]) -> None:
+        if not batch:
+            return
+        with get_conn() as conn:
+            conn.executemany(
+                "INSERT INTO events (telegram_id, event, meta, created_at) VALUES (?, ?, ?, ?)",
+                batch,
+            )
+            conn.commit()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or len(self._buf) >= self.batch_size,
+                    timeout=self.flush_interval,
+                )
+                batch = self._take()
+                closed = self._closed
+            try:
+                self._write(batch)
+            except Exception as e:
+                self._failures += 1
+                delay = min(self.max_backoff, self.flush_interval * 2 ** self._failures)
+                log.warning(
+                    "Falha gravando %s eventos (%s); nova tentativa em %.1fs",
+                    len(batch), e, delay,
+                )
+                self._requeue(batch)
+                if closed:
+                    return  # close() ainda tenta um flush final
+                with self._cond:
+                    self._cond.wait_for(lambda: self._closed, timeout=delay)
+                continue
+            self._failures = 0
+            if closed:
+                return
+
+    def flush(self) -> None:
+        """Grava o buffer agora. Se falhar, o lote volta para o buffer e a exceção sobe."""
+        with self._cond:
+            batch = self._take()
+        try:
+            self._write(batch)
+        except Exception:
+            self._requeue(batch)
+            raise
+
+    def close(self) -> None:
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._closed = True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            lost = len(self._buf)
+            self._buf = []
+            self._drop(lost, f"falha no flush final: {e}")
+
+
+_events = EventSink(EVENT_BATCH_SIZE, EVENT_FLUSH_MS, EVENT_BUFFER_MAX)
+
 def log_event(telegram_id: int, event: str, meta: str | None = None):
+    """Fire-and-forget: vai para o buffer, gravado em lote pela EventSink."""
+    created_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    _events.put((telegram_id, event, meta, created_at))
+
+def flush_events():
+    _events.flush()
+
+def pending_events() -> int:
+    return len(_events)
+
+def dropped_events() -> int:
+    return _events.dropped
+
+def load_media() -> dict[str, tuple[str, int]]:
     with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("INSERT INTO events (telegram_id, event, meta) VALUES (?, ?, ?)", (telegram_id, event, meta))
+        rows = conn.execute("SELECT slot, file_id, version FROM media").fetchall()
+    return {r[0]: (r[1], r[2]) for r in rows}
+
+def save_media(upserts: list[tuple[str, str]], deletes: list[str]) -> dict[str, int]:
+    """
+    Grava vários slots numa transação; a versão de cada slot sobe em 1.
+    Devolve a versão nova de cada slot gravado.
+    """
+    with get_conn() as conn:
+        conn.executemany(
+            """
+            INSERT INTO media (slot, file_id) VALUES (?, ?)
+            ON CONFLICT(slot) DO UPDATE SET
+              file_id=excluded.file_id,
+              version=media.version + 1,
+              updated_at=CURRENT_TIMESTAMP
+            """,
+            upserts,
+        )
+        conn.executemany("DELETE FROM media WHERE slot=?", [(s,) for s in deletes])
+        slots = [s for s, _ in upserts]
+        rows = conn.execute(
+            f"SELECT slot, version FROM media WHERE slot IN ({','.join('?' * len(slots))})", slots
+        ).fetchall() if slots else []
         conn.commit()
+    return {r[0]: r[1] for r in rows}
+
+def shard_of(chat_id: int, shards: int) -> int:
+    return abs(chat_id) % shards
+
+def _shard_filter(column: str = "chat_id") -> tuple[str, tuple]:
+    if SHARD_COUNT <= 1:
+        return "1", ()
+    return f"abs({column}) % ? = ?", (SHARD_COUNT, SHARD_INDEX)
+
+def add_pending_print(chat_id: int, expires_at: float):
+    with get_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO pending_prints (chat_id, expires_at) VALUES (?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET expires_at=excluded.expires_at
+            """,
+            (chat_id, expires_at),
+        )
+        conn.commit()
+
+def remove_pending_print(chat_id: int):
+    with get_conn() as conn:
+        conn.execute("DELETE FROM pending_prints WHERE chat_id=?", (chat_id,))
+        conn.commit()
+
+def prune_pending_prints(now: float):
+    with get_conn() as conn:
+        conn.execute("DELETE FROM pending_prints WHERE expires_at <= ?", (now,))
+        conn.commit()
+
+def load_pending_prints(now: float) -> list[tuple[int, float]]:
+    """Apaga os vencidos e devolve (chat_id, expires_at) dos que ainda valem."""
+    prune_pending_prints(now)
+    with get_conn() as conn:
+        where, args = _shard_filter()
+        rows = conn.execute(
+            f"SELECT chat_id, expires_at FROM pending_prints WHERE {where}", args
+        ).fetchall()
+    return [(r[0], r[1]) for r in rows]
+
+def add_followup(chat_id: int, step: str, due_at: float) -> bool:
+    """Agenda (chat_id, step). Se já existe, mantém o agendamento atual."""
+    with get_conn() as conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO followups (chat_id, step, due_at) VALUES (?, ?, ?)",
+            (chat_id, step, due_at),
+        )
+        conn.commit()
+        return cur.rowcount > 0
+
+def remove_followups(keys: list[tuple[int, str]]):
+    with get_conn() as conn:
+        conn.executemany("DELETE FROM followups WHERE chat_id=? AND step=?", keys)
+        conn.commit()
+
+def load_followups() -> list[tuple[float, int, str]]:
+    with get_conn() as conn:
+        where, args = _shard_filter()
+        rows = conn.execute(
+            f"SELECT due_at, chat_id, step FROM followups WHERE {where}", args
+        ).fetchall()
+    return [(r[0], r[1], r[2]) for r in rows]
+
+def save_join_requests(
+    new: list[tuple[int, int, int, str | None, float]],
+    approved: list[tuple[int, int]],
+    dm_sent: list[tuple[int, int]],
+):
+    """
+    Grava de uma vez os join requests novos (user_id, chat_id, user_chat_id,
+    first_name, created_at) e o progresso dos workers, por (user_id,
+    chat_id). Quem já foi aprovado e recebeu a DM sai da tabela.
+    """
+    with get_conn() as conn:
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO join_requests
+              (user_id, chat_id, user_chat_id, first_name, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            new,
+        )
+        conn.executemany(
+            "UPDATE join_requests SET approved=1 WHERE user_id=? AND chat_id=?",
+            approved,
+        )
+        conn.executemany(
+            "UPDATE join_requests SET dm_sent=1 WHERE user_id=? AND chat_id=?",
+            dm_sent,
+        )
+        conn.execute("DELETE FROM join_requests WHERE approved=1 AND dm_sent=1")
+        conn.commit()
+
+def load_join_requests() -> list[tuple[int, int, int, str | None, float, bool, bool]]:
+    with get_conn() as conn:
+        where, args = _shard_filter("user_chat_id")
+        rows = conn.execute(
+            f"""
+            SELECT user_id, chat_id, user_chat_id, first_name, created_at, approved, dm_sent
+            FROM join_requests WHERE {where} ORDER BY created_at
+            """,
+            args,
+        ).fetchall()
+    return [(r[0], r[1], r[2], r[3], r[4], bool(r[5]), bool(r[6])) for r in rows]
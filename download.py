@@ -0,0 +1,87 @@
+import io
+
+import httpx
+
+
+class TooLarge(Exception):
+    """Arquivo maior que o limite configurado."""
+
+
+def pick_photo_size(sizes, min_long_side: int):
+    """
+    Menor PhotoSize cujo lado maior ainda é >= min_long_side (legível).
+    Se nenhum chegar lá, fica com o maior disponível.
+    """
+    ordered = sorted(sizes, key=lambda p: max(p.width, p.height))
+    for p in ordered:
+        if max(p.width, p.height) >= min_long_side:
+            return p
+    return ordered[-1]
+
+
+async def stream_to_buffer(
+    client: httpx.AsyncClient,
+    url: str,
+    limit: int,
+    size_hint: int | None = None,
+) -> memoryview:
+    """
+    Baixa `url` direto para um bytearray pré-alocado (pelo file_size do
+    Telegram), sem juntar pedaços nem copiar no final. Passou de `limit`,
+    aborta com TooLarge.
+    """
+    if size_hint and size_hint > limit:
+        raise TooLarge(f"{size_hint} bytes")
+
+    buf = bytearray(size_hint or min(limit, 1 << 20))
+    n = 0
+    async with client.stream("GET", url) as resp:
+        resp.raise_for_status()
+        length = int(resp.headers.get("content-length") or 0)
+        if length > limit:
+            raise TooLarge(f"{length} bytes")
+        if length > len(buf):
+            buf.extend(bytes(length - len(buf)))
+        async for chunk in resp.aiter_bytes():
+            end = n + len(chunk)
+            if end > limit:
+                raise TooLarge(f"{end} bytes")
+            if end > len(buf):
+                buf.extend(bytes(max(end - len(buf), len(buf))))
+            buf[n:end] = chunk
+            n = end
+    return memoryview(buf)[:n]
+
+
+class MemoryReader(io.RawIOBase):
+    """Arquivo só-leitura sobre um memoryview, sem copiar o buffer inteiro."""
+
+    def __init__(self, view: memoryview):
+        self._view = view.cast("B") if view.format != "B" else view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        chunk = self._view[self._pos : self._pos + len(b)]
+        n = len(chunk)
+        b[:n] = chunk
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = len(self._view) + offset
+        self._pos = max(0, self._pos)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
@@ -0,0 +1,123 @@
+import time
+from collections import OrderedDict
+
+import db
+
+# Estágios do funil, em ordem. Só se anda para frente.
+START = "start"
+AUDIO = "audio"
+IMG1 = "img1"
+FOLLOWUP = "followup"
+CONFIRMED = "confirmed"
+VIP = "vip"
+PENDING_PRINT = "pending_print"
+APPROVED = "approved"
+
+STAGES = (START, AUDIO, IMG1, FOLLOWUP, CONFIRMED, VIP, PENDING_PRINT, APPROVED)
+_RANK = {stage: i for i, stage in enumerate(STAGES)}
+
+_MISS = object()
+
+
+class Funnel:
+    """
+    Estágio de cada chat no funil (users.stage, via db.set_stage).
+
+    Cada passo do fluxo pergunta `reached()` antes de enviar e chama
+    `advance()` depois: repetir o gatilho (/start de novo, botão tocado
+    duas vezes) não gera envio nenhum. Como os updates de um mesmo chat
+    já são processados em ordem, um gatilho repetido sempre encontra o
+    estágio atualizado pelo anterior.
+
+    Quem parou no meio do funil há mais de `restart_after` segundos pode
+    recomeçar com /start.
+
+    O cache é limitado (LRU com TTL, como o VerdictCache). `load()` traz o
+    estágio pela thread do db, fora do event loop, e fica na ordem das
+    gravações pendentes; quem chama antes de consultar não lê o SQLite no
+    loop. Chat aprovado é o fim do funil: vai para a ponta fria do LRU e
+    expira em `terminal_ttl`.
+    """
+
+    def __init__(
+        self,
+        restart_after: float,
+        maxsize: int = 100_000,
+        ttl: float = 3600,
+        terminal_ttl: float = 60,
+    ):
+        self.restart_after = restart_after
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.terminal_ttl = terminal_ttl
+        self._cache: OrderedDict[int, tuple[tuple[str, float] | None, float]] = OrderedDict()
+
+    def _lookup(self, chat_id: int):
+        item = self._cache.get(chat_id)
+        if item is None:
+            return _MISS
+        value, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._cache[chat_id]
+            return _MISS
+        if value is None or value[0] != APPROVED:
+            self._cache.move_to_end(chat_id)
+        return value
+
+    def _store(self, chat_id: int, value: tuple[str, float] | None) -> None:
+        if value is not None and value[0] == APPROVED:
+            self._cache[chat_id] = (value, time.monotonic() + self.terminal_ttl)
+            self._cache.move_to_end(chat_id, last=False)
+        else:
+            self._cache[chat_id] = (value, time.monotonic() + self.ttl)
+            self._cache.move_to_end(chat_id)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    async def load(self, chat_id: int) -> None:
+        if self._lookup(chat_id) is not _MISS:
+            return
+        value = await db.run(db.get_stage, chat_id)
+        # alguém pode ter avançado o chat enquanto a leitura estava na fila
+        if self._lookup(chat_id) is _MISS:
+            self._store(chat_id, value)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def _get(self, chat_id: int) -> tuple[str, float] | None:
+        value = self._lookup(chat_id)
+        if value is _MISS:
+            # só sem load() antes: lê no loop mesmo
+            value = db.get_stage(chat_id)
+            self._store(chat_id, value)
+        return value
+
+    def stage(self, chat_id: int) -> str | None:
+        cur = self._get(chat_id)
+        return cur[0] if cur else None
+
+    def reached(self, chat_id: int, stage: str) -> bool:
+        cur = self._get(chat_id)
+        return cur is not None and _RANK.get(cur[0], -1) >= _RANK[stage]
+
+    def stale(self, chat_id: int) -> bool:
+        cur = self._get(chat_id)
+        if cur is None or cur[0] == APPROVED:
+            return False
+        return time.time() - cur[1] > self.restart_after
+
+    def _set(self, chat_id: int, stage: str) -> None:
+        now = time.time()
+        self._store(chat_id, (stage, now))
+        db.submit(db.set_stage, chat_id, stage, now)
+
+    def advance(self, chat_id: int, stage: str) -> bool:
+        """Vai para `stage` se ainda não passou dele. Retorna se mudou."""
+        if self.reached(chat_id, stage):
+            return False
+        self._set(chat_id, stage)
+        return True
+
+    def restart(self, chat_id: int) -> None:
+        self._set(chat_id, START)
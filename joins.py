@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from telegram.error import BadRequest, Forbidden
+
+import db
+
+log = logging.getLogger("presente-vip-unificado.joins")
+
+
+@dataclass
+class JoinRequest:
+    user_id: int
+    chat_id: int
+    user_chat_id: int
+    first_name: str | None
+    created_at: float
+    approved: bool = False
+    dm_sent: bool = False
+    attempts: int = 0
+
+    @property
+    def key(self) -> tuple[int, int]:
+        return (self.user_id, self.chat_id)
+
+
+JoinHandler = Callable[[object, JoinRequest], Awaitable[None]]
+
+
+class JoinQueue:
+    """
+    Join requests saem do handler e entram aqui (tabela join_requests).
+
+    Dois workers independentes, cada um com seu ritmo: um manda a DM de
+    boas-vindas, o outro aprova a entrada. Dedupe por (user_id, chat_id)
+    enquanto o pedido estiver em aberto: o mesmo usuário pedindo para dois
+    canais são dois pedidos. O progresso é gravado em lote; num restart
+    o que ficou pela metade é recarregado e continua de onde parou.
+
+    O user_chat_id só serve para DM enquanto o pedido não foi processado
+    (até 5 min), então a aprovação espera a DM daquele usuário — mas no
+    máximo `approve_max_delay` segundos, para um pico de DMs não segurar
+    as aprovações. DM que passou da janela é descartada.
+    """
+
+    def __init__(
+        self,
+        approve_rate: float = 20,
+        dm_rate: float = 20,
+        approve_max_delay: float = 240,
+        dm_window: float = 290,
+        max_attempts: int = 5,
+        max_inflight: int = 32,
+    ):
+        self.approve_rate = approve_rate
+        self.dm_rate = dm_rate
+        self.approve_max_delay = approve_max_delay
+        self.dm_window = dm_window
+        self.max_attempts = max_attempts
+        # lotes pequenos: centenas de requests esperando no pool do httpx
+        # custam mais CPU do que rendem
+        self.max_inflight = max_inflight
+        self._items: dict[tuple[int, int], JoinRequest] = {}
+        self._approve: deque[tuple[int, int]] = deque()
+        self._dm: deque[tuple[int, int]] = deque()
+        self._wake: dict[str, asyncio.Event] = {}
+        self._new: list[tuple] = []
+        self._approved: list[tuple[int, int]] = []
+        self._dm_done: list[tuple[int, int]] = []
+        self._flush_handle: asyncio.Handle | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._stopping = False
+        self._loaded = False
+
+    def load(self) -> int:
+        self._items.clear()
+        self._approve.clear()
+        self._dm.clear()
+        for row in db.load_join_requests():
+            req = JoinRequest(*row)
+            self._items[req.key] = req
+            if not req.dm_sent:
+                self._dm.append(req.key)
+            if not req.approved:
+                self._approve.append(req.key)
+        self._loaded = True
+        return len(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def depth(self, kind: str) -> int:
+        return len(self._approve if kind == "approve" else self._dm)
+
+    def add(self, user_id: int, chat_id: int, user_chat_id: int, first_name: str | None) -> bool:
+        """Enfileira o pedido. Se o usuário já tem um em aberto para esse chat, ignora."""
+        if not self._loaded:
+            self.load()
+        req = JoinRequest(user_id, chat_id, user_chat_id, first_name, time.time())
+        if req.key in self._items:
+            return False
+        self._items[req.key] = req
+        self._dm.append(req.key)
+        self._approve.append(req.key)
+        self._new.append((user_id, chat_id, user_chat_id, first_name, req.created_at))
+        self._schedule_flush()
+        self._notify("dm")
+        self._notify("approve")
+        return True
+
+    def _notify(self, kind: str) -> None:
+        event = self._wake.get(kind)
+        if event is not None:
+            event.set()
+
+    # ---- persistência em lote ----
+    def _schedule_flush(self) -> None:
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(0.05, self.flush)
+
+    def flush(self) -> None:
+        self._flush_handle = None
+        if not (self._new or self._approved or self._dm_done):
+            return
+        new, self._new = self._new, []
+        approved, self._approved = self._approved, []
+        dm_done, self._dm_done = self._dm_done, []
+        db.submit(db.save_join_requests, new, approved, dm_done)
+
+    def _finish(self, req: JoinRequest, kind: str) -> None:
+        if kind == "approve":
+            req.approved = True
+            self._approved.append(req.key)
+        else:
+            req.dm_sent = True
+            self._dm_done.append(req.key)
+            self._notify("approve")
+        if req.approved and req.dm_sent:
+            self._items.pop(req.key, None)
+        self._schedule_flush()
+
+    # ---- workers ----
+    def _ready(self, req: JoinRequest, kind: str, now: float) -> bool:
+        if kind == "dm":
+            return True
+        return req.dm_sent or now - req.created_at >= self.approve_max_delay
+
+    def _take(self, kind: str, limit: int) -> list[JoinRequest]:
+        queue = self._approve if kind == "approve" else self._dm
+        now = time.time()
+        batch = []
+        while queue and len(batch) < limit:
+            req = self._items.get(queue[0])
+            if req is None:
+                queue.popleft()
+                continue
+            if kind == "dm" and now - req.created_at > self.dm_window:
+                queue.popleft()
+                log.info("DM de boas-vindas para %s perdeu a janela", req.user_id)
+                self._finish(req, "dm")
+                continue
+            if not self._ready(req, kind, now):
+                break  # fila em ordem de chegada: os de trás também não estão
+            batch.append(req)
+            queue.popleft()
+        return batch
+
+    async def _run_one(self, fn: JoinHandler, bot, req: JoinRequest, kind: str) -> None:
+        try:
+            await fn(bot, req)
+        except (BadRequest, Forbidden) as e:
+            # pedido já tratado por outro admin, usuário bloqueou o bot etc.
+            log.info("Join %s de %s descartado: %s", kind, req.user_id, e)
+        except Exception as e:
+            req.attempts += 1
+            if req.attempts < self.max_attempts:
+                log.warning("Join %s de %s falhou (%s), tento de novo", kind, req.user_id, e)
+                (self._approve if kind == "approve" else self._dm).append(req.key)
+                return
+            log.warning("Join %s de %s desistido após %s tentativas", kind, req.user_id, req.attempts)
+        self._finish(req, kind)
+
+    async def _worker(self, kind: str, fn: JoinHandler, bot, rate: float) -> None:
+        per_batch = max(1, min(int(rate), self.max_inflight))
+        wake = self._wake[kind]
+        while not self._stopping:
+            batch = self._take(kind, per_batch)
+            if not batch:
+                wake.clear()
+                # acorda com pedido novo, DM concluída ou a cada 1s (prazo da aprovação)
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=1)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            started = time.monotonic()
+            await asyncio.gather(*(self._run_one(fn, bot, req, kind) for req in batch))
+            elapsed = time.monotonic() - started
+            await asyncio.sleep(max(0.0, len(batch) / rate - elapsed))
+
+    def start(self, bot, approve: JoinHandler, welcome: JoinHandler) -> None:
+        if not self._loaded:
+            self.load()
+        self._wake = {"approve": asyncio.Event(), "dm": asyncio.Event()}
+        self._stopping = False
+        self._tasks = [
+            asyncio.create_task(self._worker("approve", approve, bot, self.approve_rate)),
+            asyncio.create_task(self._worker("dm", welcome, bot, self.dm_rate)),
+        ]
+
+    async def stop(self, timeout: float = 10) -> None:
+        # deixa o lote em andamento terminar (e ser marcado) antes de parar
+        self._stopping = True
+        for event in self._wake.values():
+            event.set()
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout) if self._tasks else ((), ())
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self.flush()
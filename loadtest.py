@@ -0,0 +1,1485 @@
+"""
+Teste de carga do funil, 100% offline.
+
+Sobe uma Bot API falsa e um endpoint /v1/responses falso (OpenAI), os dois
+com latência e taxa de erro configuráveis, aponta o app.py para eles e
+passa N usuários simulados por:
+
+    join request → /start presente → SIM → Acessar VIP → Quero Garantir → print
+
+No fim mostra vazão, p50/p95/p99 por etapa, 429 devolvidos pela Bot API
+falsa (flood control), retentativas e crescimento de memória.
+
+    python loadtest.py                       # 100 usuários, limites de produção
+    python loadtest.py --users 5000 --global-rate 1000 --api-limit 0
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs
+
+TOKEN = "123456:LOADTEST"
+
+STEPS = ("join", "start", "confirm_sim", "vip_go", "vip_garantir", "print")
+
+
+def _percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def _rss_mib() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_print_png(seed: int | None = None, size: tuple[int, int] = (720, 1560)) -> bytes:
+    """
+    Print sintético com cara de screenshot (passa na pré-triagem). Com
+    `seed`, valores e um banner com ruído mudam de um print para outro,
+    para o PNG optimize trabalhar como num print de verdade.
+    """
+    from PIL import Image, ImageDraw
+
+    w, h = size
+    img = Image.new("RGB", size, (18, 18, 32))
+    draw = ImageDraw.Draw(img)
+    rnd = random.Random(seed)
+    for y in range(80, h - 80, 140):
+        value = "50,00" if seed is None else f"{rnd.randint(35, 999)},{rnd.randint(0, 99):02d}"
+        draw.rectangle((30, y, w - 30, y + 110), fill=(38, 38, 64))
+        draw.text((50, y + 40), f"Depósito  R$ {value}  Concluído", fill=(240, 240, 240))
+    if seed is not None:
+        img.paste(Image.effect_noise((w, 60), 30 + seed % 30).convert("RGB"), (0, 0))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+# ====== Amostras rotuladas para a pré-triagem ======
+_PHONE_SIZES = ((720, 1560), (1080, 2400), (1170, 2532), (1080, 1920), (1284, 2778))
+
+
+def _sample_history(rnd: random.Random, size: tuple[int, int]):
+    """Lista de transações de app (tema claro ou escuro)."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    w, h = size
+    dark = rnd.random() < 0.5
+    bg = (rnd.randint(10, 30),) * 3 if dark else (rnd.randint(235, 255),) * 3
+    fg = (235, 235, 235) if dark else (30, 30, 30)
+    card = tuple(c + 18 for c in bg) if dark else tuple(c - 10 for c in bg)
+    img = Image.new("RGB", size, bg)
+    d = ImageDraw.Draw(img)
+    fs = max(12, w // rnd.choice((28, 36, 45)))
+    font, small = ImageFont.load_default(size=fs), ImageFont.load_default(size=int(fs * 0.75))
+    d.rectangle((0, fs * 2, w, fs * 5), fill=(rnd.randint(0, 255), rnd.randint(0, 120), rnd.randint(0, 255)))
+    d.text((40, fs * 3), "Histórico de transações", fill=(255, 255, 255), font=font)
+    y, row = fs * 6, int(fs * rnd.choice((3.2, 5)))
+    while y + row < h - fs * 3:
+        d.rounded_rectangle((20, y, w - 20, y + row - 10), radius=16, fill=card)
+        d.text((40, y + 10), rnd.choice(("Depósito", "Saque", "Aposta", "Pix recebido")), fill=fg, font=font)
+        d.text((40, y + 10 + fs * 1.2), f"{rnd.randint(1, 28):02d}/10/2026 {rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}", fill=fg, font=small)
+        d.text((w - fs * 7, y + 10), f"R$ {rnd.randint(5, 999)},{rnd.randint(0, 99):02d}", fill=fg, font=font)
+        y += row
+    return img
+
+
+def _sample_statement(rnd: random.Random, size: tuple[int, int]):
+    """Extrato tomado de texto miúdo, de ponta a ponta."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    w, h = size
+    img = Image.new("RGB", size, (250, 250, 250))
+    d = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=max(12, w // rnd.choice((36, 42, 50))))
+    y = 20
+    while y < h - 40:
+        x = 20
+        while x < w - 120:
+            word = "".join(rnd.choice("abcdefghijklmnopqrstuvwxyz0123456789R$,./") for _ in range(rnd.randint(2, 9)))
+            d.text((x, y), word, fill=(20, 20, 20), font=font)
+            x += font.getlength(word) + 10
+        y += int(font.size * 1.15)
+    return img
+
+
+def _sample_receipt(rnd: random.Random, size: tuple[int, int]):
+    """Tela de "depósito concluído": quase toda lisa, pouco texto."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    w, h = size
+    img = Image.new("RGB", size, (255, 255, 255))
+    d = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=w // 20)
+    r = w // 8
+    d.ellipse((w // 2 - r, h // 4 - r, w // 2 + r, h // 4 + r), fill=(40, 180, 90))
+    d.text((w // 6, h // 4 + r * 2), "Depósito concluído", fill=(30, 30, 30), font=font)
+    d.text((w // 6, h // 4 + r * 3), f"R$ {rnd.randint(35, 999)},00", fill=(30, 30, 30), font=font)
+    return img
+
+
+def _sample_photo(rnd: random.Random, size: tuple[int, int]):
+    """Foto de câmera: formas desfocadas, gradiente e ruído de sensor."""
+    from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+    w, h = size
+    sw, sh = w // 8, h // 8
+    base = Image.linear_gradient("L").resize((sw, sh)).rotate(rnd.randint(0, 359))
+    img = Image.merge("RGB", [base.point(lambda v: int(v * rnd.uniform(0.3, 1)) + rnd.randint(0, 80)) for _ in range(3)])
+    d = ImageDraw.Draw(img)
+    for _ in range(rnd.randint(5, 25)):
+        x, y, r = rnd.randint(0, sw), rnd.randint(0, sh), rnd.randint(5, sw // 3)
+        d.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rnd.randint(0, 255) for _ in range(3)))
+    img = img.filter(ImageFilter.GaussianBlur(rnd.uniform(1, 4))).resize(size, Image.BICUBIC)
+    noise = Image.effect_noise(size, rnd.uniform(4, 14)).convert("RGB")
+    return ImageChops.add(img, noise, offset=-128)
+
+
+def _sample_blank(rnd: random.Random, size: tuple[int, int]):
+    from PIL import Image
+
+    return Image.new("RGB", size, tuple(rnd.choice((0, 255, rnd.randint(0, 255))) for _ in range(3)))
+
+
+# tipo -> (rótulo, gerador, tamanhos possíveis)
+PRESCREEN_SAMPLES = {
+    "historico": ("ok", _sample_history, _PHONE_SIZES),
+    "extrato": ("ok", _sample_statement, _PHONE_SIZES),
+    "comprovante": ("ok", _sample_receipt, _PHONE_SIZES),
+    "foto": ("junk", _sample_photo, ((3000, 4000), (1536, 2048), (1080, 1920))),
+    "pequena": ("junk", _sample_history, ((180, 390), (220, 470))),
+    "quadrada": ("junk", _sample_history, ((1080, 1080), (800, 800))),
+    "faixa": ("junk", _sample_history, ((2400, 500),)),
+    "lisa": ("junk", _sample_blank, _PHONE_SIZES),
+}
+
+
+def write_prescreen_samples(root: str, per_kind: int, seed: int = 0) -> dict[str, list[str]]:
+    """
+    Gera root/ok e root/junk (o layout do `python prescreen.py`), metade
+    em JPEG como o Telegram recomprime foto, metade em PNG (documento).
+    """
+    rnd = random.Random(seed)
+    files: dict[str, list[str]] = {}
+    for kind, (label, make, sizes) in PRESCREEN_SAMPLES.items():
+        os.makedirs(os.path.join(root, label), exist_ok=True)
+        for i in range(per_kind):
+            img = make(rnd, rnd.choice(sizes))
+            ext = "jpg" if i % 2 == 0 else "png"
+            path = os.path.join(root, label, f"{kind}-{i:03d}.{ext}")
+            if ext == "jpg":
+                img.save(path, "JPEG", quality=rnd.choice((75, 85, 95)))
+            else:
+                img.save(path, "PNG")
+            files.setdefault(kind, []).append(path)
+    return files
+
+
+# ====== Servidor HTTP mínimo ======
+class _HTTPServer:
+    """HTTP/1.1 com keep-alive; `handle(method, path, headers, body)` devolve
+    (status, corpo, content-type)."""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.port = 0
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._conn, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _conn(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method, target = lines[0].split(" ")[:2]
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                length = int(headers.get("content-length") or 0)
+                body = await reader.readexactly(length) if length else b""
+                try:
+                    status, payload, ctype = await self.handle(method, target, headers, body)
+                except Exception as e:
+                    print("erro no servidor falso:", target, repr(e), file=sys.stderr)
+                    status, payload, ctype = 500, b"{}", "application/json"
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} X\r\nContent-Type: {ctype}\r\n"
+                        f"Content-Length: {len(payload)}\r\n\r\n"
+                    ).encode("latin-1")
+                    + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+def _form(headers: dict, body: bytes) -> dict[str, str]:
+    """Campos do form enviado pelo PTB (urlencoded ou multipart)."""
+    ctype = headers.get("content-type", "")
+    if ctype.startswith("multipart/"):
+        text = body.decode("utf-8", "replace")
+        return {
+            m.group(1): m.group(2)
+            for m in re.finditer(r'name="([^"]+)"\r\n(?:[^\r\n]+\r\n)*\r\n(.*?)\r\n--', text, re.S)
+        }
+    if ctype.startswith("application/json"):
+        return {k: json.dumps(v) if not isinstance(v, str) else v for k, v in json.loads(body or b"{}").items()}
+    return {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+
+
+def _outcome(text: str) -> tuple[str, str] | None:
+    """(etapa, resultado) se a mensagem encerra uma etapa assíncrona."""
+    if "COMUNIDADE DA MALU" in text:
+        return "join", "dm"
+    # última mensagem do bot depois do print
+    if "Parabéns" in text:
+        return "print", "aprovado"
+    if "novamente" in text:
+        return "print", "reprovado"
+    if "não parece o print" in text:
+        return "print", "pré-triagem"
+    if "grande demais" in text or "muitos prints" in text:
+        return "print", "recusado"
+    return None
+
+
+# ====== Bot API falsa ======
+class FakeBotAPI:
+    def __init__(self, latency: float, error_rate: float, flood_rate: float, limit: float, png: bytes):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.limit = limit  # msgs/s globais antes de devolver 429 (0 = sem limite)
+        self.png = png
+        self.server = _HTTPServer(self._handle)
+        self.calls: dict[str, int] = {}
+        self.floods = 0
+        self.errors = 0
+        self._window: list[float] = []
+        self._msg_id = 0
+        self._waiters: dict[tuple[int, str], asyncio.Future] = {}
+        self.welcomed: dict[int, int] = {}  # DMs de boas-vindas por usuário
+        self.approved: dict[tuple[int, int], int] = {}  # aprovações por (usuário, canal)
+        self.verdicts: dict[int, int] = {}  # respostas finais a prints por chat
+        self.last_at: dict[str, float] = {}
+        self.first_at: dict[str, float] = {}
+
+    def wait_for(self, chat_id: int, step: str) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[(chat_id, step)] = fut
+        return fut
+
+    def _message(self, chat_id, **extra) -> dict:
+        self._msg_id += 1
+        return {
+            "message_id": self._msg_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            **extra,
+        }
+
+    def _flooded(self) -> bool:
+        if random.random() < self.flood_rate:
+            return True
+        if not self.limit:
+            return False
+        now = time.monotonic()
+        self._window = [t for t in self._window if now - t < 1.0]
+        if len(self._window) >= self.limit:
+            return True
+        self._window.append(now)
+        return False
+
+    async def _handle(self, method, target, headers, body):
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+
+        if target.startswith("/file/"):
+            return 200, self.png, "image/png"
+
+        api = target.rsplit("/", 1)[-1]
+        self.calls[api] = self.calls.get(api, 0) + 1
+        form = _form(headers, body)
+
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return 500, b'{"ok":false,"error_code":500,"description":"Internal Server Error"}', "application/json"
+
+        if api.startswith(("send", "copy", "forward")) and self._flooded():
+            self.floods += 1
+            return 429, json.dumps({
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }).encode(), "application/json"
+
+        if api == "getUpdates":
+            # long polling sem updates: segura um pouco e devolve vazio
+            self.first_at.setdefault(api, time.monotonic())
+            await asyncio.sleep(min(float(form.get("timeout") or 0), 0.5))
+            return 200, b'{"ok":true,"result":[]}', "application/json"
+
+        result = self._result(api, form)
+        self.last_at[api] = time.monotonic()
+        return 200, json.dumps({"ok": True, "result": result}).encode(), "application/json"
+
+    def _result(self, api: str, form: dict):
+        chat_id = form.get("chat_id", "0")
+        if api == "getMe":
+            return {
+                "id": 1, "is_bot": True, "first_name": "Load", "username": "loadtest_bot",
+                "can_join_groups": True, "can_read_all_group_messages": False,
+                "supports_inline_queries": False,
+            }
+        if api == "getFile":
+            return {
+                "file_id": form.get("file_id", "f"), "file_unique_id": "u",
+                "file_size": len(self.png), "file_path": "photos/print.png",
+            }
+        if api == "approveChatJoinRequest":
+            key = (int(form["user_id"]), int(chat_id))
+            self.approved[key] = self.approved.get(key, 0) + 1
+            return True
+        if api == "sendMessage":
+            text = form.get("text", "")
+            outcome = _outcome(text)
+            if outcome:
+                step, value = outcome
+                if step == "join":
+                    self.welcomed[int(chat_id)] = self.welcomed.get(int(chat_id), 0) + 1
+                if step == "print":
+                    self.verdicts[int(chat_id)] = self.verdicts.get(int(chat_id), 0) + 1
+                fut = self._waiters.pop((int(chat_id), step), None)
+                if fut and not fut.done():
+                    fut.set_result(value)
+            return self._message(chat_id, text=text)
+        if api == "sendPhoto":
+            return self._message(chat_id, photo=[
+                {"file_id": "photo-fid", "file_unique_id": "p", "width": 720, "height": 720}
+            ])
+        if api == "sendAudio":
+            return self._message(chat_id, audio={"file_id": "audio-fid", "file_unique_id": "a", "duration": 60})
+        if api == "sendVideo":
+            return self._message(chat_id, video={
+                "file_id": "video-fid", "file_unique_id": "v", "width": 720, "height": 1280, "duration": 30,
+            })
+        if api == "sendMediaGroup":
+            media = json.loads(form.get("media", "[]"))
+            return [
+                self._message(chat_id, video={
+                    "file_id": m.get("media", "v"), "file_unique_id": f"v{i}",
+                    "width": 720, "height": 1280, "duration": 30,
+                })
+                for i, m in enumerate(media)
+            ]
+        return True
+
+
+# ====== OpenAI falso ======
+class FakeOpenAI:
+    def __init__(self, latency: float, error_rate: float, day: str):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.day = day
+        self.server = _HTTPServer(self._handle)
+        self.calls = 0
+        self.errors = 0
+
+    async def _handle(self, method, target, headers, body):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return 500, b'{"error":{"message":"fake","type":"server_error"}}', "application/json"
+
+        text = json.dumps({"valor": 50.0, "data": self.day, "hora": "12:00", "status": "concluido"})
+        resp = {
+            "id": "resp_load", "object": "response", "created_at": int(time.time()),
+            "model": "gpt-4o", "status": "completed", "parallel_tool_calls": False,
+            "tool_choice": "auto", "tools": [],
+            "output": [{
+                "type": "message", "id": "msg_load", "status": "completed", "role": "assistant",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }],
+        }
+        return 200, json.dumps(resp).encode(), "application/json"
+
+
+# ====== Usuários simulados ======
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"U{uid}"}
+
+
+def _private(uid: int) -> dict:
+    return {"id": uid, "type": "private", "first_name": f"U{uid}"}
+
+
+class Driver:
+    def __init__(self, app, fake_api: FakeBotAPI, timeout: float):
+        self.app = app
+        self.api = fake_api
+        self.timeout = timeout
+        self.samples: dict[str, list[float]] = {s: [] for s in STEPS}
+        self.failures: dict[str, int] = {s: 0 for s in STEPS}
+        self.outcomes: dict[str, int] = {}
+        self._update_id = 0
+
+    def _update(self, payload: dict):
+        from telegram import Update
+
+        self._update_id += 1
+        return Update.de_json({"update_id": self._update_id, **payload}, self.app.bot)
+
+    async def _dispatch(self, update) -> None:
+        # mesmo caminho do app.update_queue: processor por chat + handlers
+        await self.app.update_processor.process_update(update, self.app.process_update(update))
+
+    def _callback(self, uid: int, data: str) -> dict:
+        return {
+            "callback_query": {
+                "id": f"cb{uid}{data}",
+                "from": _user(uid),
+                "chat_instance": str(uid),
+                "data": data,
+                "message": {
+                    "message_id": 1, "date": int(time.time()), "chat": _private(uid),
+                    "from": {"id": 1, "is_bot": True, "first_name": "Load"}, "text": "…",
+                },
+            }
+        }
+
+    def _payloads(self, uid: int, channel_id: int):
+        now = int(time.time())
+        yield "join", {
+            "chat_join_request": {
+                "chat": {"id": channel_id, "type": "channel", "title": "Canal"},
+                "from": _user(uid), "user_chat_id": uid, "date": now,
+            }
+        }
+        yield "start", {
+            "message": {
+                "message_id": 2, "date": now, "chat": _private(uid), "from": _user(uid),
+                "text": "/start presente",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            }
+        }
+        yield "confirm_sim", self._callback(uid, "confirm_sim")
+        yield "vip_go", self._callback(uid, "vip_go")
+        yield "vip_garantir", self._callback(uid, "vip_garantir")
+        yield "print", self.photo(uid, f"print{uid}")
+
+    def photo(self, uid: int, file_id: str) -> dict:
+        return {
+            "message": {
+                "message_id": 3, "date": int(time.time()), "chat": _private(uid), "from": _user(uid),
+                "photo": [{
+                    "file_id": file_id, "file_unique_id": f"u{file_id}",
+                    "width": 720, "height": 1560, "file_size": len(self.api.png),
+                }],
+            }
+        }
+
+    async def run_user(self, uid: int, channel_id: int) -> bool:
+        for step, payload in self._payloads(uid, channel_id):
+            start = time.perf_counter()
+            try:
+                if step in ("join", "print"):
+                    # etapa só termina quando a mensagem final chega na Bot API
+                    reply = self.api.wait_for(uid, step)
+                    await self._dispatch(self._update(payload))
+                    outcome = await asyncio.wait_for(reply, self.timeout)
+                    if step == "print":
+                        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+                else:
+                    await self._dispatch(self._update(payload))
+            except Exception:
+                self.failures[step] += 1
+                return False
+            self.samples[step].append(time.perf_counter() - start)
+        return True
+
+    async def send_join(self, uid: int, channel_id: int) -> float:
+        payload = next(self._payloads(uid, channel_id))[1]
+        start = time.perf_counter()
+        await self._dispatch(self._update(payload))
+        return time.perf_counter() - start
+
+
+async def _watch_loop(stalls: list[float], stop: asyncio.Event) -> None:
+    """Quanto o loop demora para voltar de um sleep(0.001)."""
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(0.001)
+        stalls.append(time.perf_counter() - t - 0.001)
+
+
+def _stats(values: list[float]) -> dict:
+    return {
+        "n": len(values),
+        "p50": _percentile(values, 50),
+        "p95": _percentile(values, 95),
+        "p99": _percentile(values, 99),
+    }
+
+
+async def _setup(args):
+    tz = timezone(timedelta(hours=int(os.getenv("TZ_OFFSET_HOURS", "-3"))))
+    day = datetime.now(tz).strftime("%d.%m.%y")
+
+    fake_api = FakeBotAPI(args.api_latency, args.api_error_rate, args.flood_rate, args.api_limit, make_print_png())
+    fake_ai = FakeOpenAI(args.openai_latency, args.openai_error_rate, day)
+    await fake_api.server.start()
+    await fake_ai.server.start()
+
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ.update({
+        "TELEGRAM_TOKEN": TOKEN,
+        "BOT_USERNAME": "loadtest_bot",
+        "BOT_API_URL": f"http://127.0.0.1:{fake_api.server.port}",
+        "OPENAI_API_KEY": "sk-loadtest",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{fake_ai.server.port}/v1",
+        "DB_PATH": os.path.join(tmp, "bot_data.sqlite"),
+        "METRICS_PORT": "0",
+        "MEDIA_STORAGE_CHAT_ID": "",
+        "GLOBAL_MSGS_PER_SEC": str(args.global_rate),
+        "CHAT_MSGS_PER_SEC": str(args.chat_rate),
+        "JOIN_APPROVALS_PER_SEC": str(args.join_rate),
+        "JOIN_DMS_PER_SEC": str(args.join_rate),
+    })
+    return fake_api, fake_ai
+
+
+def _common(fake_api: FakeBotAPI, fake_ai: FakeOpenAI, rss: dict) -> dict:
+    import metrics
+
+    return {
+        "bot_api_calls": dict(sorted(fake_api.calls.items())),
+        "flood_429": fake_api.floods,
+        "bot_api_5xx": fake_api.errors,
+        "openai_calls": fake_ai.calls,
+        "openai_5xx": fake_ai.errors,
+        "send_retries": {"/".join(k): v for k, v in metrics.SEND_RETRIES._values.items()},
+        "rss_mib": rss,
+    }
+
+
+async def run_funnel(args) -> dict:
+    fake_api, fake_ai = await _setup(args)
+    rss_start = _rss_mib()
+    import app as bot_app
+    import webhook
+
+    application = bot_app.build_app()
+    driver = Driver(application, fake_api, args.timeout)
+    sem = asyncio.Semaphore(args.concurrency)
+    done = 0
+
+    async def one(uid: int) -> None:
+        nonlocal done
+        async with sem:
+            if await driver.run_user(uid, -1001234567890):
+                done += 1
+
+    async with webhook.running(application):
+        rss_ready = _rss_mib()
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(10_000_000 + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - t0
+        rss_end = _rss_mib()
+
+    await fake_api.server.stop()
+    await fake_ai.server.stop()
+
+    return {
+        "scenario": "funnel",
+        "users": args.users,
+        "completed": done,
+        "elapsed": elapsed,
+        "funnels_per_sec": done / elapsed if elapsed else 0.0,
+        "updates_per_sec": sum(len(v) for v in driver.samples.values()) / elapsed if elapsed else 0.0,
+        "steps": {
+            s: {**_stats(v), "failed": driver.failures[s]} for s, v in driver.samples.items()
+        },
+        "verdicts": driver.outcomes,
+        **_common(fake_api, fake_ai, {"start": rss_start, "ready": rss_ready, "end": rss_end}),
+    }
+
+
+async def run_joins(args) -> dict:
+    """
+    Rajada de join requests (com repetidos), medindo o handler, quanto tempo
+    levam para sair todas as aprovações e DMs e se houve duplicidade. Com
+    --restart, derruba o app no meio e confere se o backlog é retomado.
+    Com --channels > 1 cada usuário pede para entrar em todos os canais e
+    cada par (usuário, canal) tem que ser aprovado e ganhar sua DM.
+    """
+    fake_api, fake_ai = await _setup(args)
+    rss_start = _rss_mib()
+    import app as bot_app
+    import webhook
+
+    users = [10_000_000 + i for i in range(args.joins)]
+    channels = [-1001234567890 - i for i in range(max(1, args.channels))]
+    pairs = [(uid, channel) for uid in users for channel in channels]
+    stream = pairs + random.sample(pairs, int(len(pairs) * args.dup_rate))
+    random.shuffle(stream)
+    unique = len(pairs)
+
+    def progress() -> tuple[int, int]:
+        welcomed = sum(min(n, len(channels)) for n in fake_api.welcomed.values())
+        return len(fake_api.approved), welcomed
+
+    async def drain() -> tuple[float | None, float | None]:
+        approved_at = dm_at = None
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline:
+            approved, welcomed = progress()
+            now = time.perf_counter() - t0
+            if approved_at is None and approved >= unique:
+                approved_at = now
+            if dm_at is None and welcomed >= unique:
+                dm_at = now
+            if approved_at is not None and dm_at is not None:
+                break
+            await asyncio.sleep(0.05)
+        return approved_at, dm_at
+
+    handler: list[float] = []
+    restarted_at = None
+    t0 = time.perf_counter()
+    application = bot_app.build_app()
+    async with webhook.running(application):
+        rss_ready = _rss_mib()
+        driver = Driver(application, fake_api, args.timeout)
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def one(uid: int, channel: int) -> None:
+            async with sem:
+                handler.append(await driver.send_join(uid, channel))
+
+        await asyncio.gather(*(one(uid, channel) for uid, channel in stream))
+        enqueued = time.perf_counter() - t0
+        if args.restart:
+            while progress()[0] < unique // 2:
+                await asyncio.sleep(0.05)
+        else:
+            approved_at, dm_at = await drain()
+            rss_end = _rss_mib()
+
+    if args.restart:
+        # app novo no mesmo banco: o backlog tem que ser recarregado do SQLite
+        restarted_at = progress()
+        async with webhook.running(bot_app.build_app()):
+            approved_at, dm_at = await drain()
+            rss_end = _rss_mib()
+
+    await fake_api.server.stop()
+    await fake_ai.server.stop()
+
+    approved, welcomed = progress()
+    return {
+        "scenario": "joins",
+        "joins": len(stream),
+        "channels": len(channels),
+        "unique_requests": unique,
+        "handler": _stats(handler),
+        "enqueued_in": enqueued,
+        "approved": approved,
+        "welcomed": welcomed,
+        "all_approved_at": approved_at,
+        "all_welcomed_at": dm_at,
+        "double_approvals": sum(n - 1 for n in fake_api.approved.values()),
+        "double_dms": sum(max(0, n - len(channels)) for n in fake_api.welcomed.values()),
+        "restarted_at": restarted_at,
+        **_common(fake_api, fake_ai, {"start": rss_start, "ready": rss_ready, "end": rss_end}),
+    }
+
+
+async def run_startup(args) -> dict:
+    """
+    Sobe o app.py de verdade (outro processo, modo polling) contra a Bot API
+    falsa e mede do exec até o primeiro getUpdates. Repete --runs vezes; a
+    pior rodada é comparada com --budget.
+    """
+    fake_api, fake_ai = await _setup(args)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    runs = []
+    for _ in range(args.runs):
+        fake_api.first_at.clear()
+        t0 = time.monotonic()
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, script,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        deadline = t0 + args.timeout
+        while "getUpdates" not in fake_api.first_at and proc.returncode is None:
+            if time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.01)
+        first_poll = fake_api.first_at.get("getUpdates")
+        if proc.returncode is None:
+            proc.terminate()
+        _, err = await proc.communicate()
+        m = re.search(r"Boot até o primeiro poll: (.*)", err.decode("utf-8", "replace"))
+        runs.append({
+            "first_poll": first_poll - t0 if first_poll else None,
+            "breakdown": m.group(1).strip() if m else None,
+        })
+        if first_poll is None:
+            sys.stderr.write(err.decode("utf-8", "replace")[-2000:])
+            break
+
+    await fake_api.server.stop()
+    await fake_ai.server.stop()
+
+    times = [r["first_poll"] for r in runs if r["first_poll"] is not None]
+    worst = max(times) if len(times) == len(runs) else None
+    return {
+        "scenario": "startup",
+        "runs": runs,
+        "first_poll": _stats(times),
+        "worst": worst,
+        "budget": args.budget,
+        "over_budget": worst is None or worst > args.budget,
+    }
+
+
+async def run_validation(args) -> dict:
+    """
+    Latência do handler com --inflight validações de print em voo (download,
+    imagem no pool, OpenAI). Um update barato (foto de quem não tem print
+    pendente) sai a cada 10ms antes e durante as validações; o p99 com
+    validações em voo tem que ficar no do ocioso mais --p99-slack-ms.
+    Esse update nunca espera nada, então não vê um loop travado: o
+    _watch_loop roda junto e o maior travamento do loop com validações em
+    voo tem que ficar abaixo de --max-stall-ms.
+
+    Cada chat manda dois prints seguidos. Com a validação serializada por
+    chat sai uma chamada à OpenAI e um veredicto por chat.
+    """
+    os.environ["VALIDATION_WORKERS"] = str(args.inflight)
+    os.environ["VALIDATION_QUEUE_SIZE"] = str(args.inflight * 4)
+    fake_api, fake_ai = await _setup(args)
+    rss_start = _rss_mib()
+    import app as bot_app
+    import webhook
+
+    application = bot_app.build_app()
+    driver = Driver(application, fake_api, args.timeout)
+    users = [10_000_000 + i for i in range(args.inflight)]
+
+    async def probe(samples: list[float], stop: asyncio.Event) -> None:
+        i = 0
+        while not stop.is_set():
+            i += 1
+            update = driver._update(driver.photo(20_000_000 + i % 50, f"probe{i}"))
+            start = time.perf_counter()
+            await driver._dispatch(update)
+            samples.append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)
+
+    async def probing(samples: list[float], stalls: list[float], coro):
+        stop = asyncio.Event()
+        tasks = [
+            asyncio.create_task(probe(samples, stop)),
+            asyncio.create_task(_watch_loop(stalls, stop)),
+        ]
+        try:
+            return await coro
+        finally:
+            stop.set()
+            await asyncio.gather(*tasks)
+
+    async def two_prints(uid: int) -> None:
+        await asyncio.gather(
+            driver._dispatch(driver._update(driver.photo(uid, f"print{uid}a"))),
+            driver._dispatch(driver._update(driver.photo(uid, f"print{uid}b"))),
+        )
+
+    async def validations() -> float:
+        start = time.perf_counter()
+        await asyncio.gather(*(two_prints(uid) for uid in users))
+        await asyncio.wait_for(bot_app._validation_queue.join(), args.timeout)
+        return time.perf_counter() - start
+
+    idle: list[float] = []
+    loaded: list[float] = []
+    idle_stalls: list[float] = []
+    loaded_stalls: list[float] = []
+    async with webhook.running(application):
+        rss_ready = _rss_mib()
+        for uid in users:
+            bot_app.VIP_PENDING_PRINT.add(uid)
+        await bot_app.openai_client()  # o app já começou a carregar no startup
+        await probing(idle, idle_stalls, asyncio.sleep(2))
+        elapsed = await probing(loaded, loaded_stalls, validations())
+        rss_end = _rss_mib()
+
+    await fake_api.server.stop()
+    await fake_ai.server.stop()
+
+    idle_s, loaded_s = _stats(idle), _stats(loaded)
+    double = sum(n - 1 for n in fake_api.verdicts.values())
+    return {
+        "scenario": "validation",
+        "inflight": args.inflight,
+        "elapsed": elapsed,
+        "idle": idle_s,
+        "loaded": loaded_s,
+        "slack_ms": args.p99_slack_ms,
+        "stall_ms": {
+            "idle": max(idle_stalls, default=0) * 1000,
+            "loaded": max(loaded_stalls, default=0) * 1000,
+        },
+        "max_stall_ms": args.max_stall_ms,
+        "verdicts": sum(fake_api.verdicts.values()),
+        "double_verdicts": double,
+        "over_budget": double > 0
+        or (loaded_s["p99"] - idle_s["p99"]) * 1000 > args.p99_slack_ms
+        or max(loaded_stalls, default=0) * 1000 > args.max_stall_ms,
+        **_common(fake_api, fake_ai, {"start": rss_start, "ready": rss_ready, "end": rss_end}),
+    }
+
+
+async def run_ordering(args) -> dict:
+    """
+    Confere o PerChatUpdateProcessor sozinho: --chats chats mandam
+    --per-chat updates cada, intercalados (mensagens, callbacks e join
+    requests, que contam no chat privado do usuário). Cada update leva
+    ~10ms. Falha se dois updates do mesmo chat rodarem ao mesmo tempo ou
+    fora da ordem de chegada, ou se chats diferentes não rodarem em paralelo.
+    """
+    from telegram import Update
+
+    from update_processor import PerChatUpdateProcessor, chat_key
+
+    processor = PerChatUpdateProcessor(args.concurrency)
+    chats = [10_000_000 + i for i in range(args.chats)]
+    driver = Driver(None, None, args.timeout)
+    kinds = ("message", "callback", "join")
+    stream = []
+    for seq in range(args.per_chat):
+        batch = []
+        for uid in chats:
+            kind = kinds[seq % len(kinds)]
+            if kind == "message":
+                payload = {"message": {
+                    "message_id": seq, "date": int(time.time()), "chat": _private(uid),
+                    "from": _user(uid), "text": str(seq),
+                }}
+            elif kind == "callback":
+                payload = driver._callback(uid, str(seq))
+            else:
+                payload = next(driver._payloads(uid, -1001234567890))[1]
+            batch.append((uid, seq, payload))
+        random.shuffle(batch)  # intercala chats, mantendo a ordem dentro de cada um
+        stream.extend(batch)
+
+    started: dict[int, list[int]] = {uid: [] for uid in chats}
+    running: set[int] = set()
+    overlaps = 0
+    active = peak = 0
+
+    async def handle(uid: int, seq: int) -> None:
+        nonlocal overlaps, active, peak
+        if uid in running:
+            overlaps += 1
+        running.add(uid)
+        started[uid].append(seq)
+        active += 1
+        peak = max(peak, active)
+        try:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * 0.01)
+        finally:
+            active -= 1
+            running.discard(uid)
+
+    t0 = time.perf_counter()
+    tasks = []
+    for i, (uid, seq, payload) in enumerate(stream):
+        update = Update.de_json({"update_id": i + 1, **payload}, None)
+        assert chat_key(update) == uid
+        # como o Application faz com concurrent_updates: uma task por update, na ordem de chegada
+        tasks.append(asyncio.create_task(processor.process_update(update, handle(uid, seq))))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t0
+
+    out_of_order = sum(1 for seqs in started.values() if seqs != sorted(seqs))
+    serial = args.per_chat * 0.01
+    return {
+        "scenario": "ordering",
+        "chats": args.chats,
+        "per_chat": args.per_chat,
+        "updates": len(stream),
+        "elapsed": elapsed,
+        "serial_per_chat": serial,
+        "peak_parallel": peak,
+        "overlaps": overlaps,
+        "out_of_order_chats": out_of_order,
+        "leaked_locks": processor.active_chats(),
+        "over_budget": bool(
+            overlaps or out_of_order or processor.active_chats()
+            or (args.chats > 1 and peak < 2)
+        ),
+    }
+
+
+async def run_followups(args) -> dict:
+    """
+    Benchmark do FollowupScheduler com --followups follow-ups pendentes
+    contra o jeito antigo, um Job do JobQueue (APScheduler) por chat.
+
+    Cada lado roda duas vezes. Na primeira, com tracemalloc, mede a
+    memória do que fica vivo depois de agendar tudo (com as escritas no
+    SQLite já drenadas) e quanto o agendamento levou. Na segunda, sem
+    tracemalloc, todos vencem numa janela de --window segundos que só
+    começa depois do agendamento, e o tick roda a cada 1s como no app:
+    mede o atraso de cada disparo. Mede também quanto o load() leva para
+    recarregar tudo do SQLite (restart).
+    """
+    import gc
+    import tracemalloc
+
+    tmp = tempfile.mkdtemp(prefix="loadtest-followups-")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bot_data.sqlite")
+    import db
+    from scheduler import FollowupScheduler
+    from telegram.ext import ApplicationBuilder, JobQueue
+
+    db.init_db()
+    n = args.followups
+    chats = range(10_000_000, 10_000_000 + n)
+
+    def traced(schedule_all) -> tuple[float, float]:
+        """(MiB vivos depois de agendar, segundos para agendar)."""
+        gc.collect()
+        tracemalloc.start()
+        try:
+            base = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            kept = schedule_all(time.time() + 3600)
+            took = time.perf_counter() - start
+            gc.collect()
+            mib = (tracemalloc.get_traced_memory()[0] - base) / 2**20
+        finally:
+            tracemalloc.stop()
+        del kept
+        return mib, took
+
+    async def fire_all(schedule_all, fired: list[float], lead: float, tick=None) -> dict:
+        start_at = time.time() + lead
+        kept = schedule_all(start_at)
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+        start = time.monotonic()
+        while len(fired) < n and time.monotonic() - start < args.timeout:
+            if tick is not None:
+                await tick(kept)
+            await asyncio.sleep(1)
+        elapsed = time.monotonic() - start
+        return {**_stats(fired), "max": max(fired, default=0.0), "fired": len(fired), "elapsed": elapsed}
+
+    # ---- depois: heap + SQLite ----
+    fired_new: list[float] = []
+
+    async def on_due(context, chat_id: int) -> None:
+        fired_new.append(time.time() - due_new[chat_id])
+
+    due_new: dict[int, float] = {}
+
+    def schedule_new(start_at: float) -> FollowupScheduler:
+        sched = FollowupScheduler(args.followup_batch)
+        sched.register("bench", on_due)
+        sched.load()
+        for i, chat_id in enumerate(chats):
+            due = start_at + args.window * i / n
+            due_new[chat_id] = due
+            sched.schedule(chat_id, "bench", due - time.time())
+        db.submit(time.time).result()  # escritas drenadas
+        return sched
+
+    def clear_followups() -> None:
+        with db.get_conn() as conn:
+            conn.execute("DELETE FROM followups")
+            conn.commit()
+
+    mem_new, took_new = traced(schedule_new)
+    t = time.monotonic()
+    reloaded = FollowupScheduler().load()
+    reload_s = time.monotonic() - t
+    await db.run(clear_followups)
+    due_new.clear()
+    new = {
+        "mem_mib": mem_new,
+        "schedule_s": took_new,
+        "reload_s": reload_s,
+        "reloaded": reloaded,
+        **await fire_all(schedule_new, fired_new, took_new + 2, lambda s: s.tick(None)),
+    }
+
+    # ---- antes: um Job por chat no JobQueue ----
+    fired_old: list[float] = []
+
+    async def old_job(context) -> None:
+        fired_old.append(time.time() - context.job.data)
+
+    # o JobQueue só guarda uma weakref do app: os dois ficam vivos aqui, e
+    # montá-los não entra na conta de memória. Como no app, os jobs entram
+    # com o JobQueue já rodando. Sem misfire_grace_time o APScheduler
+    # descarta o job atrasado mais de 1s; aqui ele sai mesmo atrasado,
+    # para o atraso aparecer no p99 em vez de sumir da contagem.
+    apps = [ApplicationBuilder().token(TOKEN).job_queue(JobQueue()).build() for _ in range(2)]
+    for application in apps:
+        await application.job_queue.start()
+    spare = iter(apps)
+
+    def schedule_old(start_at: float) -> JobQueue:
+        jq = next(spare).job_queue
+        for i, chat_id in enumerate(chats):
+            due = start_at + args.window * i / n
+            jq.run_once(
+                old_job, due - time.time(), chat_id=chat_id, data=due,
+                job_kwargs={"misfire_grace_time": None},
+            )
+        return jq
+
+    mem_old, took_old = traced(schedule_old)
+    old = {
+        "mem_mib": mem_old,
+        "schedule_s": took_old,
+        **await fire_all(schedule_old, fired_old, took_old + 2),
+    }
+    for application in apps:
+        await application.job_queue.stop(wait=False)
+    db.close()
+
+    return {
+        "scenario": "followups",
+        "followups": n,
+        "window": args.window,
+        "antes": old,
+        "depois": new,
+    }
+
+
+async def run_prescreen(args) -> dict:
+    """
+    Pré-triagem (prescreen.screen) contra um conjunto rotulado sintético:
+    --per-kind imagens de cada tipo de PRESCREEN_SAMPLES, gravadas em
+    --samples (ou numa pasta temporária) no layout ok/junk do
+    `python prescreen.py`. Sai com código 1 se algum print válido for
+    recusado: na dúvida a imagem tem que ir para o modelo.
+    """
+    import prescreen
+    from PIL import Image
+
+    root = args.samples or tempfile.mkdtemp(prefix="loadtest-prescreen-")
+    files = write_prescreen_samples(root, args.per_kind)
+    kinds = {}
+    for kind, paths in files.items():
+        reasons: dict[str, int] = {}
+        for path in paths:
+            with Image.open(path) as img:
+                result = prescreen.screen(img)
+            if not result.ok:
+                reasons[result.reason] = reasons.get(result.reason, 0) + 1
+        kinds[kind] = {
+            "label": PRESCREEN_SAMPLES[kind][0],
+            "n": len(paths),
+            "rejected": sum(reasons.values()),
+            "reasons": reasons,
+        }
+    metrics = prescreen.evaluate(root)
+    return {
+        "scenario": "prescreen",
+        "samples": root,
+        "kinds": kinds,
+        **metrics,
+        "over_budget": metrics["fn"] > 0,
+    }
+
+
+async def run_images(args) -> dict:
+    """
+    Re-encode dos prints (_prepare_image: decode, dHash, pré-triagem, PNG
+    optimize + base64) inline no event loop contra o pool de threads e o
+    de processos, com --images screenshots sintéticos de celular chegando
+    de uma vez. Mede prints/s e o maior travamento do loop em cada modo.
+    """
+    tmp = tempfile.mkdtemp(prefix="loadtest-images-")
+    os.environ.update({
+        "TELEGRAM_TOKEN": TOKEN,
+        "BOT_USERNAME": "loadtest_bot",
+        "OPENAI_API_KEY": "sk-loadtest",
+        "DB_PATH": os.path.join(tmp, "bot_data.sqlite"),
+        "METRICS_PORT": "0",
+        # tudo entra na fila do pool de uma vez: o timeout é por print
+        "IMAGE_ENCODE_TIMEOUT_SECONDS": str(args.timeout),
+    })
+    import app as bot_app
+
+    samples = [make_print_png(seed=i, size=(1080, 2400)) for i in range(args.images)]
+    kb = sum(len(raw) for raw in samples) / len(samples) / 1024
+
+    async def inline(raw):
+        return bot_app._prepare_image(raw)
+
+    results = {}
+    for mode in ("inline", "thread", "process"):
+        prepare = inline
+        if mode != "inline":
+            bot_app.shutdown_image_pool()
+            bot_app.IMAGE_POOL_KIND = mode
+            prepare = bot_app.prepare_image
+            await prepare(memoryview(samples[0]))  # sobe o pool fora da medição
+        stalls: list[float] = []
+        stop = asyncio.Event()
+        watcher = asyncio.create_task(_watch_loop(stalls, stop))
+        start = time.perf_counter()
+        out = await asyncio.gather(*(prepare(memoryview(raw)) for raw in samples))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await watcher
+        results[mode] = {
+            "per_sec": len(samples) / elapsed,
+            "max_stall_ms": max(stalls, default=0) * 1000,
+            "rejected": sum(1 for data_url, _, _ in out if data_url is None),
+        }
+    bot_app.shutdown_image_pool()
+
+    return {
+        "scenario": "images",
+        "images": len(samples),
+        "avg_kib": kb,
+        "workers": bot_app.IMAGE_POOL_WORKERS,
+        "cpus": os.cpu_count(),
+        "modes": results,
+    }
+
+
+_LEGACY_SCHEMA = (
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, telegram_id INTEGER UNIQUE, username TEXT,"
+    " full_name TEXT, consent INTEGER DEFAULT 0, source TEXT, stage TEXT,"
+    " created_at DATETIME DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE events (id INTEGER PRIMARY KEY, telegram_id INTEGER, event TEXT, meta TEXT,"
+    " created_at DATETIME DEFAULT CURRENT_TIMESTAMP)",
+)
+
+
+async def run_db(args) -> dict:
+    """
+    Microbenchmark do db.py: escritas/s no jeito antigo (uma conexão e um
+    commit por escrita, journal padrão) contra a conexão longa em WAL pela
+    thread de escrita (upsert_user) e o buffer de eventos (log_event).
+    Mede também o maior travamento do event loop durante cada rodada.
+    """
+    tmp = tempfile.mkdtemp(prefix="loadtest-db-")
+    legacy_path = os.path.join(tmp, "legacy.sqlite")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bot_data.sqlite")
+    import db
+
+    db.init_db()
+    conn = sqlite3.connect(legacy_path)
+    for ddl in _LEGACY_SCHEMA:
+        conn.execute(ddl)
+    conn.commit()
+    conn.close()
+
+    n = args.writes
+    stalls: list[float] = []
+
+    async def timed(fn) -> dict:
+        stalls.clear()
+        stop = asyncio.Event()
+        watcher = asyncio.create_task(_watch_loop(stalls, stop))
+        start = time.perf_counter()
+        await fn()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await watcher
+        return {"per_sec": n / elapsed, "max_stall_ms": max(stalls, default=0) * 1000}
+
+    def legacy_write(sql: str, params: tuple) -> None:
+        c = sqlite3.connect(legacy_path)
+        c.execute(sql, params)
+        c.commit()
+        c.close()
+
+    async def legacy_users() -> None:
+        for i in range(n):
+            legacy_write(
+                "INSERT INTO users (telegram_id, username, full_name) VALUES (?, ?, ?)"
+                " ON CONFLICT(telegram_id) DO UPDATE SET username=excluded.username",
+                (i, f"u{i}", f"User {i}"),
+            )
+            await asyncio.sleep(0)
+
+    async def legacy_events() -> None:
+        for i in range(n):
+            legacy_write("INSERT INTO events (telegram_id, event) VALUES (?, ?)", (i, "start"))
+            await asyncio.sleep(0)
+
+    async def pooled_users() -> None:
+        # em levas de 100, como vários handlers aguardando ao mesmo tempo
+        for lo in range(0, n, 100):
+            await asyncio.gather(
+                *(db.run(db.upsert_user, i, f"u{i}", f"User {i}") for i in range(lo, min(n, lo + 100)))
+            )
+
+    async def buffered_events() -> None:
+        for i in range(n):
+            db.log_event(i, "start")
+        await asyncio.to_thread(db.flush_events)
+
+    result = {
+        "scenario": "db",
+        "writes": n,
+        "upsert_user": {"antes": await timed(legacy_users), "depois": await timed(pooled_users)},
+        "log_event": {"antes": await timed(legacy_events), "depois": await timed(buffered_events)},
+    }
+    db.close()
+    return result
+
+
+def _print_common(r: dict) -> None:
+    print(f"Bot API: {r['bot_api_calls']}")
+    print(f"flood control (429): {r['flood_429']}  5xx: {r['bot_api_5xx']}  retentativas: {r['send_retries']}")
+    print(f"OpenAI: {r['openai_calls']} chamadas, {r['openai_5xx']} com 5xx")
+    m = r["rss_mib"]
+    print(
+        f"memória (RSS): início {m['start']:.0f} MiB, app pronto {m['ready']:.0f} MiB, "
+        f"fim {m['end']:.0f} MiB (+{m['end'] - m['ready']:.0f} MiB durante o teste)"
+    )
+
+
+def print_report(r: dict) -> None:
+    if r["scenario"] == "db":
+        print(f"{r['writes']} escritas por rodada\n")
+        print(f"{'':<14}{'antes':>14}{'depois':>14}{'loop travado (antes/depois)':>32}")
+        for name in ("upsert_user", "log_event"):
+            before, after = r[name]["antes"], r[name]["depois"]
+            print(
+                f"{name:<14}{before['per_sec']:>12.0f}/s{after['per_sec']:>12.0f}/s"
+                f"{before['max_stall_ms']:>20.1f}ms / {after['max_stall_ms']:.1f}ms"
+            )
+        return
+
+    if r["scenario"] == "prescreen":
+        print(f"amostras em {r['samples']}\n")
+        print(f"{'':<14}{'rótulo':<8}{'n':>5}{'recusadas':>11}  motivos")
+        for kind, x in r["kinds"].items():
+            reasons = ", ".join(f"{k}={v}" for k, v in x["reasons"].items()) or "-"
+            print(f"{kind:<14}{x['label']:<8}{x['n']:>5}{x['rejected']:>11}  {reasons}")
+        print(
+            f"\nprecisão={r['precision']:.2%} recall={r['recall']:.2%} "
+            f"chamadas evitadas={r['calls_saved']:.2%}"
+        )
+        print("ESTOUROU: print válido recusado" if r["over_budget"] else "nenhum print válido recusado")
+        return
+
+    if r["scenario"] == "images":
+        print(
+            f"{r['images']} prints 1080x2400 (~{r['avg_kib']:.0f} KiB), "
+            f"pool com {r['workers']} workers, {r['cpus']} CPUs\n"
+        )
+        print(f"{'':<10}{'prints/s':>10}{'loop travado':>15}{'recusados':>11}")
+        for mode, x in r["modes"].items():
+            print(f"{mode:<10}{x['per_sec']:>10.1f}{x['max_stall_ms']:>13.0f}ms{x['rejected']:>11}")
+        return
+
+    if r["scenario"] == "followups":
+        print(f"{r['followups']} follow-ups vencendo numa janela de {r['window']:.0f}s\n")
+        print(
+            f"{'':<10}{'memória':>10}{'por item':>10}{'agendar':>9}"
+            f"{'disparados':>12}{'p50':>9}{'p99':>9}{'máx':>9}"
+        )
+        for name in ("antes", "depois"):
+            x = r[name]
+            print(
+                f"{name:<10}{x['mem_mib']:>6.1f} MiB{x['mem_mib'] * 2**20 / r['followups']:>8.0f} B"
+                f"{x['schedule_s']:>8.1f}s{x['fired']:>12}"
+                f"{x['p50'] * 1000:>7.0f}ms{x['p99'] * 1000:>7.0f}ms{x['max'] * 1000:>7.0f}ms"
+            )
+        d = r["depois"]
+        print(f"\nrestart: load() de {d['reloaded']} follow-ups do SQLite em {d['reload_s'] * 1000:.0f}ms")
+        return
+
+    if r["scenario"] == "ordering":
+        print(
+            f"\n{r['updates']} updates de {r['chats']} chats ({r['per_chat']} por chat) "
+            f"em {r['elapsed']:.2f}s (um chat sozinho levaria ~{r['serial_per_chat']:.2f}s)"
+        )
+        print(f"chats em paralelo no pico: {r['peak_parallel']}")
+        print(
+            f"sobreposições no mesmo chat: {r['overlaps']}; chats fora de ordem: "
+            f"{r['out_of_order_chats']}; locks sobrando: {r['leaked_locks']}"
+        )
+        print("FALHOU" if r["over_budget"] else "ordem por chat e paralelismo entre chats ok")
+        return
+
+    if r["scenario"] == "validation":
+        print(f"\n{r['inflight']} chats com 2 prints cada, validados em {r['elapsed']:.1f}s")
+        for label in ("idle", "loaded"):
+            s = r[label]
+            print(
+                f"handler {'ocioso' if label == 'idle' else 'com validações':<16} n={s['n']:<5} "
+                f"p50 {s['p50'] * 1000:.1f}ms p99 {s['p99'] * 1000:.1f}ms"
+            )
+        print(
+            f"loop travado: ocioso {r['stall_ms']['idle']:.1f}ms, "
+            f"com validações {r['stall_ms']['loaded']:.1f}ms (máx. {r['max_stall_ms']:.0f}ms)"
+        )
+        print(f"veredictos: {r['verdicts']} ({r['double_verdicts']} repetidos no mesmo chat)")
+        _print_common(r)
+        print(
+            f"ESTOUROU: p99 subiu mais de {r['slack_ms']:.0f}ms, o loop travou mais de "
+            f"{r['max_stall_ms']:.0f}ms ou houve veredicto repetido"
+            if r["over_budget"] else "p99 estável, loop livre"
+        )
+        return
+
+    if r["scenario"] == "startup":
+        for i, run in enumerate(r["runs"], 1):
+            took = f"{run['first_poll']:.2f}s" if run["first_poll"] is not None else "não chegou"
+            print(f"rodada {i}: primeiro getUpdates em {took}  ({run['breakdown'] or 'sem breakdown'})")
+        s = r["first_poll"]
+        print(f"p50 {s['p50']:.2f}s, pior {r['worst'] or float('nan'):.2f}s, orçamento {r['budget']:.2f}s")
+        print("ESTOUROU o orçamento" if r["over_budget"] else "dentro do orçamento")
+        return
+
+    if r["scenario"] == "joins":
+        h = r["handler"]
+        print(
+            f"\njoin requests={r['joins']} em {r['channels']} canal(is) "
+            f"(pedidos únicos={r['unique_requests']})"
+        )
+        print(
+            f"handler: p50 {h['p50'] * 1000:.1f}ms p99 {h['p99'] * 1000:.1f}ms; "
+            f"tudo enfileirado em {r['enqueued_in']:.1f}s"
+        )
+        for label, key, n in (
+            ("aprovações", "all_approved_at", r["approved"]),
+            ("DMs", "all_welcomed_at", r["welcomed"]),
+        ):
+            at = r[key]
+            rate = f"{n / at:.0f}/s" if at else "não terminou"
+            print(f"{label}: {n}/{r['unique_requests']} em {at or float('nan'):.1f}s ({rate})")
+        print(f"duplicadas: {r['double_approvals']} aprovações, {r['double_dms']} DMs")
+        if r["restarted_at"]:
+            print(f"restart com (aprovados, DMs) = {r['restarted_at']}")
+        _print_common(r)
+        return
+
+    print(f"\nusuários={r['users']} concluídos={r['completed']} tempo={r['elapsed']:.1f}s")
+    print(f"vazão: {r['funnels_per_sec']:.1f} funis/s, {r['updates_per_sec']:.1f} updates/s\n")
+    print(f"{'etapa':<14}{'n':>7}{'falhas':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for step, s in r["steps"].items():
+        print(
+            f"{step:<14}{s['n']:>7}{s['failed']:>8}"
+            f"{s['p50'] * 1000:>7.0f}ms{s['p95'] * 1000:>7.0f}ms{s['p99'] * 1000:>7.0f}ms"
+        )
+    print(f"\nresultado dos prints: {r['verdicts']}")
+    _print_common(r)
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Teste de carga offline do funil")
+    p.add_argument(
+        "--scenario",
+        choices=(
+            "funnel", "joins", "startup", "db", "validation", "ordering", "followups", "images", "prescreen",
+        ),
+        default="funnel",
+    )
+    p.add_argument("--users", type=int, default=100)
+    p.add_argument("--concurrency", type=int, default=500, help="usuários simultâneos no funil")
+    p.add_argument("--api-latency", type=float, default=0.05, help="latência média da Bot API falsa (s)")
+    p.add_argument("--api-error-rate", type=float, default=0.0, help="fração de respostas 500")
+    p.add_argument("--flood-rate", type=float, default=0.0, help="fração de envios com 429 aleatório")
+    p.add_argument("--api-limit", type=float, default=30, help="envios/s globais antes de 429 (0 = sem limite)")
+    p.add_argument("--openai-latency", type=float, default=1.5)
+    p.add_argument("--openai-error-rate", type=float, default=0.0)
+    p.add_argument("--global-rate", type=float, default=25, help="GLOBAL_MSGS_PER_SEC do bot")
+    p.add_argument("--chat-rate", type=float, default=1, help="CHAT_MSGS_PER_SEC do bot")
+    p.add_argument("--join-rate", type=float, default=20, help="JOIN_APPROVALS_PER_SEC e JOIN_DMS_PER_SEC")
+    p.add_argument("--joins", type=int, default=10_000, help="cenário joins: usuários na rajada")
+    p.add_argument("--dup-rate", type=float, default=0.05, help="cenário joins: fração de pedidos repetidos")
+    p.add_argument("--channels", type=int, default=1, help="cenário joins: canais por usuário")
+    p.add_argument("--restart", action="store_true", help="cenário joins: reinicia o app no meio")
+    p.add_argument("--runs", type=int, default=3, help="cenário startup: quantas vezes subir o app")
+    p.add_argument("--budget", type=float, default=3.0, help="cenário startup: tempo máximo até o primeiro poll (s)")
+    p.add_argument("--writes", type=int, default=2000, help="cenário db: escritas por rodada")
+    p.add_argument("--images", type=int, default=24, help="cenário images: prints na rajada")
+    p.add_argument("--per-kind", type=int, default=20, help="cenário prescreen: imagens por tipo")
+    p.add_argument("--samples", default=None, help="cenário prescreen: pasta onde gravar as amostras")
+    p.add_argument("--followups", type=int, default=100_000, help="cenário followups: follow-ups agendados")
+    p.add_argument("--window", type=float, default=10, help="cenário followups: janela de vencimento (s)")
+    p.add_argument("--followup-batch", type=int, default=200, help="cenário followups: FOLLOWUP_BATCH_SIZE")
+    p.add_argument("--chats", type=int, default=200, help="cenário ordering: chats intercalados")
+    p.add_argument("--per-chat", type=int, default=30, help="cenário ordering: updates por chat")
+    p.add_argument("--inflight", type=int, default=20, help="cenário validation: validações em voo")
+    p.add_argument(
+        "--p99-slack-ms", type=float, default=10, help="cenário validation: quanto o p99 pode subir"
+    )
+    p.add_argument(
+        "--max-stall-ms", type=float, default=100, help="cenário validation: maior travamento do loop aceito"
+    )
+    p.add_argument("--timeout", type=float, default=900, help="espera máxima por etapa/backlog (s)")
+    p.add_argument("--json", action="store_true", help="imprime o resultado em JSON")
+    args = p.parse_args()
+
+    runner = {
+        "funnel": run_funnel,
+        "joins": run_joins,
+        "startup": run_startup,
+        "db": run_db,
+        "validation": run_validation,
+        "ordering": run_ordering,
+        "followups": run_followups,
+        "images": run_images,
+        "prescreen": run_prescreen,
+    }[args.scenario]
+    result = asyncio.run(runner(args))
+    if args.json:
+        json.dump(result, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+    else:
+        print_report(result)
+    if result.get("over_budget"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
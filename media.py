@@ -0,0 +1,167 @@
+import asyncio
+import json
+import logging
+
+import db
+
+log = logging.getLogger("presente-vip-unificado.media")
+
+
+class MediaRegistry:
+    """
+    file_ids das mídias (img1, img2, audio, video1..3...) em memória,
+    persistidos no SQLite (tabela media) em write-behind.
+
+    - Leitura: só o dict em memória.
+    - Escrita: marca o slot como sujo; várias mudanças seguidas viram um
+      único flush na thread de escrita do db, `flush_delay` segundos depois.
+    - Cada slot tem uma versão que sobe a cada gravação; refresh() puxa o
+      que outros processos gravaram sem sobrescrever mudanças locais
+      ainda não gravadas (ou gravando).
+
+    O estado em memória só muda no event loop: a thread do db lê e grava,
+    e o resultado volta para o loop (call_soon_threadsafe).
+    """
+
+    def __init__(self, legacy_json: str | None = None, flush_delay: float = 1.0):
+        self.legacy_json = legacy_json
+        self.flush_delay = flush_delay
+        self._ids: dict[str, str] = {}
+        self._versions: dict[str, int] = {}
+        self._dirty: set[str] = set()
+        self._inflight: set[str] = set()  # já mandados para o db, sem confirmação
+        self._flush_pending = False
+        self._loaded = False
+
+    # ---- leitura ----
+    def _load(self, rows: dict[str, tuple[str, int]] | None = None) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if rows is None:
+            rows = db.load_media()
+        if not rows and self.legacy_json:
+            rows = self._import_legacy()
+        for slot, (file_id, version) in rows.items():
+            self._ids[slot] = file_id
+            self._versions[slot] = version
+
+    def _import_legacy(self) -> dict[str, tuple[str, int]]:
+        try:
+            with open(self.legacy_json, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        items = [(k, v) for k, v in data.items() if isinstance(v, str) and v]
+        if items:
+            db.save_media(items, [])
+            log.info("file_ids.json migrado para o SQLite (%s slots)", len(items))
+        return db.load_media()
+
+    def get(self, slot: str, default=None):
+        self._load()
+        return self._ids.get(slot, default)
+
+    def __getitem__(self, slot: str) -> str:
+        self._load()
+        return self._ids[slot]
+
+    def __contains__(self, slot: str) -> bool:
+        self._load()
+        return slot in self._ids
+
+    def snapshot(self) -> dict[str, str]:
+        self._load()
+        return dict(self._ids)
+
+    # ---- escrita ----
+    def __setitem__(self, slot: str, file_id: str) -> None:
+        self._load()
+        if self._ids.get(slot) == file_id:
+            return
+        self._ids[slot] = file_id
+        self._mark_dirty(slot)
+
+    def pop(self, slot: str, default=None):
+        self._load()
+        value = self._ids.pop(slot, default)
+        if value is not default:
+            self._mark_dirty(slot)
+        return value
+
+    def _mark_dirty(self, slot: str) -> None:
+        self._dirty.add(slot)
+        if self._flush_pending:
+            return
+        self._flush_pending = True
+        try:
+            asyncio.get_running_loop().call_later(self.flush_delay, self.flush)
+        except RuntimeError:
+            self.flush()  # fora do event loop (scripts): grava na hora
+
+    def flush(self) -> None:
+        self._flush_pending = False
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts = [(s, self._ids[s]) for s in dirty if s in self._ids]
+        deletes = [s for s in dirty if s not in self._ids]
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        fut = db.submit(db.save_media, upserts, deletes)
+        self._inflight |= dirty
+        fut.add_done_callback(lambda f: self._on_saved(loop, dirty, f))
+
+    def _on_saved(self, loop, slots: set[str], fut) -> None:
+        # roda na thread do db: devolve para o loop antes de mexer no estado
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._saved, slots, fut)
+                return
+            except RuntimeError:
+                pass  # loop já fechado (flush do shutdown): ninguém mais lê
+        self._saved(slots, fut)
+
+    def _saved(self, slots: set[str], fut) -> None:
+        self._inflight -= slots
+        exc = fut.exception()
+        if exc is not None:
+            # fica sujo de novo: sai no próximo flush
+            log.warning("Falha gravando file_ids %s: %s", sorted(slots), exc)
+            self._dirty |= slots
+            return
+        # a versão gravada por nós passa a ser a nossa; sem isso o próximo
+        # refresh acharia que a própria escrita veio de outro processo
+        versions = fut.result()
+        for slot in slots:
+            if slot in versions:
+                self._versions[slot] = versions[slot]
+            else:
+                self._versions.pop(slot, None)
+
+    async def refresh(self) -> None:
+        """Traz gravações de outros processos (versão maior que a nossa)."""
+        self.apply(await db.run(db.load_media))
+
+    def apply(self, rows: dict[str, tuple[str, int]]) -> None:
+        """Aplica linhas lidas da tabela media. Só no event loop."""
+        if not self._loaded:
+            self._load(rows)
+            return
+        busy = self._dirty | self._inflight
+        for slot, (file_id, version) in rows.items():
+            if slot in busy:
+                continue
+            if version > self._versions.get(slot, 0):
+                self._ids[slot] = file_id
+                self._versions[slot] = version
+        for slot in list(self._ids):
+            if slot not in rows and slot not in busy and slot in self._versions:
+                del self._ids[slot]
+                del self._versions[slot]
+
+
+def parse_admin_ids(raw: str) -> set[int]:
+    return {int(x) for x in raw.replace(" ", "").split(",") if x.lstrip("-").isdigit()}
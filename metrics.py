@@ -0,0 +1,235 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from telegram.request import HTTPXRequest
+
+log = logging.getLogger("presente-vip-unificado.metrics")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for n, v in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            out.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return out
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # por label: [contagem por bucket..., +Inf], soma
+        self._values: dict[tuple, tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                labels, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[idx] += 1
+            total[0] += value
+
+    def time(self, *labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, (list(c), t[0])) for k, (c, t) in self._values.items()]
+        names = self.labelnames + ("le",)
+        for labels, (counts, total) in items:
+            acc = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                acc += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append(f"{self.name}_bucket{_labels(names, labels + (le,))} {acc}")
+            lbl = _labels(self.labelnames, labels)
+            out.append(f"{self.name}_sum{lbl} {total}")
+            out.append(f"{self.name}_count{lbl} {acc}")
+        return out
+
+
+class _Timer:
+    __slots__ = ("_hist", "_labels", "_start")
+
+    def __init__(self, hist: Histogram, labels: tuple):
+        self._hist = hist
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._hist.observe(time.perf_counter() - self._start, *self._labels)
+        return False
+
+
+class Gauge:
+    """
+    Valor lido na hora do scrape (ex.: tamanho de fila). Com
+    kind="counter" serve para contadores mantidos fora daqui.
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> list[str]:
+        try:
+            value = float(self.fn())
+        except Exception:
+            return []
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}",
+            f"{self.name} {value}",
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float], kind: str = "gauge") -> Gauge:
+        return self.register(Gauge(name, help, fn, kind))
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(
+    Histogram("bot_handler_seconds", "Latência dos handlers", ("handler",))
+)
+HANDLER_ERRORS = REGISTRY.register(
+    Counter("bot_handler_errors_total", "Exceções nos handlers", ("handler",))
+)
+BOT_API_SECONDS = REGISTRY.register(
+    Histogram("bot_api_request_seconds", "Latência das chamadas à Bot API", ("method",))
+)
+BOT_API_ERRORS = REGISTRY.register(
+    Counter("bot_api_errors_total", "Erros da Bot API", ("method", "code"))
+)
+SEND_RETRIES = REGISTRY.register(
+    Counter("bot_send_retries_total", "Retentativas no _retry_send", ("method", "reason"))
+)
+OPENAI_SECONDS = REGISTRY.register(
+    Histogram("openai_request_seconds", "Latência da validação no OpenAI", ("outcome",))
+)
+FUNNEL_COALESCED = REGISTRY.register(
+    Counter("funnel_coalesced_total", "Gatilhos repetidos do funil que não geraram envio", ("action",))
+)
+PRESCREEN_REJECTS = REGISTRY.register(
+    Counter("prescreen_rejects_total", "Prints recusados na pré-triagem local", ("reason",))
+)
+
+
+def instrument(fn):
+    """Decorator para handlers: mede latência e conta exceções."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, name)
+
+    return wrapper
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest que mede cada chamada à Bot API por método."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            BOT_API_ERRORS.inc(endpoint, type(e).__name__)
+            raise
+        finally:
+            BOT_API_SECONDS.observe(time.perf_counter() - start, endpoint)
+        if code >= 400:
+            BOT_API_ERRORS.inc(endpoint, code)
+        return code, payload
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info("📈 /metrics em http://%s:%s/metrics", host, port)
+    return server
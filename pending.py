@@ -0,0 +1,54 @@
+import time
+
+import db
+
+
+class PendingPrints:
+    """
+    Chats aguardando o print do depósito.
+
+    Fica salvo no SQLite (sobrevive a restart) com um índice em memória
+    para o `chat_id in PENDING` do caminho quente. Cada entrada expira
+    depois de `ttl` segundos. O índice é lido uma vez, no startup, pela
+    thread do db (`await load()`); depois disso nada aqui lê o banco, e
+    as escritas vão para a fila do db.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._index: dict[int, float] = {}
+
+    async def load(self) -> int:
+        """Carrega as pendências que ainda valem (apagando as vencidas)."""
+        self._index = dict(await db.run(db.load_pending_prints, time.time()))
+        return len(self._index)
+
+    def __contains__(self, chat_id: int) -> bool:
+        expires_at = self._index.get(chat_id)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            self.discard(chat_id)
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def add(self, chat_id: int) -> None:
+        expires_at = time.time() + self.ttl
+        self._index[chat_id] = expires_at
+        db.submit(db.add_pending_print, chat_id, expires_at)
+
+    def discard(self, chat_id: int) -> None:
+        if self._index.pop(chat_id, None) is not None:
+            db.submit(db.remove_pending_print, chat_id)
+
+    def prune(self) -> int:
+        """Remove os vencidos da memória e do banco. Retorna quantos saíram."""
+        now = time.time()
+        expired = [chat_id for chat_id, at in self._index.items() if at <= now]
+        for chat_id in expired:
+            del self._index[chat_id]
+        db.submit(db.prune_pending_prints, now)
+        return len(expired)
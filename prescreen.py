@@ -0,0 +1,106 @@
+"""
+Pré-triagem local e offline do print antes de chamar o gpt-4o.
+
+Só recusa o que claramente não é um print de tela: resolução baixa,
+proporção de meme/quadrado ou imagem quase lisa (em branco/preta). Foto
+de câmera passa: nas amostras rotuladas, a fração de áreas chapadas
+recusava extrato com muito texto e aceitava foto lisa, então ficou de
+fora. Na dúvida, deixa passar para o modelo.
+
+Avaliação com amostras rotuladas:
+
+    python prescreen.py amostras/
+
+onde amostras/ok/ tem prints de depósito válidos (devem passar) e
+amostras/junk/ tem o resto (devem ser recusados). Um conjunto sintético
+sai de `python loadtest.py --scenario prescreen --samples amostras/`.
+"""
+from __future__ import annotations
+
+import os
+import sys
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+MIN_LONG_SIDE = int(os.getenv("PRESCREEN_MIN_LONG_SIDE", "480"))
+MIN_ASPECT = float(os.getenv("PRESCREEN_MIN_ASPECT", "1.15"))
+MAX_ASPECT = float(os.getenv("PRESCREEN_MAX_ASPECT", "3.5"))
+MIN_STDDEV = float(os.getenv("PRESCREEN_MIN_STDDEV", "6"))
+
+_SAMPLE = 128  # lado da miniatura usada nas heurísticas
+
+
+@dataclass
+class Screening:
+    ok: bool
+    reason: str = ""
+
+
+def screen(img: Image.Image) -> Screening:
+    from PIL import ImageStat  # só no primeiro print: o boot não paga o Pillow
+
+    w, h = img.size
+    long_side, short_side = max(w, h), min(w, h)
+
+    if long_side < MIN_LONG_SIDE:
+        return Screening(False, "resolução baixa")
+
+    aspect = long_side / max(1, short_side)
+    if aspect < MIN_ASPECT or aspect > MAX_ASPECT:
+        return Screening(False, "formato não parece print de tela")
+
+    gray = img.convert("L").resize((_SAMPLE, _SAMPLE))
+    if ImageStat.Stat(gray).stddev[0] < MIN_STDDEV:
+        return Screening(False, "imagem em branco")
+
+    return Screening(True)
+
+
+def evaluate(root: str) -> dict:
+    """Roda a triagem em root/ok e root/junk e calcula precisão/recall."""
+    from PIL import Image
+
+    counts = {"tp": 0, "fn": 0, "fp": 0, "tn": 0}
+    for label in ("ok", "junk"):
+        folder = os.path.join(root, label)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            try:
+                with Image.open(os.path.join(folder, name)) as img:
+                    passed = screen(img).ok
+            except OSError:
+                continue
+            if label == "ok":
+                counts["tp" if passed else "fn"] += 1
+            else:
+                counts["fp" if passed else "tn"] += 1
+
+    escalated = counts["tp"] + counts["fp"]
+    valid = counts["tp"] + counts["fn"]
+    total = sum(counts.values())
+    return {
+        **counts,
+        # precisão: dos que iriam pro gpt-4o, quantos eram prints válidos
+        "precision": counts["tp"] / escalated if escalated else 0.0,
+        # recall: dos prints válidos, quantos passaram (o ideal é 1.0)
+        "recall": counts["tp"] / valid if valid else 0.0,
+        "calls_saved": counts["tn"] / total if total else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("uso: python prescreen.py PASTA_COM_ok_E_junk")
+    r = evaluate(sys.argv[1])
+    print(
+        f"ok→passou={r['tp']} ok→recusado={r['fn']} "
+        f"junk→passou={r['fp']} junk→recusado={r['tn']}"
+    )
+    print(
+        f"precisão={r['precision']:.2%} recall={r['recall']:.2%} "
+        f"chamadas evitadas={r['calls_saved']:.2%}"
+    )
@@ -0,0 +1,139 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine
+
+from telegram.ext import BaseRateLimiter
+
+HIGH = "high"
+LOW = "low"
+
+# Passe em rate_limit_args= nos envios agendados (follow-ups etc.)
+LOW_PRIORITY = {"priority": LOW}
+
+# Só métodos que entregam mensagem num chat contam para os limites
+_LIMITED_PREFIXES = ("send", "copy", "forward")
+
+
+class _PriorityGate:
+    """
+    Libera no máximo `rate` envios por segundo para todo o bot.
+    Quem está na fila HIGH sempre sai antes de quem está na LOW.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._lanes: dict[str, deque[asyncio.Future]] = {HIGH: deque(), LOW: deque()}
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def depth(self, lane: str) -> int:
+        return len(self._lanes[lane])
+
+    async def acquire(self, lane: str) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        fut = asyncio.get_running_loop().create_future()
+        self._lanes[lane].append(fut)
+        self._wakeup.set()
+        await fut
+
+    def _next(self) -> asyncio.Future | None:
+        for lane in (HIGH, LOW):
+            q = self._lanes[lane]
+            while q:
+                fut = q.popleft()
+                if not fut.done():
+                    return fut
+        return None
+
+    async def _run(self) -> None:
+        while True:
+            fut = self._next()
+            if fut is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            fut.set_result(None)
+            await asyncio.sleep(self.interval)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class OutboundRateLimiter(BaseRateLimiter[dict]):
+    """
+    Rate limiter de saída plugado no ApplicationBuilder().rate_limiter().
+
+    - Limite global (~30 msg/s no Telegram) com duas filas de prioridade:
+      respostas interativas (padrão) passam na frente dos envios marcados
+      com rate_limit_args=LOW_PRIORITY.
+    - Limite por chat (~1 msg/s no privado, 20/min em grupos), reservando
+      o próximo horário livre de cada chat.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 25,
+        chat_rate: float = 1,
+        group_rate: float = 20 / 60,
+    ):
+        self._gate = _PriorityGate(global_rate)
+        self._chat_interval = 1 / chat_rate
+        self._group_interval = 1 / group_rate
+        self._next_slot: dict[Any, float] = {}
+        self._last_cleanup = 0.0
+
+    def depth(self, lane: str) -> int:
+        return self._gate.depth(lane)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        await self._gate.close()
+
+    def _reserve_chat(self, chat_id: Any) -> float:
+        now = time.monotonic()
+        if now - self._last_cleanup > 60:
+            self._next_slot = {
+                k: v for k, v in self._next_slot.items() if v > now
+            }
+            self._last_cleanup = now
+
+        is_group = isinstance(chat_id, str) or (
+            isinstance(chat_id, int) and chat_id < 0
+        )
+        interval = self._group_interval if is_group else self._chat_interval
+        slot = max(self._next_slot.get(chat_id, now), now)
+        self._next_slot[chat_id] = slot + interval
+        return slot - now
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: dict | None,
+    ):
+        if not endpoint.startswith(_LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        chat_id = data.get("chat_id")
+        if chat_id is not None:
+            wait = self._reserve_chat(chat_id)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        lane = (rate_limit_args or {}).get("priority", HIGH)
+        await self._gate.acquire(lane)
+        return await callback(*args, **kwargs)
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+import metrics
+
+log = logging.getLogger("presente-vip-unificado.retry")
+
+# Tentativas por método da Bot API (inclui a primeira)
+DEFAULT_BUDGETS = {
+    "send_message": 4,
+    "send_photo": 3,
+    "send_audio": 3,
+    "send_video": 3,
+    "send_media_group": 2,
+}
+
+SHED_SENDS = metrics.REGISTRY.register(
+    metrics.Counter(
+        "bot_send_shed_total",
+        "Envios de baixa prioridade descartados com o circuito aberto",
+        ("method",),
+    )
+)
+
+
+class CircuitOpen(Exception):
+    """Bot API degradada: envio de baixa prioridade descartado."""
+
+
+def _seconds(value) -> float:
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+class CircuitBreaker:
+    """
+    Abre depois de `threshold` falhas de rede/timeout em `window` segundos
+    e fica aberto por `cooldown` segundos. Qualquer sucesso fecha.
+    """
+
+    def __init__(self, threshold: int = 10, window: float = 30, cooldown: float = 30):
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self._failures: deque[float] = deque()
+        self._open_until = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return time.monotonic() < self._open_until
+
+    def record_failure(self) -> None:
+        now = time.monotonic()
+        self._failures.append(now)
+        while self._failures and self._failures[0] < now - self.window:
+            self._failures.popleft()
+        if len(self._failures) >= self.threshold and not self.is_open:
+            self._open_until = now + self.cooldown
+            log.warning("⚡ Circuito da Bot API aberto por %ss", self.cooldown)
+
+    def record_success(self) -> None:
+        self._failures.clear()
+        self._open_until = 0.0
+
+
+class RetryPolicy:
+    """
+    - RetryAfter: espera o retry_after pedido pelo Telegram (se couber em
+      `max_retry_after`).
+    - TimedOut/NetworkError: backoff exponencial com jitter total.
+    - BadRequest/Forbidden/etc.: não adianta repetir, sobe na hora.
+    - Com o circuito aberto, envios de baixa prioridade nem são tentados.
+    """
+
+    def __init__(
+        self,
+        budgets: dict[str, int] | None = None,
+        default_budget: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8,
+        max_retry_after: float = 60,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.budgets = {**DEFAULT_BUDGETS, **(budgets or {})}
+        self.default_budget = default_budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.breaker = breaker or CircuitBreaker()
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def run(self, coro_factory, method: str, low_priority: bool = False):
+        if low_priority and self.breaker.is_open:
+            SHED_SENDS.inc(method)
+            raise CircuitOpen(method)
+
+        attempts = self.budgets.get(method, self.default_budget)
+        for attempt in range(attempts):
+            last_try = attempt == attempts - 1
+            try:
+                result = await coro_factory()
+            except RetryAfter as e:
+                wait = _seconds(e.retry_after)
+                if last_try or wait > self.max_retry_after:
+                    raise
+                metrics.SEND_RETRIES.inc(method, "RetryAfter")
+                await asyncio.sleep(wait + random.uniform(0, 0.5))
+            except BadRequest:
+                raise
+            except NetworkError as e:  # inclui TimedOut
+                self.breaker.record_failure()
+                if last_try or (low_priority and self.breaker.is_open):
+                    raise
+                metrics.SEND_RETRIES.inc(method, type(e).__name__)
+                await asyncio.sleep(self._backoff(attempt))
+            else:
+                self.breaker.record_success()
+                return result
@@ -0,0 +1,99 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable
+
+import db
+
+log = logging.getLogger("presente-vip-unificado.scheduler")
+
+FollowupHandler = Callable[[object, int], Awaitable[None]]
+
+
+class FollowupScheduler:
+    """
+    Follow-ups do funil salvos no SQLite (tabela followups).
+
+    Em memória fica só um heap de (due_at, chat_id, step) e um dict para
+    dedupe por (chat_id, step) — bem mais leve que um Job por usuário.
+    Um tick periódico dispara os vencidos em lotes; no startup os que
+    venceram durante o downtime saem nos primeiros ticks.
+    """
+
+    def __init__(self, batch_size: int = 200):
+        self.batch_size = batch_size
+        self._handlers: dict[str, FollowupHandler] = {}
+        self._heap: list[tuple[float, int, str]] = []
+        self._due: dict[tuple[int, str], float] = {}
+        self._loaded = False
+
+    def register(self, step: str, handler: FollowupHandler) -> None:
+        self._handlers[step] = handler
+
+    def load(self) -> int:
+        self._heap = db.load_followups()
+        heapq.heapify(self._heap)
+        self._due = {(chat_id, step): due for due, chat_id, step in self._heap}
+        self._loaded = True
+        return len(self._due)
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def is_scheduled(self, chat_id: int, step: str) -> bool:
+        return (chat_id, step) in self._due
+
+    def schedule(self, chat_id: int, step: str, delay: float) -> bool:
+        """Agenda o passo; se já houver um igual pendente, não faz nada."""
+        if not self._loaded:
+            self.load()
+        key = (chat_id, step)
+        if key in self._due:
+            return False
+        due_at = time.time() + delay
+        self._due[key] = due_at
+        heapq.heappush(self._heap, (due_at, chat_id, step))
+        db.submit(db.add_followup, chat_id, step, due_at)
+        return True
+
+    def cancel(self, chat_id: int, step: str) -> None:
+        # o item fica no heap e é ignorado quando vencer (remoção preguiçosa)
+        if self._due.pop((chat_id, step), None) is not None:
+            db.submit(db.remove_followups, [(chat_id, step)])
+
+    def _pop_due(self, now: float) -> list[tuple[int, str]]:
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+            due_at, chat_id, step = heapq.heappop(self._heap)
+            if self._due.get((chat_id, step)) != due_at:
+                continue  # cancelado ou reagendado
+            del self._due[(chat_id, step)]
+            batch.append((chat_id, step))
+        return batch
+
+    async def _fire(self, context, chat_id: int, step: str) -> None:
+        handler = self._handlers.get(step)
+        if handler is None:
+            log.warning("Follow-up sem handler: %s", step)
+            return
+        try:
+            await handler(context, chat_id)
+        except Exception as e:
+            log.warning("Follow-up %s para %s falhou: %s", step, chat_id, e)
+
+    async def tick(self, context) -> int:
+        """Dispara tudo que venceu, em lotes. Retorna quantos saíram."""
+        if not self._loaded:
+            self.load()
+        fired = 0
+        while True:
+            batch = self._pop_due(time.time())
+            if not batch:
+                return fired
+            # remove antes de disparar: um handler pode reagendar o mesmo passo
+            db.submit(db.remove_followups, batch)
+            await asyncio.gather(
+                *(self._fire(context, chat_id, step) for chat_id, step in batch)
+            )
+            fired += len(batch)
@@ -0,0 +1,153 @@
+import functools
+import logging
+import os
+import runpy
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import funnel
+from scheduler import FollowupScheduler
+
+log = logging.getLogger("presente-vip-unificado.sequencer")
+
+SEQUENCES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sequences.py")
+
+SendFn = Callable[[object, int, dict], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class CompiledStep:
+    id: str
+    sequence: str
+    delay: float
+    payload: dict  # kwargs prontos para bot.send_message
+    while_stage: str | None
+    advance_to: str | None
+
+
+def compile_step(sequence: str, step) -> CompiledStep:
+    if not step.id or not step.text:
+        raise ValueError(f"{sequence}: passo sem id ou sem texto")
+    if step.delay_seconds < 0:
+        raise ValueError(f"{sequence}/{step.id}: delay negativo")
+    for stage in (step.while_stage, step.advance_to):
+        if stage is not None and stage not in funnel.STAGES:
+            raise ValueError(f"{sequence}/{step.id}: estágio desconhecido {stage!r}")
+
+    payload = {"text": step.text}
+    if step.parse_mode:
+        payload["parse_mode"] = step.parse_mode
+    if step.buttons:
+        rows = []
+        for b in step.buttons:
+            if (b.callback is None) == (b.url is None):
+                raise ValueError(f"{sequence}/{step.id}: botão precisa de callback ou url")
+            rows.append([InlineKeyboardButton(b.text, callback_data=b.callback, url=b.url)])
+        payload["reply_markup"] = InlineKeyboardMarkup(rows)
+
+    return CompiledStep(
+        id=step.id,
+        sequence=sequence,
+        delay=float(step.delay_seconds),
+        payload=payload,
+        while_stage=step.while_stage,
+        advance_to=step.advance_to,
+    )
+
+
+def compile_sequences(sequences: dict) -> dict[str, list[CompiledStep]]:
+    """Valida e pré-monta tudo; qualquer erro invalida o arquivo inteiro."""
+    compiled: dict[str, list[CompiledStep]] = {}
+    seen: set[str] = set()
+    for name, steps in sequences.items():
+        compiled[name] = []
+        for step in steps:
+            if step.id in seen:
+                raise ValueError(f"id de passo repetido: {step.id}")
+            seen.add(step.id)
+            compiled[name].append(compile_step(name, step))
+    return compiled
+
+
+class SequenceEngine:
+    """
+    Executa as sequências de sequences.py em cima do FollowupScheduler.
+
+    Cada passo vira um follow-up com chave = id do passo, então o
+    agendamento é durável do mesmo jeito. Texto e teclado são montados
+    uma vez por carga do arquivo; no disparo só sai o send_message.
+
+    `reload_if_changed()` relê o arquivo quando o mtime muda. Os timers
+    pendentes não são tocados: quando vencem, usam a versão atual do
+    passo. Arquivo com erro é ignorado e a versão anterior continua.
+    """
+
+    def __init__(
+        self,
+        scheduler: FollowupScheduler,
+        funnel_: funnel.Funnel,
+        send: SendFn,
+        path: str = SEQUENCES_FILE,
+    ):
+        self.scheduler = scheduler
+        self.funnel = funnel_
+        self.send = send
+        self.path = path
+        self._sequences: dict[str, list[CompiledStep]] = {}
+        self._steps: dict[str, CompiledStep] = {}
+        self._mtime: int | None = None
+
+    def load(self) -> int:
+        """Carrega o arquivo. Levanta exceção se ele estiver inválido."""
+        mtime = os.stat(self.path).st_mtime_ns
+        compiled = compile_sequences(runpy.run_path(self.path)["SEQUENCES"])
+        self._sequences = compiled
+        self._steps = {s.id: s for steps in compiled.values() for s in steps}
+        self._mtime = mtime
+        for step_id in self._steps:
+            self.scheduler.register(step_id, functools.partial(self._fire, step_id))
+        return len(self._steps)
+
+    def reload_if_changed(self) -> bool:
+        try:
+            if os.stat(self.path).st_mtime_ns == self._mtime:
+                return False
+            n = self.load()
+        except Exception as e:
+            log.warning("sequences.py inválido, mantendo a versão anterior: %s", e)
+            # não tenta de novo até o arquivo mudar outra vez
+            try:
+                self._mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                pass
+            return False
+        log.info("Sequências recarregadas: %s passos", n)
+        return True
+
+    def start(self, chat_id: int, name: str) -> int:
+        """Agenda todos os passos da sequência (delays contados de agora)."""
+        if not self._sequences:
+            self.load()
+        scheduled = 0
+        for step in self._sequences[name]:
+            scheduled += self.scheduler.schedule(chat_id, step.id, step.delay)
+        return scheduled
+
+    def cancel(self, chat_id: int, name: str) -> None:
+        for step in self._sequences.get(name, ()):
+            self.scheduler.cancel(chat_id, step.id)
+
+    async def _fire(self, step_id: str, context, chat_id: int) -> None:
+        step = self._steps.get(step_id)
+        if step is None:
+            log.warning("Passo %s saiu de sequences.py; follow-up de %s descartado", step_id, chat_id)
+            return
+        if step.while_stage is not None:
+            await self.funnel.load(chat_id)
+            if self.funnel.stage(chat_id) != step.while_stage:
+                return  # o chat já andou no funil
+        await self.send(context, chat_id, step.payload)
+        if step.advance_to is not None:
+            self.funnel.advance(chat_id, step.advance_to)
@@ -1,10 +1,61 @@
 from dataclasses import dataclass
 
+# Arquivo recarregado em tempo de execução (sequencer.SequenceEngine):
+# editou a copy ou um delay aqui, o bot pega a mudança sem restart.
+# Follow-ups já agendados continuam valendo e saem com o texto novo.
+# Não renomeie o id de um passo com follow-ups pendentes: ele é a chave
+# na tabela followups e um id que sumiu é descartado quando vencer.
+
+
+@dataclass
+class Button:
+    text: str
+    callback: str | None = None
+    url: str | None = None
+
+
 @dataclass
 class Step:
     id: str
     delay_seconds: int
     text: str
+    buttons: tuple[Button, ...] = ()
+    parse_mode: str | None = None
+    # só envia se o chat ainda estiver nesse estágio do funil (funnel.py)
+    while_stage: str | None = None
+    # estágio para onde o chat vai depois do envio
+    advance_to: str | None = None
+
+
+# Depois das boas-vindas do /start: pergunta se já criou a conta
+START_SEQUENCE = [
+    Step(
+        id="start_followup",
+        delay_seconds=60,
+        text="Eae, já conseguiu finalizar a criação da sua conta?",
+        buttons=(Button("✅ SIM", callback="confirm_sim"),),
+        while_stage="img1",
+        advance_to="followup",
+    ),
+]
+
+# Pediu o print do depósito e sumiu
+VIP_SEQUENCE = [
+    Step(
+        id="vip_followup",
+        delay_seconds=7 * 60,
+        text=(
+            "Eii, tá por aí? Não sei se você esqueceu, mas são pelo menos R$500 sorteados "
+            "para 10 pessoas + 1 chance na roleta que pode te dar até um IPHONE 17 PRO HOJE!"
+        ),
+        buttons=(
+            Button("🖼️ PRINT = LIBERAR VIP", callback="vip_print"),
+            Button("💳 FAZER DEPÓSITO", callback="vip_depositar"),
+        ),
+        parse_mode="Markdown",
+        while_stage="pending_print",
+    ),
+]
 
 # Ajuste a copy conforme sua comunidade
 WELCOME_SEQUENCE = [
@@ -19,3 +70,9 @@ WELCOME_SEQUENCE = [
         "📚 Conteúdo recomendado inicial: Guia Rápido e Canal de Anúncios. Precisa de ajuda para configurar?"
     )),
 ]
+
+SEQUENCES = {
+    "start": START_SEQUENCE,
+    "vip": VIP_SEQUENCE,
+    "welcome": WELCOME_SEQUENCE,
+}
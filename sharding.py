@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import signal
+import threading
+import time
+
+from telegram import Bot, Update
+
+import db
+import webhook
+
+log = logging.getLogger("presente-vip-unificado.sharding")
+
+
+def route_chat_id(data: dict) -> int:
+    """
+    Descobre de qual chat (conversa privada com o usuário) é o update.
+    Join request vai pelo user_chat_id, que é onde o funil continua.
+    """
+    req = data.get("chat_join_request")
+    if req:
+        return req.get("user_chat_id") or req["from"]["id"]
+
+    cq = data.get("callback_query")
+    if cq:
+        msg = cq.get("message") or {}
+        return (msg.get("chat") or {}).get("id") or cq["from"]["id"]
+
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        msg = data.get(key)
+        if msg:
+            return msg["chat"]["id"]
+
+    for value in data.values():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("user")
+            if sender:
+                return sender["id"]
+    return 0
+
+
+# ====== Worker ======
+def _worker_main(index: int, shards: int, queue) -> None:
+    # Ctrl+C chega no grupo todo; quem encerra o worker é o front (sentinela None)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.environ["SHARD_COUNT"] = str(shards)
+    os.environ["SHARD_INDEX"] = str(index)
+    base_port = int(os.getenv("METRICS_PORT", "9100"))
+    if base_port:
+        os.environ["METRICS_PORT"] = str(base_port + 1 + index)
+
+    db.SHARD_COUNT = shards
+    db.SHARD_INDEX = index
+
+    import app as bot_app  # importado já com o shard no ambiente
+
+    asyncio.run(_worker_loop(bot_app.build_app(), queue, index))
+
+
+async def _worker_loop(app, queue, index: int) -> None:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+
+    def feed(data: dict) -> None:
+        app.update_queue.put_nowait(Update.de_json(data, app.bot))
+
+    def reader() -> None:
+        while True:
+            data = queue.get()
+            if data is None:
+                loop.call_soon_threadsafe(stop.set)
+                return
+            loop.call_soon_threadsafe(feed, data)
+
+    async with webhook.running(app):
+        threading.Thread(target=reader, name="shard-reader", daemon=True).start()
+        log.info("🧩 Worker %s pronto", index)
+        await stop.wait()
+
+
+# ====== Front ======
+class WorkerCrashLoop(RuntimeError):
+    pass
+
+
+class ShardRouter:
+    """
+    Manda cada update para a fila do worker dono do chat (ordem preservada).
+
+    `supervise()` reinicia worker que morreu. A fila dele é trocada por uma
+    nova: o Queue.get() bloqueado segura o lock de leitura, então a fila de
+    um processo morto não pode ser reaproveitada — o que estava nela se
+    perde e vai para o log. Mais de `max_restarts` mortes em
+    `restart_window` segundos levanta WorkerCrashLoop.
+    """
+
+    def __init__(self, shards: int, max_restarts: int = 3, restart_window: float = 60):
+        self._ctx = mp.get_context("spawn")
+        self.shards = shards
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.queues = [self._ctx.Queue() for _ in range(shards)]
+        self.procs = [self._spawn(i) for i in range(shards)]
+        self._deaths: list[list[float]] = [[] for _ in range(shards)]
+        self._stopping = False
+
+    def _spawn(self, index: int):
+        return self._ctx.Process(
+            target=_worker_main,
+            args=(index, self.shards, self.queues[index]),
+            name=f"shard-{index}",
+        )
+
+    def start(self) -> None:
+        for p in self.procs:
+            p.start()
+
+    def route(self, data: dict) -> None:
+        shard = db.shard_of(route_chat_id(data), self.shards)
+        self.queues[shard].put(data)
+
+    def supervise(self) -> None:
+        if self._stopping:
+            return
+        now = time.monotonic()
+        for i, p in enumerate(self.procs):
+            if p.is_alive():
+                continue
+            deaths = [t for t in self._deaths[i] if now - t < self.restart_window] + [now]
+            self._deaths[i] = deaths
+            try:
+                lost = self.queues[i].qsize()
+            except NotImplementedError:  # macOS
+                lost = -1
+            log.error(
+                "🧩 Worker %s morreu (exit %s); ~%s updates na fila dele perdidos",
+                i, p.exitcode, lost,
+            )
+            if len(deaths) > self.max_restarts:
+                raise WorkerCrashLoop(
+                    f"worker {i} morreu {len(deaths)} vezes em {self.restart_window:.0f}s"
+                )
+            self.queues[i].close()
+            self.queues[i] = self._ctx.Queue()
+            self.procs[i] = self._spawn(i)
+            self.procs[i].start()
+            log.warning("🧩 Worker %s reiniciado", i)
+
+    def stop(self) -> None:
+        self._stopping = True
+        for q in self.queues:
+            q.put(None)
+        for p in self.procs:
+            p.join(timeout=30)
+            if p.is_alive():
+                p.terminate()
+
+
+async def _poll(bot: Bot, router: ShardRouter, stop: asyncio.Event) -> None:
+    await bot.delete_webhook(drop_pending_updates=True)
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = await bot.do_api_request(
+                "getUpdates",
+                api_kwargs={"offset": offset, "timeout": 25},
+                read_timeout=35,
+            )
+        except Exception as e:
+            log.warning("getUpdates falhou: %s", e)
+            await asyncio.sleep(1)
+            continue
+        for data in updates:
+            offset = data["update_id"] + 1
+            router.route(data)
+
+
+async def _supervise(router: ShardRouter, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        await asyncio.sleep(1)
+        router.supervise()
+
+
+async def run_front(
+    token: str,
+    shards: int,
+    mode: str = "polling",
+    *,
+    listen: str = "0.0.0.0",
+    port: int = 8080,
+    path: str = "telegram",
+    secret: str = "",
+    max_connections: int = 40,
+    webhook_url: str = "",
+    bot_api: dict | None = None,
+) -> None:
+    """
+    Processo da frente: recebe updates (polling ou webhook) e distribui
+    por chat_id entre `shards` processos worker, cada um com seu event
+    loop e sua Application. `bot_api` são os kwargs do Bot (request,
+    base_url, base_file_url) que os workers também usam.
+    """
+    router = ShardRouter(shards)
+    router.start()
+    stop = webhook.stop_event()
+    supervisor = asyncio.create_task(_supervise(router, stop))
+    # worker em crash loop derruba o front (e o supervisor do deploy reinicia tudo)
+    supervisor.add_done_callback(lambda _: stop.set())
+    bot = Bot(token, **(bot_api or {}))
+    try:
+        async with bot:
+            if mode == "webhook":
+                server = webhook.WebhookServer(router.route, path, secret, max_connections)
+                await server.start(listen, port)
+                if webhook_url:
+                    await webhook.set_webhook(bot, webhook_url, server)
+                try:
+                    await stop.wait()
+                finally:
+                    await server.stop()
+            else:
+                poll = asyncio.create_task(_poll(bot, router, stop))
+                await stop.wait()
+                poll.cancel()
+    finally:
+        supervisor.cancel()
+        await asyncio.gather(supervisor, return_exceptions=True)
+        await asyncio.to_thread(router.stop)
+    if not supervisor.cancelled() and supervisor.exception() is not None:
+        raise supervisor.exception()
@@ -0,0 +1,123 @@
+import json
+import re
+from dataclasses import dataclass, field
+
+# Formato estruturado pedido ao modelo (Responses API, strict=True):
+# ele só extrai os campos; quem decide aprovado/reprovado é o código.
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "valor": {"type": ["number", "null"]},
+        "data": {"type": "string"},
+        "hora": {"type": "string"},
+        "status": {
+            "type": "string",
+            "enum": ["concluido", "pendente", "cancelado", "falhou", "ilegivel"],
+        },
+    },
+    "required": ["valor", "data", "hora", "status"],
+    "additionalProperties": False,
+}
+
+TEXT_FORMAT = {
+    "format": {
+        "type": "json_schema",
+        "name": "deposito",
+        "schema": SCHEMA,
+        "strict": True,
+    }
+}
+
+PROMPT = (
+    "Analise APENAS o item de Depósito que está expandido (seta para cima). "
+    "Extraia: valor em reais (número, null se não der para ler), "
+    "data no formato DD.MM.AA (vazio se não der para ler), hora HH:MM e status. "
+    "Use status 'ilegivel' se não houver um depósito expandido na imagem."
+)
+
+_STATUS_LABELS = {
+    "concluido": "Concluído",
+    "pendente": "Pendente",
+    "cancelado": "Cancelado",
+    "falhou": "Falhou",
+    "ilegivel": "Não identificado",
+}
+
+_DATE_RE = re.compile(r"(\d{1,2})\s*[./-]\s*(\d{1,2})\s*[./-]\s*(\d{2,4})")
+
+
+@dataclass(frozen=True)
+class Receipt:
+    valor: float | None
+    data: str
+    hora: str
+    status: str
+
+
+@dataclass
+class Verdict:
+    approved: bool
+    reasons: list[str] = field(default_factory=list)
+
+
+def normalize_date(raw: str) -> str:
+    """'5/3/2025', '05.03.25', '05-03-2025' -> '05.03.25' (formato do today_str)."""
+    m = _DATE_RE.search(raw or "")
+    if not m:
+        return ""
+    d, mth, y = m.groups()
+    return f"{int(d):02d}.{int(mth):02d}.{y[-2:]}"
+
+
+def parse(text: str) -> Receipt | None:
+    """Lê o JSON do modelo. Retorna None se vier quebrado ou fora do schema."""
+    try:
+        data = json.loads(text)
+        valor = data["valor"]
+        status = data["status"]
+        if valor is not None:
+            valor = float(valor)
+        if status not in _STATUS_LABELS:
+            return None
+        return Receipt(
+            valor=valor,
+            data=normalize_date(str(data["data"])),
+            hora=str(data["hora"]).strip(),
+            status=status,
+        )
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def evaluate(receipt: Receipt, min_value: float, day: str) -> Verdict:
+    """Regras de aprovação, aplicadas localmente sobre os campos extraídos."""
+    reasons = []
+    if receipt.status == "ilegivel":
+        reasons.append("não encontrei o depósito expandido no print")
+    elif receipt.status != "concluido":
+        reasons.append(f"status {_STATUS_LABELS[receipt.status]}, precisa estar Concluído")
+    if receipt.valor is None:
+        reasons.append("não consegui ler o valor")
+    elif receipt.valor < min_value:
+        reasons.append(f"valor abaixo de R${min_value:.0f}")
+    if not receipt.data:
+        reasons.append("não consegui ler a data")
+    elif receipt.data != day:
+        reasons.append(f"depósito não é de hoje ({day})")
+    return Verdict(approved=not reasons, reasons=reasons)
+
+
+def render(receipt: Receipt, verdict: Verdict) -> str:
+    """Texto curto para o usuário, montado a partir dos campos."""
+    valor = f"R${receipt.valor:.2f}".replace(".", ",") if receipt.valor is not None else "?"
+    when = " ".join(p for p in (receipt.data, receipt.hora) if p) or "?"
+    lines = [
+        f"- Valor: {valor}",
+        f"- Data/hora: {when}",
+        f"- Status: {_STATUS_LABELS[receipt.status]}",
+    ]
+    if verdict.approved:
+        lines.append("- Resultado: Aprovado ✅")
+    else:
+        lines.append("- Resultado: Reprovado ❌ (" + "; ".join(verdict.reasons) + ")")
+    return "\n".join(lines)
@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class _Entry:
+    day: str
+    expires_at: float
+    verdict: Any
+
+
+def dhash(img, size: int = 8) -> str:
+    """
+    Hash perceptual (dHash) de 64 bits em hex.
+    Prints iguais reenviados/encaminhados dão o mesmo hash (ou muito próximo).
+    """
+    gray = img.convert("L").resize((size + 1, size))
+    px = list(gray.getdata())
+    bits = 0
+    for row in range(size):
+        base = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (px[base + col] > px[base + col + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+class VerdictCache:
+    """
+    Cache de veredictos em dois níveis, sempre por chat:
+    - file_unique_id do Telegram (evita até o download)
+    - hash perceptual da imagem (pega quase-duplicatas)
+
+    Cada entrada guarda o dia (today_str) em que foi criada e só vale
+    nesse mesmo dia, além do TTL. Tamanho limitado com descarte LRU.
+    """
+
+    def __init__(self, ttl: float, maxsize: int, max_distance: int = 4):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.max_distance = max_distance
+        self._by_file: OrderedDict[tuple[int, str], _Entry] = OrderedDict()
+        self._by_hash: OrderedDict[int, list[tuple[str, _Entry]]] = OrderedDict()
+
+    def _valid(self, entry: _Entry, day: str) -> bool:
+        return entry.day == day and entry.expires_at > time.monotonic()
+
+    def get_by_file(self, chat_id: int, file_unique_id: str, day: str):
+        key = (chat_id, file_unique_id)
+        entry = self._by_file.get(key)
+        if entry is None:
+            return None
+        if not self._valid(entry, day):
+            del self._by_file[key]
+            return None
+        self._by_file.move_to_end(key)
+        return entry.verdict
+
+    def get_by_hash(self, chat_id: int, phash: str, day: str):
+        items = self._by_hash.get(chat_id)
+        if not items:
+            return None
+        items[:] = [(h, e) for h, e in items if self._valid(e, day)]
+        if not items:
+            del self._by_hash[chat_id]
+            return None
+        self._by_hash.move_to_end(chat_id)
+        best = min(items, key=lambda it: hamming(it[0], phash))
+        if hamming(best[0], phash) <= self.max_distance:
+            return best[1].verdict
+        return None
+
+    def put(
+        self,
+        chat_id: int,
+        day: str,
+        verdict: Any,
+        file_unique_id: str | None = None,
+        phash: str | None = None,
+    ) -> None:
+        entry = _Entry(day=day, expires_at=time.monotonic() + self.ttl, verdict=verdict)
+
+        if file_unique_id:
+            key = (chat_id, file_unique_id)
+            self._by_file[key] = entry
+            self._by_file.move_to_end(key)
+            while len(self._by_file) > self.maxsize:
+                self._by_file.popitem(last=False)
+
+        if phash:
+            items = self._by_hash.setdefault(chat_id, [])
+            items[:] = [(h, e) for h, e in items if h != phash]
+            items.append((phash, entry))
+            del items[:-8]  # poucos prints por chat bastam
+            self._by_hash.move_to_end(chat_id)
+            while len(self._by_hash) > self.maxsize:
+                self._by_hash.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._by_file) + sum(len(v) for v in self._by_hash.values())
@@ -0,0 +1,153 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+import sys
+import urllib.request
+from contextlib import asynccontextmanager
+
+from telegram import Update
+
+log = logging.getLogger("presente-vip-unificado.webhook")
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY = 1 << 20  # updates são pequenos; 1 MiB é folga
+
+
+class WebhookServer:
+    """
+    Servidor aiohttp embutido que recebe os updates do Telegram.
+
+    Confere o secret token, entrega o update para quem chamou (a fila da
+    Application ou o roteador dos shards) e responde 200 na hora: o
+    processamento não segura a resposta HTTP. Corpo acima de MAX_BODY
+    leva 413, JSON inválido 400, outro caminho 404. `max_connections`
+    vai para o setWebhook: é o Telegram que limita as conexões abertas.
+    """
+
+    def __init__(self, on_update, path: str, secret: str, max_connections: int = 40):
+        self.on_update = on_update
+        self.path = "/" + path.lstrip("/")
+        self.secret = secret
+        self.max_connections = max_connections
+        self._runner = None
+
+    async def start(self, host: str, port: int) -> None:
+        from aiohttp import web  # só no modo webhook: o polling não paga o import
+
+        server = web.Application(client_max_size=MAX_BODY)
+        server.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(server, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        log.info("🌐 Webhook ouvindo em http://%s:%s%s", host, port, self.path)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        token = request.headers.get(SECRET_HEADER, "").encode()
+        if not hmac.compare_digest(token, self.secret.encode()):
+            return web.Response(status=403)
+        try:
+            data = json.loads(await request.read())
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            self.on_update(data)
+        except Exception as e:
+            log.warning("Update inválido recebido no webhook: %s", e)
+        return web.Response(status=200)
+
+
+@asynccontextmanager
+async def running(app):
+    """
+    Ciclo de vida da Application sem o Updater, com os mesmos hooks do
+    run_polling (post_init/post_stop/post_shutdown). Os updates são
+    colocados direto em app.update_queue por quem estiver de fora.
+    """
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    try:
+        yield app
+    finally:
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def stop_event() -> asyncio.Event:
+    """Evento que dispara no SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    return stop
+
+
+async def set_webhook(bot, webhook_url: str, server: WebhookServer) -> None:
+    """
+    Único lugar que registra o webhook. Não descarta os updates pendentes:
+    o que chegou durante um restart é entregue depois. Com várias
+    instâncias atrás do mesmo endpoint o secret é o mesmo em todas, então
+    registrar de novo não tira as outras do ar.
+    """
+    await bot.set_webhook(
+        url=webhook_url.rstrip("/") + server.path,
+        secret_token=server.secret,
+        max_connections=server.max_connections,
+    )
+
+
+async def serve(app, *, listen, port, path, secret, max_connections, webhook_url=None):
+    stop = stop_event()
+
+    def on_update(data: dict) -> None:
+        app.update_queue.put_nowait(Update.de_json(data, app.bot))
+
+    server = WebhookServer(on_update, path, secret, max_connections)
+
+    async with running(app):
+        await server.start(listen, port)
+        if webhook_url:
+            await set_webhook(app.bot, webhook_url, server)
+        try:
+            await stop.wait()
+        finally:
+            await server.stop()
+
+
+def post_updates(path: str, url: str, secret: str | None = None) -> None:
+    """Reenvia updates gravados (um JSON por linha) para um webhook local."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            req = urllib.request.Request(url, data=line.encode("utf-8"), method="POST")
+            req.add_header("Content-Type", "application/json")
+            if secret:
+                req.add_header(SECRET_HEADER, secret)
+            with urllib.request.urlopen(req) as resp:
+                print(resp.status, line[:80])
+
+
+if __name__ == "__main__":
+    # python webhook.py updates.jsonl http://127.0.0.1:8080/telegram [secret]
+    if len(sys.argv) < 3:
+        sys.exit("uso: python webhook.py ARQUIVO.jsonl URL [SECRET]")
+    post_updates(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)